@@ -0,0 +1,141 @@
+"""End-to-end runs of `vecrv fetch-addresses` and `vecrv fetch-balances`
+against `benchmarks.mock_rpc`
+
+The mock node rate limits requests, with 429 responses and with JSON-RPC
+errors, reverts aggregated calls and rejects oversized log ranges, so a run
+exercises the retries of `BatchRPCClient`, the fallback of `SnapshotReader`
+to single calls and the range splitting of `LogScanner`. Every fetch is run
+twice with the same checkpoint file, the second run must not send the
+requests of the first one again, and the addresses scanned up to a block
+below the snapshot are resumed up to the snapshot, then scanned again up to
+that block from the checkpoint alone. The outputs are compared with the data
+of the mock node and a JSON report is printed, the command exits with an
+error if a check fails.
+
+Usage: python -m benchmarks.fetch_mock
+"""
+
+import gzip
+import json
+import os
+import sys
+import tempfile
+from typing import Set
+
+from conicfinance import vecrv
+from conicfinance.snapshot_file import load_snapshot
+
+from benchmarks.mock_rpc import MockNode, run_in_thread
+
+EVENT_TYPE = "airdrop-boost"
+
+
+def read_addresses(path: str) -> Set[str]:
+    with gzip.open(path, "rt") as f:
+        return {line.strip() for line in f}
+
+
+def run_vecrv(*argv: str):
+    args = vecrv.parser.parse_args(["-t", EVENT_TYPE, *argv])
+    if args.command == "fetch-addresses":
+        vecrv.fetch_addresses(args)
+    else:
+        vecrv.fetch_balances(args)
+
+
+def get_expected_addresses(node: MockNode, end_block: int) -> Set[str]:
+    start_block = vecrv.get_start_block(EVENT_TYPE)
+    blocks = node.get_log_blocks(start_block, end_block)
+    return {node.get_depositor(block) for block in blocks}
+
+
+def run_checks(node: MockNode, directory: str) -> dict:
+    checks = {}
+    checkpoint = os.path.join(directory, "checkpoint.sqlite")
+    addresses_file = os.path.join(directory, "addresses.txt.gz")
+    balances_file = os.path.join(directory, "balances.json.gz")
+    snapshot_block = vecrv.get_snapshot_block(EVENT_TYPE)
+    middle_block = (vecrv.get_start_block(EVENT_TYPE) + snapshot_block) // 2
+
+    run_vecrv(
+        "fetch-addresses",
+        "-o",
+        addresses_file,
+        "--block",
+        str(middle_block),
+        "--checkpoint",
+        checkpoint,
+    )
+    checks["partial_addresses"] = read_addresses(
+        addresses_file
+    ) == get_expected_addresses(node, middle_block)
+
+    ranges_count = len(node.log_ranges)
+    run_vecrv("fetch-addresses", "-o", addresses_file, "--checkpoint", checkpoint)
+    resumed_ranges = node.log_ranges[ranges_count:]
+    checks["resumed_after_checkpoint"] = bool(resumed_ranges) and all(
+        start > middle_block for start, _ in resumed_ranges
+    )
+    addresses = read_addresses(addresses_file)
+    checks["addresses"] = addresses == get_expected_addresses(node, snapshot_block)
+
+    ranges_count = len(node.log_ranges)
+    run_vecrv("fetch-addresses", "-o", addresses_file, "--checkpoint", checkpoint)
+    checks["addresses_rerun_from_checkpoint"] = len(node.log_ranges) == ranges_count
+
+    # values found after a lower block must not be returned from the checkpoint
+    partial_file = os.path.join(directory, "partial-addresses.txt.gz")
+    run_vecrv(
+        "fetch-addresses",
+        "-o",
+        partial_file,
+        "--block",
+        str(middle_block),
+        "--checkpoint",
+        checkpoint,
+    )
+    checks["lower_block_from_checkpoint"] = len(
+        node.log_ranges
+    ) == ranges_count and read_addresses(partial_file) == get_expected_addresses(
+        node, middle_block
+    )
+
+    balances_args = ["-o", balances_file, "--checkpoint", checkpoint]
+    run_vecrv("fetch-balances", addresses_file, *balances_args)
+    balances = {account["address"]: account for account in load_snapshot(balances_file)}
+    checks["balances"] = balances.keys() == addresses and all(
+        int(account["balance"]) == node.balance_of(vecrv.VECRV_ADDRESS, address)
+        and account["is_eoa"] == (not node.has_code(address))
+        for address, account in balances.items()
+    )
+
+    calls_count = node.stats["eth_call"] + node.stats["eth_getCode"]
+    run_vecrv("fetch-balances", addresses_file, *balances_args)
+    checks["balances_rerun_from_checkpoint"] = (
+        node.stats["eth_call"] + node.stats["eth_getCode"] == calls_count
+    )
+
+    # the failures must have been injected for the checks above to mean anything
+    checks["rate_limited"] = node.stats["rate_limited"] > 0
+    checks["error_rate_limited"] = node.stats["error_rate_limited"] > 0
+    checks["reverted_aggregates"] = node.stats["reverted_aggregates"] > 0
+    checks["range_errors"] = node.stats["range_errors"] > 0
+    return checks
+
+
+def main():
+    node = MockNode()
+    # responses must come from the mock node, not from a local cache
+    os.environ.pop("ETH_RPC_CACHE", None)
+    with run_in_thread(node) as url, tempfile.TemporaryDirectory() as directory:
+        os.environ["ETH_RPC_URL"] = url
+        checks = run_checks(node, directory)
+
+    report = {"ok": all(checks.values()), "checks": checks, "mock": dict(node.stats)}
+    print(json.dumps(report, indent=2))
+    if not report["ok"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
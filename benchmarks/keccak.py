@@ -0,0 +1,76 @@
+"""Compare the packed keccak backend against the original solidityKeccak path
+
+Usage: python -m benchmarks.keccak [-s 10000 100000 1000000]
+"""
+
+import argparse
+import os
+import time
+
+from web3 import Web3
+
+from conicfinance.merkle.tree import generate_merkle_tree
+
+
+def legacy_compute_hash(user):
+    if isinstance(user, str):
+        address = Web3.toChecksumAddress(user)
+        return Web3.solidityKeccak(["address"], [address])
+    else:
+        address = Web3.toChecksumAddress(user["address"])
+        value = int(user["value"])
+        return Web3.solidityKeccak(["address", "uint256"], [address, value])
+
+
+def legacy_generate_merkle_tree(users):
+    leaves = [legacy_compute_hash(user) for user in users]
+    while len(leaves) > 1:
+        if len(leaves) % 2 == 1:
+            leaves.append(Web3.solidityKeccak(["uint256"], [0]))
+        new_leaves = []
+        for i in range(0, len(leaves), 2):
+            new_leaves.append(
+                Web3.solidityKeccak(["bytes32", "bytes32"], [leaves[i], leaves[i + 1]])
+            )
+        leaves = new_leaves
+    return leaves[0]
+
+
+def random_users(count):
+    return [
+        {
+            "address": "0x" + os.urandom(20).hex(),
+            "value": str(int.from_bytes(os.urandom(10), "big")),
+        }
+        for _ in range(count)
+    ]
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="benchmarks.keccak")
+    parser.add_argument(
+        "-s", "--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000]
+    )
+    args = parser.parse_args()
+
+    print(f"{'leaves':>10} {'legacy (s)':>12} {'packed (s)':>12} {'speedup':>8}")
+    for size in args.sizes:
+        users = random_users(size)
+        legacy_root, legacy_time = timed(legacy_generate_merkle_tree, users)
+        packed_root, packed_time = timed(generate_merkle_tree, users)
+        if bytes(legacy_root) != bytes(packed_root):
+            raise AssertionError(f"roots differ for {size} leaves")
+        print(
+            f"{size:>10} {legacy_time:>12.2f} {packed_time:>12.2f} "
+            f"{legacy_time / packed_time:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""Local JSON-RPC node serving deterministic chain data with injected failures
+
+Balances, contract code and `eth_getLogs` results are derived from the
+addresses and block numbers alone, so the output of a fetch can be checked
+against `MockNode` itself. The node injects the failures the fetch engines
+must recover from, at fixed intervals so that every run goes through them:
+
+* an HTTP 429 response for every `rate_limit_every` requests
+* a -32005 rate limit error in a 200 response, as Infura sends them, for
+  every `error_rate_limit_every` requests
+* a Multicall3 `aggregate3` call reverting as a whole for every
+  `revert_every` of them
+* `eth_getLogs` ranges holding more than `max_logs` logs rejected with the
+  error Infura returns for oversized queries
+
+Usage: python -m benchmarks.mock_rpc [-p 8545]
+"""
+
+import argparse
+import asyncio
+import socket
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import Iterator, List
+
+from aiohttp import web
+from eth_abi import decode_abi, encode_abi
+from web3 import Web3
+
+from conicfinance.snapshot_reader import AGGREGATE3_SELECTOR
+
+DEFAULT_HEAD_BLOCK = 17_000_000
+DEFAULT_MAX_LOGS = 1_000
+# logs per thousand blocks
+DEFAULT_LOG_DENSITY = 3
+DEFAULT_DEPOSITORS = 5_000
+BALANCE_OF_SELECTOR = "0x70a08231"
+
+
+class RangeError(ValueError):
+    pass
+
+
+class MockNode:
+    def __init__(
+        self,
+        head_block: int = DEFAULT_HEAD_BLOCK,
+        rate_limit_every: int = 10,
+        error_rate_limit_every: int = 7,
+        revert_every: int = 3,
+        max_logs: int = DEFAULT_MAX_LOGS,
+        log_density: int = DEFAULT_LOG_DENSITY,
+        depositors: int = DEFAULT_DEPOSITORS,
+    ):
+        self.head_block = head_block
+        self.rate_limit_every = rate_limit_every
+        self.error_rate_limit_every = error_rate_limit_every
+        self.revert_every = revert_every
+        self.max_logs = max_logs
+        self.log_density = log_density
+        self.depositors = depositors
+        self.stats = Counter()
+        # (from, to) of every eth_getLogs request
+        self.log_ranges = []
+
+    def balance_of(self, token: str, holder: str) -> int:
+        return (int(holder, 16) * 2_654_435_761 + int(token, 16)) % 10**6 * 10**15
+
+    def has_code(self, address: str) -> bool:
+        return int(address, 16) % 3 == 0
+
+    def get_depositor(self, block: int) -> str:
+        index = (block * 2_654_435_761 >> 16) % self.depositors + 1
+        return Web3.toChecksumAddress(f"{index * 0x9E3779B97F4A7C15:040x}")
+
+    def get_log_blocks(self, from_block: int, to_block: int) -> List[int]:
+        return [
+            block
+            for block in range(from_block, to_block + 1)
+            if block * 2_654_435_761 % 1000 < self.log_density
+        ]
+
+    def call(self, method: str, params: list):
+        self.stats[method] += 1
+        if method == "eth_call":
+            return self.eth_call(params[0])
+        if method == "eth_getCode":
+            return "0x6080" if self.has_code(params[0]) else "0x"
+        if method == "eth_getLogs":
+            return self.get_logs(params[0])
+        if method == "eth_blockNumber":
+            return hex(self.head_block)
+        if method == "eth_getBlockByNumber":
+            if params[0] in ("latest", "finalized"):
+                number = self.head_block
+            else:
+                number = int(params[0], 16)
+            timestamp = 1_600_000_000 + 12 * number
+            return {"number": hex(number), "timestamp": hex(timestamp)}
+        raise NotImplementedError(method)
+
+    def eth_call(self, transaction: dict) -> str:
+        data = bytes.fromhex(transaction["data"][2:])
+        if data.startswith(AGGREGATE3_SELECTOR):
+            self.stats["aggregates"] += 1
+            if self.stats["aggregates"] % self.revert_every == 0:
+                self.stats["reverted_aggregates"] += 1
+                raise ValueError("execution reverted")
+            (calls,) = decode_abi(["(address,bool,bytes)[]"], data[4:])
+            results = []
+            for to, _, call in calls:
+                result = self.eth_call({"to": to, "data": "0x" + call.hex()})
+                results.append((True, bytes.fromhex(result[2:])))
+            return "0x" + encode_abi(["(bool,bytes)[]"], [results]).hex()
+        if transaction["data"].startswith(BALANCE_OF_SELECTOR):
+            holder = "0x" + transaction["data"][-40:]
+            balance = self.balance_of(transaction["to"], holder)
+            return "0x" + encode_abi(["uint256"], [balance]).hex()
+        raise ValueError("execution reverted")
+
+    def get_logs(self, log_filter: dict) -> List[dict]:
+        from_block = int(log_filter["fromBlock"], 16)
+        to_block = int(log_filter["toBlock"], 16)
+        self.log_ranges.append((from_block, to_block))
+        blocks = self.get_log_blocks(from_block, to_block)
+        if len(blocks) > self.max_logs:
+            self.stats["range_errors"] += 1
+            raise RangeError(f"query returned more than {self.max_logs} results")
+        return [
+            {
+                "blockNumber": hex(block),
+                "logIndex": "0x0",
+                "address": log_filter["address"],
+                "topics": [
+                    log_filter["topics"][0],
+                    "0x" + self.get_depositor(block)[2:].lower().rjust(64, "0"),
+                    "0x" + "0" * 64,
+                ],
+                "data": "0x" + "0" * 192,
+            }
+            for block in blocks
+        ]
+
+    def handle_item(self, item: dict) -> dict:
+        response = {"jsonrpc": "2.0", "id": item["id"]}
+        try:
+            response["result"] = self.call(item["method"], item["params"])
+        except RangeError as ex:
+            response["error"] = {"code": -32005, "message": str(ex)}
+        except ValueError as ex:
+            response["error"] = {"code": 3, "message": str(ex)}
+        except NotImplementedError as ex:
+            response["error"] = {"code": -32601, "message": f"{ex} not supported"}
+        return response
+
+    async def handle_rpc(self, request: web.Request) -> web.Response:
+        self.stats["http_requests"] += 1
+        if self.stats["http_requests"] % self.rate_limit_every == 0:
+            self.stats["rate_limited"] += 1
+            return web.Response(status=429)
+        payload = await request.json()
+        handle_item = self.handle_item
+        if self.stats["http_requests"] % self.error_rate_limit_every == 0:
+            self.stats["error_rate_limited"] += 1
+            handle_item = self.rate_limit_item
+        if isinstance(payload, list):
+            return web.json_response([handle_item(item) for item in payload])
+        return web.json_response(handle_item(payload))
+
+    def rate_limit_item(self, item: dict) -> dict:
+        error = {"code": -32005, "message": "project ID request rate exceeded"}
+        return {"jsonrpc": "2.0", "id": item["id"], "error": error}
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/", self.handle_rpc)
+        return app
+
+
+@contextmanager
+def run_in_thread(node: MockNode, port: int = 0) -> Iterator[str]:
+    """Serve `node` from a background thread, on a free port by default, and
+    yield its URL
+    """
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", port))
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(node.create_app())
+    loop.run_until_complete(runner.setup())
+    loop.run_until_complete(web.SockSite(runner, sock).start())
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{sock.getsockname()[1]}"
+    finally:
+        asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="benchmarks.mock_rpc")
+    parser.add_argument("-p", "--port", type=int, default=8545)
+    args = parser.parse_args()
+    web.run_app(MockNode().create_app(), host="127.0.0.1", port=args.port)
+
+
+if __name__ == "__main__":
+    main()
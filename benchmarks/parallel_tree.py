@@ -0,0 +1,39 @@
+"""Scaling of the parallel Merkle tree builder with the number of workers
+
+Usage: python -m benchmarks.parallel_tree [-n 1000000] [-w 1 2 4 8]
+"""
+
+import argparse
+import time
+
+from conicfinance.merkle.parallel import generate_merkle_tree_parallel
+from conicfinance.merkle.tree import generate_merkle_tree
+
+from benchmarks.keccak import random_users
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="benchmarks.parallel_tree")
+    parser.add_argument("-n", "--leaves", type=int, default=1_000_000)
+    parser.add_argument("-w", "--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    users = random_users(args.leaves)
+
+    start = time.perf_counter()
+    expected_root = generate_merkle_tree(users)
+    serial_time = time.perf_counter() - start
+    print(f"{args.leaves} leaves, serial: {serial_time:.2f}s")
+
+    print(f"{'workers':>8} {'time (s)':>10} {'speedup':>8}")
+    for workers in args.workers:
+        start = time.perf_counter()
+        root = generate_merkle_tree_parallel(users, workers)
+        elapsed = time.perf_counter() - start
+        if root != expected_root:
+            raise AssertionError(f"roots differ with {workers} workers")
+        print(f"{workers:>8} {elapsed:>10.2f} {serial_time / elapsed:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
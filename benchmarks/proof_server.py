@@ -0,0 +1,124 @@
+"""Load test of `merkle serve`
+
+Sends proof requests over keep-alive connections for addresses drawn from the
+distribution served, a share of them to a small set of hot addresses, then
+prints the client side throughput and latencies, and the server counters.
+With --verify, every returned proof is checked against the served root.
+
+Usage: python -m benchmarks.proof_server data/airdrop.json [-n 100000] [-c 64]
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import Dict, List, Optional
+
+import aiohttp
+import numpy as np
+from web3 import Web3
+
+from conicfinance.merkle.hashing import PackedHasher, address_to_bytes
+from conicfinance.merkle.verify import fold_proof
+
+
+def check_proof(
+    hasher: PackedHasher, root: bytes, address: str, value: Optional[int], proof
+):
+    index, nodes = proof
+    raw_address = address_to_bytes(address)
+    if value is None:
+        leaf = hasher.hash_address(raw_address)
+    else:
+        leaf = hasher.hash_address_value(raw_address, value)
+    nodes = [Web3.toBytes(hexstr=node) for node in nodes]
+    if fold_proof(leaf, index, nodes, hasher) != root:
+        raise AssertionError(f"invalid proof for {address}")
+
+
+async def run_load(
+    url: str,
+    addresses: List[str],
+    concurrency: int,
+    values: Optional[Dict[str, Optional[int]]] = None,
+):
+    """Request the proofs of `addresses` and check them if `values` is given"""
+    latencies = []
+    statuses = {}
+    pending = iter(addresses)
+    hasher = PackedHasher()
+
+    async def worker(session, root):
+        for address in pending:
+            start = time.perf_counter()
+            async with session.get(f"{url}/proof/{address}") as response:
+                body = await response.read()
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status] = statuses.get(response.status, 0) + 1
+            if values is not None and response.status == 200:
+                check_proof(hasher, root, address, values[address], json.loads(body))
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        async with session.get(f"{url}/stats") as response:
+            root = Web3.toBytes(hexstr=(await response.json())["root"])
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(session, root) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+        async with session.get(f"{url}/stats") as response:
+            server_stats = await response.json()
+    return elapsed, np.array(latencies) * 1000, statuses, server_stats
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="benchmarks.proof_server")
+    parser.add_argument("input", help="Distribution served by merkle serve")
+    parser.add_argument("-u", "--url", default="http://127.0.0.1:8080")
+    parser.add_argument("-n", "--requests", type=int, default=100_000)
+    parser.add_argument("-c", "--concurrency", type=int, default=64)
+    parser.add_argument("--hot-addresses", type=int, default=100)
+    parser.add_argument(
+        "--hot-share",
+        type=float,
+        default=0.5,
+        help="Share of the requests for hot addresses",
+    )
+    parser.add_argument("--verify", action="store_true")
+    args = parser.parse_args()
+
+    with open(args.input) as f:
+        users = json.load(f)
+    values = {}
+    for user in users:
+        if isinstance(user, str):
+            values.setdefault(user, None)
+        else:
+            values.setdefault(user["address"], int(user["value"]))
+
+    all_addresses = list(values)
+    hot = random.sample(all_addresses, min(args.hot_addresses, len(all_addresses)))
+    addresses = [
+        random.choice(hot if random.random() < args.hot_share else all_addresses)
+        for _ in range(args.requests)
+    ]
+
+    elapsed, latencies, statuses, server_stats = asyncio.run(
+        run_load(
+            args.url, addresses, args.concurrency, values if args.verify else None
+        )
+    )
+    throughput = len(latencies) / elapsed
+    print(f"{len(latencies)} requests in {elapsed:.2f}s, {throughput:.0f}/s")
+    print(f"statuses: {statuses}")
+    print(
+        "latency (ms): "
+        + ", ".join(f"p{p} {np.percentile(latencies, p):.2f}" for p in [50, 90, 99])
+    )
+    print(json.dumps(server_stats, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Load times of gzipped JSON snapshots against their columnar conversion
+
+For every snapshot, compares the original consumer path (decompress, parse
+and convert every balance to `Decimal`) with a full load of the columnar file,
+a cutoff filter returning checksummed addresses, and a cutoff filter returning
+indices only. Checksumming needs a keccak hash per address, which the JSON
+snapshots avoid by storing checksummed strings.
+
+Usage: python -m benchmarks.snapshot_load [-s data/vlcvx-snapshot-balances.json.gz ...]
+"""
+
+import argparse
+import gzip
+import json
+import os
+import tempfile
+from decimal import Decimal
+from glob import glob
+
+from conicfinance.locker_v2.airdrop import DATA_PATH
+from conicfinance.snapshot_file import (
+    SnapshotFile,
+    get_addresses_with_balance,
+    load_snapshot,
+    write_snapshot_file,
+)
+
+from benchmarks.keccak import timed
+
+CUTOFF = 100 * 10**18
+
+
+def load_json_decimal(path):
+    with gzip.open(path) as f:
+        accounts = json.load(f)
+    return [
+        a["address"] for a in accounts if Decimal(a["balance"]) >= Decimal(CUTOFF)
+    ]
+
+
+def count_columnar_above_cutoff(path):
+    with SnapshotFile(path) as snapshot:
+        return len(snapshot.find_indices(CUTOFF))
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="benchmarks.snapshot_load")
+    parser.add_argument(
+        "-s",
+        "--snapshots",
+        nargs="+",
+        default=sorted(glob(os.path.join(DATA_PATH, "*-balances.json.gz"))),
+    )
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(
+        f"{'snapshot':>36} {'accounts':>9} {'json (ms)':>10} {'load (ms)':>10} "
+        f"{'filter (ms)':>12} {'scan (ms)':>10} {'scan speedup':>13}"
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        for path in args.snapshots:
+            accounts = load_snapshot(path)
+            columnar_path = os.path.join(directory, "snapshot.snap")
+            write_snapshot_file(accounts, columnar_path)
+
+            def best_time(func, *func_args):
+                return min(timed(func, *func_args)[1] for _ in range(args.repeat))
+
+            expected = load_json_decimal(path)
+            if get_addresses_with_balance(columnar_path, CUTOFF) != expected:
+                raise AssertionError(f"filtered addresses differ for {path}")
+
+            json_time = best_time(load_json_decimal, path)
+            load_time = best_time(load_snapshot, columnar_path)
+            filter_time = best_time(get_addresses_with_balance, columnar_path, CUTOFF)
+            scan_time = best_time(count_columnar_above_cutoff, columnar_path)
+            print(
+                f"{os.path.basename(path):>36} {len(accounts):>9} "
+                f"{json_time * 1000:>10.1f} {load_time * 1000:>10.1f} "
+                f"{filter_time * 1000:>12.1f} {scan_time * 1000:>10.2f} "
+                f"{json_time / scan_time:>12.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""Timings of the Merkle, snapshot and airdrop hot paths on synthetic data
+
+Fixtures are generated with `generate_users` for every scale and kept in the
+fixtures directory, so that successive runs, and runs compared against each
+other, time the same data. `compute_airdrop` reads the veCRV balances of the
+fixture but the CNC locks of `data/`, whose cost does not depend on the scale.
+
+Results are written as JSON and, given a baseline file from a previous run,
+benchmarks slower than the baseline by more than the threshold are flagged as
+regressions and the command exits with an error.
+
+Usage: python -m benchmarks.suite [-s 1000 10000] [-o results.json] [-b baseline.json]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from importlib import metadata
+from typing import Callable, Dict, List
+
+from conicfinance import generate_snapshot
+from conicfinance.airdrop.generate_sample import generate_users
+from conicfinance.locker_v2.airdrop import compute_airdrop
+from conicfinance.merkle.proof import generate_all_proofs, generate_proof
+from conicfinance.merkle.tree import generate_merkle_tree
+from conicfinance.snapshot_file import load_snapshot, write_snapshot
+
+TOTAL_AMOUNT = 1_000_000
+DEFAULT_SCALES = [1_000, 10_000]
+DEFAULT_THRESHOLD = 0.2
+DEFAULT_FIXTURES_DIR = os.path.join(tempfile.gettempdir(), "conicfinance-benchmarks")
+
+PACKAGES = ["web3", "eth-hash", "eth-abi", "pycryptodome", "numpy"]
+
+
+def get_fixture_users(fixtures_dir: str, scale: int) -> List[dict]:
+    path = os.path.join(fixtures_dir, f"users-{scale}.json")
+    if not os.path.exists(path):
+        os.makedirs(fixtures_dir, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(generate_users(scale, TOTAL_AMOUNT), f)
+    with open(path) as f:
+        return json.load(f)
+
+
+def get_fixture_snapshot(fixtures_dir: str, scale: int, extension: str) -> str:
+    """Snapshot holding the users of the fixture, with their values as balances"""
+    path = os.path.join(fixtures_dir, f"balances-{scale}{extension}")
+    if not os.path.exists(path):
+        accounts = [
+            {"address": user["address"], "balance": user["value"], "is_eoa": True}
+            for user in get_fixture_users(fixtures_dir, scale)
+        ]
+        write_snapshot(accounts, path)
+    return path
+
+
+def run_generate_snapshot(input_file: str, output_file: str):
+    args = argparse.Namespace(input=input_file, output=output_file)
+    with contextlib.redirect_stdout(io.StringIO()):
+        generate_snapshot.generate_snapshot(args)
+
+
+def time_function(func: Callable, repeat: int) -> Dict[str, float]:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return {"min": min(times), "median": statistics.median(times), "repeat": repeat}
+
+
+def get_benchmarks(fixtures_dir: str, scale: int, output_dir: str):
+    users = get_fixture_users(fixtures_dir, scale)
+    json_snapshot = get_fixture_snapshot(fixtures_dir, scale, ".json.gz")
+    columnar_snapshot = get_fixture_snapshot(fixtures_dir, scale, ".snap")
+    target = users[len(users) // 2]["address"]
+    airdrop_output = os.path.join(output_dir, "airdrop.json")
+
+    return {
+        "merkle-root": lambda: generate_merkle_tree(users),
+        "merkle-proof": lambda: generate_proof(target, users),
+        "merkle-all-proofs": lambda: generate_all_proofs(users),
+        "generate-snapshot": lambda: run_generate_snapshot(
+            json_snapshot, airdrop_output
+        ),
+        "compute-airdrop": lambda: compute_airdrop(json_snapshot),
+        "load-snapshot-json": lambda: load_snapshot(json_snapshot),
+        "load-snapshot-columnar": lambda: load_snapshot(columnar_snapshot),
+    }
+
+
+def get_environment() -> dict:
+    versions = {}
+    for package in PACKAGES:
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+    return {
+        "date": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "packages": versions,
+    }
+
+
+def run_benchmarks(
+    scales: List[int], repeat: int, fixtures_dir: str, selected: List[str] = None
+) -> dict:
+    results = {}
+    with tempfile.TemporaryDirectory() as output_dir:
+        for scale in scales:
+            benchmarks = get_benchmarks(fixtures_dir, scale, output_dir)
+            for name, func in benchmarks.items():
+                if selected and name not in selected:
+                    continue
+                key = f"{name}/{scale}"
+                results[key] = time_function(func, repeat)
+                print(f"{key:>32} {results[key]['min'] * 1000:>12.2f}")
+    return {"environment": get_environment(), "results": results}
+
+
+def compare_results(results: dict, baseline: dict, threshold: float) -> List[str]:
+    """Print the timings of `results` relative to `baseline` and return the
+    benchmarks slower than the baseline by more than `threshold`
+    """
+    regressions = []
+    print(f"{'benchmark':>32} {'baseline (ms)':>14} {'current (ms)':>13} {'ratio':>7}")
+    for key, result in results["results"].items():
+        if key not in baseline["results"]:
+            continue
+        baseline_time = baseline["results"][key]["min"]
+        ratio = result["min"] / baseline_time
+        regressed = ratio > 1 + threshold
+        if regressed:
+            regressions.append(key)
+        print(
+            f"{key:>32} {baseline_time * 1000:>14.2f} {result['min'] * 1000:>13.2f} "
+            f"{ratio:>6.2f}x{'  REGRESSION' if regressed else ''}"
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="benchmarks.suite")
+    parser.add_argument("-s", "--scales", type=int, nargs="+", default=DEFAULT_SCALES)
+    parser.add_argument("-r", "--repeat", type=int, default=3)
+    parser.add_argument(
+        "-k", "--benchmarks", nargs="+", help="Only run these benchmarks"
+    )
+    parser.add_argument("-f", "--fixtures-dir", default=DEFAULT_FIXTURES_DIR)
+    parser.add_argument("-o", "--output", help="Output JSON file with the results")
+    parser.add_argument("-b", "--baseline", help="Results of a previous run")
+    parser.add_argument(
+        "-t",
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="Relative slowdown above which a benchmark is a regression",
+    )
+    args = parser.parse_args()
+
+    print(f"{'benchmark':>32} {'time (ms)':>12}")
+    results = run_benchmarks(
+        args.scales, args.repeat, args.fixtures_dir, args.benchmarks
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_results(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regressions: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,154 @@
-import random
-from decimal import Decimal
-from typing import List
+"""Synthetic users for sample airdrops, whitelists and load tests
 
-from eth_account import Account
+Addresses are random 20-byte strings checksummed in bulk, which is much
+cheaper than creating an account, and therefore a private key, per user.
+Values follow one of `DISTRIBUTIONS`:
 
+* `tiers`: a tenth of the users share half of the amount, four tenths a
+  quarter and the other half the last quarter
+* `lognormal`: log-normally distributed values
+* `snapshot`: values drawn from the balances of an existing snapshot
 
-def generate_user(amount: int) -> dict:
-    address = Account.create().address
-    return {"address": address, "value": str(Decimal(amount) * 10**18)}
+Values are scaled so that they add up to about `total_amount` tokens.
+"""
 
+import json
+from itertools import islice
+from typing import IO, Iterable, Iterator, List, Optional, Union
 
-def generate_users(count: int, total_amount: int) -> List[dict]:
+import numpy as np
+
+from conicfinance.snapshot_file import (
+    ADDRESS_SIZE,
+    iter_snapshot,
+    to_checksum_addresses,
+)
+
+DISTRIBUTIONS = ["tiers", "lognormal", "snapshot"]
+DEFAULT_SIGMA = 1.5
+BATCH_SIZE = 100_000
+
+MULTIPLIER = 10**18
+
+
+def iter_random_addresses(
+    count: int, rng: np.random.Generator, batch_size: int = BATCH_SIZE
+) -> Iterator[str]:
+    for start in range(0, count, batch_size):
+        batch_count = min(batch_size, count - start)
+        yield from to_checksum_addresses(rng.bytes(batch_count * ADDRESS_SIZE))
+
+
+def get_tier_values(count: int, total_amount: int, rng: np.random.Generator):
     tiers = [
         (total_amount // 2, count // 10),  # high tier
         (total_amount // 4, count * 4 // 10),  # normal tier
         (total_amount // 4, count * 5 // 10),  # low tier
     ]
-    users = []
+    values = []
     for tier_amount, tier_count in tiers:
-        user_amount = tier_amount // tier_count
-        for _ in range(tier_count):
-            users.append(generate_user(user_amount))
-    random.shuffle(users)
-    return users
+        if tier_count:
+            values.extend([tier_amount * MULTIPLIER // tier_count] * tier_count)
+    rng.shuffle(values)
+    return values
+
+
+def scale_weights(weights: np.ndarray, total_amount: int) -> List[int]:
+    scaled = weights * (total_amount * MULTIPLIER / weights.sum())
+    return [int(value) for value in scaled.tolist()]
+
+
+def get_lognormal_values(
+    count: int, total_amount: int, rng: np.random.Generator, sigma: float
+) -> List[int]:
+    return scale_weights(rng.lognormal(0, sigma, count), total_amount)
+
+
+def get_snapshot_values(
+    count: int, total_amount: int, rng: np.random.Generator, snapshot: str
+) -> List[int]:
+    """Balances drawn with replacement from the positive balances of `snapshot`"""
+    balances = np.array(
+        [float(a["balance"]) for a in iter_snapshot(snapshot) if a["balance"] != "0"]
+    )
+    if len(balances) == 0:
+        raise ValueError(f"{snapshot} has no positive balance")
+    return scale_weights(rng.choice(balances, count), total_amount)
+
+
+def get_values(
+    count: int,
+    total_amount: int,
+    rng: np.random.Generator,
+    distribution: str = "tiers",
+    sigma: float = DEFAULT_SIGMA,
+    snapshot: Optional[str] = None,
+) -> List[int]:
+    if distribution == "tiers":
+        return get_tier_values(count, total_amount, rng)
+    if distribution == "lognormal":
+        return get_lognormal_values(count, total_amount, rng, sigma)
+    if distribution == "snapshot":
+        if snapshot is None:
+            raise ValueError("the snapshot distribution needs a snapshot file")
+        return get_snapshot_values(count, total_amount, rng, snapshot)
+    raise ValueError(f"unknown distribution {distribution}")
+
+
+def _iter_users(values: List[int], rng: np.random.Generator) -> Iterator[dict]:
+    addresses = iter_random_addresses(len(values), rng)
+    for address, value in zip(addresses, values):
+        yield {"address": address, "value": str(value)}
+
+
+def iter_users(
+    count: int, total_amount: int, seed: Optional[int] = None, **kwargs
+) -> Iterator[dict]:
+    """Users with random addresses and values following `distribution`, see
+    `get_values` for the other arguments
+    """
+    rng = np.random.default_rng(seed)
+    return _iter_users(get_values(count, total_amount, rng, **kwargs), rng)
+
+
+def generate_users(count: int, total_amount: int, **kwargs) -> List[dict]:
+    return list(iter_users(count, total_amount, **kwargs))
+
+
+def generate_addresses(count: int, seed: Optional[int] = None) -> List[str]:
+    return list(iter_random_addresses(count, np.random.default_rng(seed)))
+
+
+def write_users(
+    output_file: str,
+    count: int,
+    total_amount: int,
+    seed: Optional[int] = None,
+    **kwargs,
+) -> int:
+    """Stream the users of `iter_users` to `output_file` and return their total
+    value
+    """
+    rng = np.random.default_rng(seed)
+    values = get_values(count, total_amount, rng, **kwargs)
+    with open(output_file, "w") as f:
+        dump_json_list(_iter_users(values, rng), f)
+    return sum(values)
+
+
+def dump_json_list(items: Iterable[Union[dict, str]], f: IO[str]) -> int:
+    """Write `items` as a JSON list, one item per line, without holding them
+    all in memory, and return their number
+    """
+    items = iter(items)
+    count = 0
+    f.write("[")
+    while True:
+        batch = [json.dumps(item) for item in islice(items, BATCH_SIZE)]
+        if not batch:
+            break
+        f.write(",\n  " if count else "\n  ")
+        f.write(",\n  ".join(batch))
+        count += len(batch)
+    f.write("\n]\n" if count else "]\n")
+    return count
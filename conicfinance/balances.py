@@ -0,0 +1,155 @@
+"""Shared engine fetching token balances and EOA status of many addresses"""
+
+import asyncio
+from typing import Dict, List, Optional, Sequence
+
+from tqdm import tqdm
+
+from conicfinance import profiling
+from conicfinance.checkpoint import CheckpointStore
+from conicfinance.rpc import (
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_CONCURRENCY,
+    BatchRPCClient,
+    add_rpc_arguments,
+)
+from conicfinance.snapshot_reader import (
+    DEFAULT_CALLS_PER_AGGREGATE,
+    SnapshotContract,
+    SnapshotReader,
+)
+
+# number of addresses fetched between two checkpoints
+DEFAULT_CHUNK_SIZE = 5_000
+
+
+def is_empty_code(code: str) -> bool:
+    return code in ("0x", "")
+
+
+async def fetch_balances_chunk(
+    client: BatchRPCClient,
+    contracts: Sequence[SnapshotContract],
+    addresses: Sequence[str],
+    block: int,
+    min_balance: Optional[int] = None,
+    calls_per_aggregate: int = DEFAULT_CALLS_PER_AGGREGATE,
+) -> Dict[str, Optional[dict]]:
+    """Fetch the sum of `balanceOf` over `contracts` at `block` and the
+    current code of every address. Addresses with a total balance below
+    `min_balance` map to `None` and their code is not fetched. `balanceOf`
+    calls are aggregated through Multicall3 unless `calls_per_aggregate` is 0
+    """
+    calls = [
+        contract.call("balanceOf", address)
+        for address in addresses
+        for contract in contracts
+    ]
+    reader = SnapshotReader(client, block, calls_per_aggregate=calls_per_aggregate)
+    results = await reader.read(calls)
+
+    contracts_count = len(contracts)
+    total_balances = {}
+    for i, address in enumerate(addresses):
+        address_results = results[i * contracts_count : (i + 1) * contracts_count]
+        total_balances[address] = sum(address_results)
+
+    eligible_addresses = [
+        address
+        for address in addresses
+        if min_balance is None or total_balances[address] >= min_balance
+    ]
+    # `is_eoa` has always meant "no code now", so the code is read at the latest
+    # block, which also keeps these calls out of the response cache
+    calls = [("eth_getCode", [address, "latest"]) for address in eligible_addresses]
+    codes = await client.batch(calls)
+
+    balances = dict.fromkeys(addresses)
+    for address, code in zip(eligible_addresses, codes):
+        balances[address] = {
+            "address": address,
+            "balance": str(total_balances[address]),
+            "is_eoa": is_empty_code(code),
+        }
+    return balances
+
+
+async def fetch_balances_async(
+    client: BatchRPCClient,
+    contracts: Sequence[SnapshotContract],
+    addresses: Sequence[str],
+    block: int,
+    min_balance: Optional[int] = None,
+    calls_per_aggregate: int = DEFAULT_CALLS_PER_AGGREGATE,
+    checkpoint: Optional[CheckpointStore] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> List[dict]:
+    """Fetch balances chunk by chunk, see `fetch_balances_chunk`
+    Addresses already recorded in `checkpoint` are not fetched again and
+    every completed chunk is recorded in it
+    """
+    balances = checkpoint.results() if checkpoint else {}
+    remaining = [address for address in addresses if address not in balances]
+
+    initial = len(addresses) - len(remaining)
+    with tqdm(total=len(addresses), initial=initial) as progress:
+        for i in range(0, len(remaining), chunk_size):
+            chunk = remaining[i : i + chunk_size]
+            chunk_balances = await fetch_balances_chunk(
+                client, contracts, chunk, block, min_balance, calls_per_aggregate
+            )
+            if checkpoint:
+                checkpoint.add_results(chunk_balances)
+            balances.update(chunk_balances)
+            progress.update(len(chunk))
+
+    return [balances[a] for a in addresses if balances[a] is not None]
+
+
+def fetch_balances(
+    rpc_url: str,
+    contracts: Sequence[SnapshotContract],
+    addresses: Sequence[str],
+    block: int,
+    min_balance: Optional[int] = None,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    rate_limit: Optional[float] = None,
+    calls_per_aggregate: int = DEFAULT_CALLS_PER_AGGREGATE,
+    checkpoint: Optional[CheckpointStore] = None,
+) -> List[dict]:
+    async def run():
+        async with BatchRPCClient(
+            rpc_url,
+            concurrency=concurrency,
+            batch_size=batch_size,
+            rate_limit=rate_limit,
+        ) as client:
+            return await fetch_balances_async(
+                client,
+                contracts,
+                addresses,
+                block,
+                min_balance,
+                calls_per_aggregate,
+                checkpoint,
+            )
+
+    with profiling.stage("fetch-balances"):
+        return asyncio.run(run())
+
+
+def add_fetch_arguments(parser):
+    add_rpc_arguments(parser)
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help="Number of JSON-RPC calls per batch request",
+    )
+    parser.add_argument(
+        "--calls-per-multicall",
+        type=int,
+        default=DEFAULT_CALLS_PER_AGGREGATE,
+        help="Number of balanceOf calls per Multicall3 call (0 to disable)",
+    )
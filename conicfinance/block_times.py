@@ -0,0 +1,101 @@
+"""Block number to timestamp resolution
+
+Exact timestamps are read with batched `eth_getBlockByNumber` calls without
+transactions. When exact precision is not needed, only a few evenly spaced
+anchor blocks are fetched and the other timestamps are linearly interpolated
+between the two closest anchors.
+"""
+
+import asyncio
+import bisect
+from typing import Dict, Iterable, List, Optional
+
+from tqdm import tqdm
+
+from conicfinance import profiling
+from conicfinance.rpc import DEFAULT_BATCH_SIZE, DEFAULT_CONCURRENCY, BatchRPCClient
+
+DEFAULT_ANCHORS_COUNT = 64
+
+
+async def fetch_block_timestamps(
+    client: BatchRPCClient, block_numbers: Iterable[int]
+) -> Dict[int, int]:
+    block_numbers = sorted(set(block_numbers))
+    calls = [("eth_getBlockByNumber", [hex(n), False]) for n in block_numbers]
+    with tqdm(total=len(calls), desc="timestamps") as progress:
+        blocks = await client.batch(calls, on_batch_done=progress.update)
+    return {n: int(block["timestamp"], 16) for n, block in zip(block_numbers, blocks)}
+
+
+def get_anchor_blocks(block_numbers: List[int], anchors_count: int) -> List[int]:
+    first, last = min(block_numbers), max(block_numbers)
+    if anchors_count < 2 or last == first:
+        return sorted({first, last})
+    step = (last - first) / (anchors_count - 1)
+    return sorted({first + round(i * step) for i in range(anchors_count)})
+
+
+def interpolate_timestamps(
+    block_numbers: Iterable[int], anchors: Dict[int, int]
+) -> Dict[int, int]:
+    """Interpolate timestamps between known `anchors` (block number to timestamp)
+    Blocks outside of the anchors range are extrapolated from the closest segment
+    """
+    anchor_blocks = sorted(anchors)
+    if len(anchor_blocks) == 1:
+        return {n: anchors[anchor_blocks[0]] for n in block_numbers}
+
+    timestamps = {}
+    for n in block_numbers:
+        if n in anchors:
+            timestamps[n] = anchors[n]
+            continue
+        i = bisect.bisect(anchor_blocks, n)
+        i = min(max(i, 1), len(anchor_blocks) - 1)
+        left, right = anchor_blocks[i - 1], anchor_blocks[i]
+        slope = (anchors[right] - anchors[left]) / (right - left)
+        timestamps[n] = round(anchors[left] + slope * (n - left))
+    return timestamps
+
+
+async def estimate_block_timestamps(
+    client: BatchRPCClient,
+    block_numbers: Iterable[int],
+    anchors_count: int = DEFAULT_ANCHORS_COUNT,
+) -> Dict[int, int]:
+    block_numbers = list(set(block_numbers))
+    if not block_numbers:
+        return {}
+    anchor_blocks = get_anchor_blocks(block_numbers, anchors_count)
+    anchors = await fetch_block_timestamps(client, anchor_blocks)
+    return interpolate_timestamps(block_numbers, anchors)
+
+
+def resolve_block_timestamps(
+    rpc_url: str,
+    block_numbers: Iterable[int],
+    anchors_count: Optional[int] = None,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    rate_limit: Optional[float] = None,
+) -> Dict[int, int]:
+    """Exact timestamps of `block_numbers`, or timestamps interpolated from
+    `anchors_count` anchor blocks if it is set
+    """
+
+    async def run():
+        async with BatchRPCClient(
+            rpc_url,
+            concurrency=concurrency,
+            batch_size=batch_size,
+            rate_limit=rate_limit,
+        ) as client:
+            if anchors_count:
+                return await estimate_block_timestamps(
+                    client, block_numbers, anchors_count
+                )
+            return await fetch_block_timestamps(client, block_numbers)
+
+    with profiling.stage("block-timestamps"):
+        return asyncio.run(run())
@@ -0,0 +1,125 @@
+"""Append-only SQLite checkpoints for long running fetches
+
+Completed block ranges with the values found in them, and completed
+per-address results, are committed as soon as they are fetched so that an
+interrupted fetch can be resumed without redoing finished work. Values are
+recorded with the block they were found at, so a fetch over a shorter range
+only gets back the values of its own range.
+Entries are grouped by namespace, so a single file can hold the
+checkpoints of several fetches.
+"""
+
+import json
+import sqlite3
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# the ranges and range_values tables of older files, whose values have no
+# block, are left alone and their ranges are scanned again
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scanned_ranges (
+    namespace TEXT NOT NULL,
+    start_block INTEGER NOT NULL,
+    end_block INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS block_values (
+    namespace TEXT NOT NULL,
+    value TEXT NOT NULL,
+    block INTEGER NOT NULL,
+    PRIMARY KEY (namespace, value, block)
+);
+CREATE TABLE IF NOT EXISTS results (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    result TEXT,
+    PRIMARY KEY (namespace, key)
+);
+"""
+
+
+class CheckpointStore:
+    def __init__(self, path: Optional[str], namespace: str):
+        """Checkpoints are only kept in memory if `path` is None"""
+        self.namespace = namespace
+        self._db = sqlite3.connect(path or ":memory:")
+        self._db.executescript(SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def completed_ranges(self) -> List[Tuple[int, int]]:
+        cursor = self._db.execute(
+            "SELECT start_block, end_block FROM scanned_ranges WHERE namespace = ? "
+            "ORDER BY start_block",
+            (self.namespace,),
+        )
+        return cursor.fetchall()
+
+    def missing_ranges(self, from_block: int, to_block: int) -> List[Tuple[int, int]]:
+        """Ranges between `from_block` and `to_block` included not completed yet"""
+        missing = []
+        cursor = from_block
+        for start, end in self.completed_ranges():
+            if start > cursor:
+                missing.append((cursor, min(start - 1, to_block)))
+            cursor = max(cursor, end + 1)
+            if cursor > to_block:
+                break
+        if cursor <= to_block:
+            missing.append((cursor, to_block))
+        return [(start, end) for start, end in missing if start <= end]
+
+    def add_range(
+        self, start_block: int, end_block: int, values: Iterable[Tuple[str, int]]
+    ):
+        """Record a completed range with the `(value, block)` pairs found in it"""
+        with self._db:
+            self._db.executemany(
+                "INSERT OR IGNORE INTO block_values VALUES (?, ?, ?)",
+                ((self.namespace, value, block) for value, block in values),
+            )
+            self._db.execute(
+                "INSERT INTO scanned_ranges VALUES (?, ?, ?)",
+                (self.namespace, start_block, end_block),
+            )
+
+    def range_values(self, from_block: int, to_block: int) -> Set[str]:
+        """Values found between `from_block` and `to_block` included"""
+        cursor = self._db.execute(
+            "SELECT DISTINCT value FROM block_values "
+            "WHERE namespace = ? AND block BETWEEN ? AND ?",
+            (self.namespace, from_block, to_block),
+        )
+        return {value for (value,) in cursor}
+
+    def add_results(self, results: Dict[str, Optional[dict]]):
+        """Record results by key, `None` marks a key done without a result"""
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?)",
+                (
+                    (self.namespace, key, None if result is None else json.dumps(result))
+                    for key, result in results.items()
+                ),
+            )
+
+    def results(self) -> Dict[str, Optional[dict]]:
+        cursor = self._db.execute(
+            "SELECT key, result FROM results WHERE namespace = ?", (self.namespace,)
+        )
+        return {
+            key: None if result is None else json.loads(result)
+            for key, result in cursor
+        }
+
+
+def add_checkpoint_argument(parser):
+    parser.add_argument(
+        "--checkpoint",
+        help="SQLite file used to record progress and resume interrupted runs",
+    )
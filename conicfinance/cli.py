@@ -1,20 +1,35 @@
 import argparse
-import gzip
 import json
 import os
+import sys
 
-from eth_account import Account
-from tqdm import tqdm
-from web3 import HTTPProvider, Web3
+from web3 import Web3
 
-from conicfinance.airdrop.generate_sample import generate_users
+from conicfinance.airdrop import generate_sample
+from conicfinance.block_times import resolve_block_timestamps
+from conicfinance.events import iter_events
 from conicfinance.initial_distribution import whitelist
+from conicfinance import pipeline, profiling
 from conicfinance.plotting import plot_airdrop_boost_dist
-from conicfinance.merkle.proof import generate_proof
+from conicfinance.merkle import server as merkle_server
+from conicfinance.merkle import verify as merkle_verify
+from conicfinance.merkle.hashing import address_to_bytes
+from conicfinance.merkle.incremental import IncrementalMerkleTree
+from conicfinance.merkle.parallel import generate_merkle_tree_parallel
+from conicfinance.merkle.proof import generate_all_proofs, generate_proof
 from conicfinance.merkle.tools import generate_merkle_root
-from conicfinance.locker_v2.airdrop import compute_airdrop as compute_boost_airdrop
+from conicfinance.merkle.tree import generate_merkle_levels, generate_merkle_tree
+from conicfinance.merkle.store import MerkleStore, write_store
+from conicfinance.merkle.tree_file import MerkleTreeFile, write_tree_file
+from conicfinance.rpc import add_rpc_arguments
+from conicfinance.rpc_cache import report_response_cache
+from conicfinance.snapshot_file import convert_snapshot
+from conicfinance.locker_v2 import airdrop as boost_airdrop
+from conicfinance.locker_v2 import sweep, vectorized
+from conicfinance.locker_v2.replay import get_locker_balances
 
 parser = argparse.ArgumentParser(description="Set of tools for Conic Finance")
+profiling.add_profile_arguments(parser)
 
 supbarsers = parser.add_subparsers(dest="command")
 
@@ -36,12 +51,120 @@ generate_proof_parser.add_argument("input", help="Input file with aidrop informa
 generate_proof_parser.add_argument(
     "-a", "--address", required=True, help="Address to generate proof for"
 )
+generate_proof_parser.add_argument(
+    "--tree-file",
+    action="store_true",
+    help="Input is a tree file generated by write-tree",
+)
+
+generate_all_proofs_parser = merkle_subparser.add_parser(
+    name="generate-all-proofs", help="Generate the proofs of all addresses"
+)
+generate_all_proofs_parser.add_argument(
+    "input", help="Input file with aidrop information"
+)
+generate_all_proofs_parser.add_argument(
+    "-o", "--output", required=True, help="Output JSON file"
+)
+
+write_tree_parser = merkle_subparser.add_parser(
+    "write-tree", help="Write the Merkle tree and address index to a file"
+)
+write_tree_parser.add_argument("input", help="Input file with aidrop information")
+write_tree_parser.add_argument("-o", "--output", required=True, help="Output tree file")
+
+verify_parser = merkle_subparser.add_parser(
+    "verify", help="Verify the proofs of all addresses against the Merkle root"
+)
+verify_parser.add_argument("input", help="Input file with aidrop information")
+verify_parser.add_argument(
+    "-p",
+    "--proofs",
+    help="Proofs generated by generate-all-proofs, generated from input if omitted",
+)
+verify_parser.add_argument(
+    "-r", "--root", help="Published Merkle root, computed from input if omitted"
+)
+verify_parser.add_argument(
+    "--expected-total", type=int, help="Expected total value of the distribution"
+)
+verify_parser.add_argument(
+    "-w",
+    "--workers",
+    type=int,
+    default=0,
+    help="Number of processes verifying the proofs (0 for one per CPU)",
+)
+
+update_tree_parser = merkle_subparser.add_parser(
+    "update-tree", help="Update values and append users to a tree file"
+)
+update_tree_parser.add_argument("input", help="Tree file generated by write-tree")
+update_tree_parser.add_argument(
+    "changes", help="File with the users to update or append, as aidrop information"
+)
+update_tree_parser.add_argument(
+    "-o", "--output", help="Output tree file, defaults to updating input"
+)
+update_tree_parser.add_argument(
+    "-r", "--report", help="Output JSON file with the changed nodes and proofs"
+)
 
+write_store_parser = merkle_subparser.add_parser(
+    "write-store", help="Write several distributions to a single store file"
+)
+write_store_parser.add_argument(
+    "inputs",
+    nargs="+",
+    help="Input files with aidrop information, as path or name=path",
+)
+write_store_parser.add_argument(
+    "-o", "--output", required=True, help="Output store file"
+)
+
+get_claims_parser = merkle_subparser.add_parser(
+    "get-claims", help="Get the proofs of an address in all the distributions"
+)
+get_claims_parser.add_argument("input", help="Store file generated by write-store")
+get_claims_parser.add_argument(
+    "-a", "--address", required=True, help="Address to get the claims of"
+)
+
+serve_parser = merkle_subparser.add_parser(
+    "serve", help="Serve the proofs of all addresses over HTTP"
+)
+serve_parser.add_argument("input", help="Input file with aidrop information")
+serve_parser.add_argument(
+    "--tree-file",
+    action="store_true",
+    help="Input is a tree file generated by write-tree",
+)
+serve_parser.add_argument("--host", default=merkle_server.DEFAULT_HOST)
+serve_parser.add_argument("-p", "--port", type=int, default=merkle_server.DEFAULT_PORT)
+serve_parser.add_argument(
+    "--cache-size",
+    type=int,
+    default=merkle_server.DEFAULT_CACHE_SIZE,
+    help="Number of proof responses kept in the LRU cache",
+)
+serve_parser.add_argument(
+    "--keepalive-timeout",
+    type=float,
+    default=merkle_server.DEFAULT_KEEPALIVE_TIMEOUT,
+    help="Seconds idle connections are kept open",
+)
 
 generate_root_parser = merkle_subparser.add_parser(
     "generate-root", help="Generate Merkle root"
 )
 generate_root_parser.add_argument("input", help="Input file with aidrop information")
+generate_root_parser.add_argument(
+    "-w",
+    "--workers",
+    type=int,
+    default=1,
+    help="Number of processes used to build the tree (0 for one per CPU)",
+)
 
 airdrop_parser = supbarsers.add_parser("airdrop", help="Airdrop related tools")
 airdrop_subparser = airdrop_parser.add_subparsers(dest="subcommand")
@@ -52,10 +175,33 @@ sample_airdrop_parser.add_argument(
     "-o", "--output", required=True, help="Output JSON file"
 )
 sample_airdrop_parser.add_argument(
-    "-c", "--users-count", default=500, help="Total number of users"
+    "-c", "--users-count", type=int, default=500, help="Total number of users"
 )
 sample_airdrop_parser.add_argument(
-    "-t", "--total-amount", default=1_000_000, help="Total amount to airdrop"
+    "-t",
+    "--total-amount",
+    type=int,
+    default=1_000_000,
+    help="Total amount to airdrop",
+)
+sample_airdrop_parser.add_argument(
+    "-d",
+    "--distribution",
+    choices=generate_sample.DISTRIBUTIONS,
+    default="tiers",
+    help="Distribution of the airdropped values",
+)
+sample_airdrop_parser.add_argument(
+    "--sigma",
+    type=float,
+    default=generate_sample.DEFAULT_SIGMA,
+    help="Standard deviation of the log of the values, for lognormal",
+)
+sample_airdrop_parser.add_argument(
+    "--snapshot", help="Snapshot whose balances are replayed, for snapshot"
+)
+sample_airdrop_parser.add_argument(
+    "--seed", type=int, help="Seed of the random generator"
 )
 
 boost_airdrop_parser = airdrop_subparser.add_parser(
@@ -64,6 +210,91 @@ boost_airdrop_parser = airdrop_subparser.add_parser(
 boost_airdrop_parser.add_argument(
     "-o", "--output", required=True, help="Output JSON file"
 )
+boost_airdrop_parser.add_argument(
+    "--engine",
+    choices=["decimal", "numpy"],
+    default="decimal",
+    help="Compute the boosts with exact decimals or with vectorized floats",
+)
+boost_airdrop_parser.add_argument(
+    "--vecrv-balances",
+    default=boost_airdrop.LOCKED_CRV,
+    help="veCRV balances snapshot at the boost airdrop block",
+)
+
+verify_boost_parser = airdrop_subparser.add_parser(
+    "verify-boost",
+    help="Check that the numpy boost engine agrees with a decimal airdrop file",
+)
+verify_boost_parser.add_argument(
+    "reference",
+    nargs="?",
+    default=os.path.join(boost_airdrop.DATA_PATH, "boost-airdrop.json"),
+    help="Airdrop generated with the decimal engine",
+)
+verify_boost_parser.add_argument(
+    "--tolerance",
+    type=float,
+    default=vectorized.DEFAULT_TOLERANCE,
+    help="Maximum relative difference allowed for every field",
+)
+
+sweep_boost_parser = airdrop_subparser.add_parser(
+    "sweep-boost", help="Summarize the Locker V2 boost airdrop over a parameter grid"
+)
+sweep_boost_parser.add_argument(
+    "--min-vecrv-boost",
+    type=float,
+    nargs="+",
+    default=[float(boost_airdrop.MIN_VCERV_BOOST)],
+    help="Minimum veCRV boosts to evaluate",
+)
+sweep_boost_parser.add_argument(
+    "--max-vecrv-boost",
+    type=float,
+    nargs="+",
+    default=[float(boost_airdrop.MAX_VECRV_BOOST)],
+    help="Maximum veCRV boosts to evaluate",
+)
+sweep_boost_parser.add_argument(
+    "--cnc-cutoff",
+    type=float,
+    nargs="+",
+    default=[boost_airdrop.CNC_CUTOFF / boost_airdrop.MULTIPLIER],
+    help="vlCNC cutoffs to evaluate, in CNC times seconds locked",
+)
+sweep_boost_parser.add_argument(
+    "--crv-cutoff",
+    type=float,
+    nargs="+",
+    default=[boost_airdrop.CRV_CUTOFF / boost_airdrop.MULTIPLIER],
+    help="veCRV cutoffs to evaluate, in CRV",
+)
+sweep_boost_parser.add_argument(
+    "--late-boost-multiplier",
+    type=float,
+    nargs="+",
+    default=[boost_airdrop.LATE_BOOST_MULTIPLIER],
+    help="Multipliers of the locks made after the late boost time to evaluate",
+)
+sweep_boost_parser.add_argument(
+    "-w",
+    "--workers",
+    type=int,
+    default=1,
+    help="Number of processes evaluating the grid (0 for one per CPU)",
+)
+sweep_boost_parser.add_argument("-o", "--output", help="Output JSON file")
+
+replay_locker_parser = airdrop_subparser.add_parser(
+    "replay-locker", help="Rebuild the CNC locker balances from its events"
+)
+replay_locker_parser.add_argument(
+    "-b", "--blocks", type=int, nargs="+", required=True, help="Snapshot blocks"
+)
+replay_locker_parser.add_argument(
+    "-o", "--output", required=True, help="Output JSON file with balances per block"
+)
 
 distribution_parser = supbarsers.add_parser(
     "distribution", help="Initial distribution related tools"
@@ -77,7 +308,10 @@ sample_whitelist_parser.add_argument(
     "-o", "--output", required=True, help="Output JSON file"
 )
 sample_whitelist_parser.add_argument(
-    "-c", "--users-count", default=500, help="Total number of users"
+    "-c", "--users-count", type=int, default=500, help="Total number of users"
+)
+sample_whitelist_parser.add_argument(
+    "--seed", type=int, help="Seed of the random generator"
 )
 sample_whitelist_parser.add_argument(
     "addresses", nargs="*", help="Users to add to the list"
@@ -89,6 +323,42 @@ generate_whitelist_parser = distribution_subparser.add_parser(
 generate_whitelist_parser.add_argument(
     "-o", "--output", required=True, help="Output JSON file"
 )
+generate_whitelist_parser.add_argument(
+    "-s",
+    "--sources",
+    nargs="+",
+    type=whitelist.parse_source,
+    default=whitelist.DEFAULT_SOURCES,
+    help="Snapshots as path:cutoff with a cutoff in tokens, or address lists as path",
+)
+generate_whitelist_parser.add_argument(
+    "--tree-file", help="Also write the Merkle tree of the whitelist to this file"
+)
+
+pipeline_parser = supbarsers.add_parser(
+    "pipeline", help="Run the stages producing the distributions"
+)
+pipeline_subparser = pipeline_parser.add_subparsers(dest="subcommand")
+run_pipeline_parser = pipeline_subparser.add_parser(
+    "execute", help="Run the stages of a pipeline that are not up to date"
+)
+run_pipeline_parser.add_argument("name", choices=sorted(pipeline.PIPELINES))
+run_pipeline_parser.add_argument(
+    "-d", "--directory", default="build", help="Directory for the stage outputs"
+)
+run_pipeline_parser.add_argument(
+    "-j",
+    "--jobs",
+    type=int,
+    default=pipeline.DEFAULT_JOBS,
+    help="Maximum number of stages running at once",
+)
+run_pipeline_parser.add_argument(
+    "--force", action="store_true", help="Run all stages even if up to date"
+)
+run_pipeline_parser.add_argument(
+    "--dry-run", action="store_true", help="Only print the commands of the stages"
+)
 
 misc_parser = supbarsers.add_parser("misc", help="Miscalenous tools")
 misc_subparser = misc_parser.add_subparsers(dest="subcommand")
@@ -99,6 +369,25 @@ fetch_event_times_parser.add_argument("input", help="Input JSON lines file")
 fetch_event_times_parser.add_argument(
     "-o", "--output", required=True, help="Output JSON file"
 )
+fetch_event_times_parser.add_argument(
+    "--anchors",
+    type=int,
+    help="Interpolate timestamps from this many anchor blocks instead of "
+    "fetching every block",
+)
+add_rpc_arguments(fetch_event_times_parser)
+
+convert_snapshot_parser = misc_subparser.add_parser(
+    "convert-snapshot",
+    help="Convert a balance snapshot between gzipped JSON and the columnar format",
+)
+convert_snapshot_parser.add_argument("input", help="Input snapshot file")
+convert_snapshot_parser.add_argument(
+    "-o",
+    "--output",
+    required=True,
+    help="Output snapshot file, in the columnar format if it ends with .snap",
+)
 
 
 class Command:
@@ -130,13 +419,20 @@ class PlotCommand(Command):
 class DistributionCommand(Command):
     def sample_whitelist(self):
         n = self.args.users_count - len(self.args.addresses)
-        users = [Account.create().address for _ in range(n)]
+        users = generate_sample.generate_addresses(n, self.args.seed)
         users.extend(self.args.addresses)
         with open(self.args.output, "w") as f:
             json.dump(users, f, indent=2)
 
     def generate_whitelist(self):
-        whitelist.generate(self.args.output)
+        users = whitelist.generate(self.args.output, self.args.sources)
+        if self.args.tree_file:
+            levels = generate_merkle_levels(users)
+            write_tree_file(users, self.args.tree_file, levels)
+            root = levels[-1][0]
+        else:
+            root = generate_merkle_tree(users)
+        print(f"{len(users)} users, root: {Web3.toHex(root)}")
 
     @property
     def parser(self):
@@ -145,21 +441,142 @@ class DistributionCommand(Command):
 
 class MerkleCommand(Command):
     def generate_root(self):
-        print(generate_merkle_root(self.args.input))
+        workers = self.args.workers or None
+        print(generate_merkle_root(self.args.input, workers))
 
     def generate_proof(self):
-        with open(self.args.input) as f:
-            users = json.load(f)
         try:
-            proof, value = generate_proof(self.args.address, users)
+            if self.args.tree_file:
+                with MerkleTreeFile(self.args.input) as tree:
+                    proof, value = tree.generate_proof(self.args.address)
+            else:
+                with open(self.args.input) as f:
+                    users = json.load(f)
+                proof, value = generate_proof(self.args.address, users)
             print(f"claimer: `{self.args.address}`")
             if value > 0:
                 print(f"amount: `{value}`")
-            formatted_proof = [proof[1], [v.hex() for v in proof[0]]]
+            formatted_proof = [proof[1], [Web3.toHex(v) for v in proof[0]]]
             print("proof: `" + json.dumps(formatted_proof) + "`")
         except ValueError:
             print("Address not found")
 
+    def generate_all_proofs(self):
+        with open(self.args.input) as f:
+            users = json.load(f)
+        proofs = generate_all_proofs(users)
+        formatted_proofs = {
+            address: [index, [Web3.toHex(v) for v in proof], str(value)]
+            for address, (index, proof, value) in proofs.items()
+        }
+        with open(self.args.output, "w") as f:
+            json.dump(formatted_proofs, f, indent=2)
+        print(f"generated {len(formatted_proofs)} proofs")
+
+    def verify(self):
+        with open(self.args.input) as f:
+            users = json.load(f)
+        with_values = bool(users) and not isinstance(users[0], str)
+        if self.args.proofs:
+            with open(self.args.proofs) as f:
+                claims = merkle_verify.parse_proofs(json.load(f), with_values)
+        else:
+            claims = [
+                (address, value if with_values else None, index, proof)
+                for address, (index, proof, value) in generate_all_proofs(users).items()
+            ]
+
+        workers = self.args.workers or None
+        if self.args.root:
+            root = Web3.toBytes(hexstr=self.args.root)
+        else:
+            root = generate_merkle_tree_parallel(users, workers)
+        report = merkle_verify.verify_distribution(
+            users, claims, root, workers, self.args.expected_total
+        )
+        print(json.dumps(report, indent=2))
+        if not report["ok"]:
+            sys.exit(1)
+
+    def update_tree(self):
+        tree = IncrementalMerkleTree.from_tree_file(self.args.input)
+        with open(self.args.changes) as f:
+            update = tree.apply(json.load(f))
+        tree.write(self.args.output or self.args.input)
+
+        changed_proofs_count = sum(end - start for start, end in update.changed_proofs)
+        print(f"updated {len(update.updated)}, appended {len(update.inserted)}")
+        existing_count = tree.leaves_count - len(update.inserted)
+        print(f"changed proofs: {changed_proofs_count} of {existing_count}")
+        print(f"root: {Web3.toHex(update.root)}")
+        if self.args.report:
+            report = {
+                "old_root": Web3.toHex(update.old_root),
+                "root": Web3.toHex(update.root),
+                "updated": update.updated,
+                "inserted": update.inserted,
+                "changed_nodes": [
+                    [level, index, Web3.toHex(node)]
+                    for level, index, node in update.changed_nodes
+                ],
+                "changed_proofs": update.changed_proofs,
+            }
+            with open(self.args.report, "w") as f:
+                json.dump(report, f, indent=2)
+
+    def write_store(self):
+        distributions = {}
+        for value in self.args.inputs:
+            name, _, path = value.partition("=")
+            if not path:
+                name, path = os.path.splitext(os.path.basename(value))[0], value
+            if name in distributions:
+                self.parser.error(f"duplicate distribution name: {name}")
+            with open(path) as f:
+                distributions[name] = json.load(f)
+        write_store(distributions, self.args.output)
+        for name, users in distributions.items():
+            print(f"{name}: {len(users)} users")
+
+    def get_claims(self):
+        try:
+            address_to_bytes(self.args.address)
+        except ValueError as ex:
+            self.parser.error(str(ex))
+        with MerkleStore(self.args.input) as store:
+            try:
+                claims = store.get_claims(self.args.address)
+            except ValueError:
+                # the address is valid, so it is only missing from the store
+                claims = []
+        formatted_claims = {
+            claim.distribution: {
+                "amount": str(claim.value),
+                "proof": [claim.index, [Web3.toHex(v) for v in claim.proof]],
+            }
+            for claim in claims
+        }
+        print(json.dumps(formatted_claims, indent=2))
+
+    def serve(self):
+        if self.args.tree_file:
+            tree = MerkleTreeFile(self.args.input)
+        else:
+            with open(self.args.input) as f:
+                tree = merkle_server.InMemoryMerkleTree(json.load(f))
+        merkle_server.serve(
+            tree,
+            self.args.host,
+            self.args.port,
+            self.args.cache_size,
+            self.args.keepalive_timeout,
+        )
+
+    def write_tree(self):
+        with open(self.args.input) as f:
+            users = json.load(f)
+        write_tree_file(users, self.args.output)
+
     @property
     def parser(self):
         return merkle_parser
@@ -167,32 +584,95 @@ class MerkleCommand(Command):
 
 class AirdropCommand(Command):
     def generate_sample(self):
-        users = generate_users(self.args.users_count, self.args.total_amount)
-        print(sum(int(user["value"]) for user in users))
-        with open(self.args.output, "w") as f:
-            json.dump(users, f, indent=2)
+        if self.args.distribution == "snapshot" and not self.args.snapshot:
+            self.parser.error("--snapshot is required by the snapshot distribution")
+        total_value = generate_sample.write_users(
+            self.args.output,
+            self.args.users_count,
+            self.args.total_amount,
+            seed=self.args.seed,
+            distribution=self.args.distribution,
+            sigma=self.args.sigma,
+            snapshot=self.args.snapshot,
+        )
+        print(total_value)
 
     def generate_boost(self):
-        users = compute_boost_airdrop()
+        if self.args.engine == "numpy":
+            crv_balances = boost_airdrop.get_vecrv_balances(self.args.vecrv_balances)
+            users = vectorized.compute_airdrop(crv_balances=crv_balances)
+        else:
+            users = boost_airdrop.compute_airdrop(self.args.vecrv_balances)
         with open(self.args.output, "w") as f:
             json.dump(users, f, indent=2)
 
+    def verify_boost(self):
+        with open(self.args.reference) as f:
+            reference = json.load(f)
+        report = vectorized.verify_airdrop(
+            vectorized.compute_airdrop(), reference, self.args.tolerance
+        )
+        print(json.dumps(report, indent=2))
+        if not report["ok"]:
+            sys.exit(1)
+
+    def replay_locker(self):
+        balances = get_locker_balances(self.args.blocks)
+        for block, accounts in balances.items():
+            print(f"block {block}: {len(accounts)} accounts")
+        with open(self.args.output, "w") as f:
+            json.dump(balances, f, indent=2)
+
+    def sweep_boost(self):
+        grid = sweep.get_parameter_grid(
+            self.args.min_vecrv_boost,
+            self.args.max_vecrv_boost,
+            self.args.cnc_cutoff,
+            self.args.crv_cutoff,
+            self.args.late_boost_multiplier,
+        )
+        results = sweep.sweep_boost_parameters(grid, self.args.workers or None)
+        print(sweep.format_sweep_table(results))
+        if self.args.output:
+            with open(self.args.output, "w") as f:
+                json.dump(results, f, indent=2)
+
     @property
     def parser(self):
         return airdrop_parser
 
 
+class PipelineCommand(Command):
+    def execute(self):
+        pipeline.run_pipeline(
+            self.args.name,
+            self.args.directory,
+            jobs=self.args.jobs,
+            force=self.args.force,
+            dry_run=self.args.dry_run,
+        )
+
+    @property
+    def parser(self):
+        return pipeline_parser
+
+
 class MiscCommand(Command):
+    def convert_snapshot(self):
+        convert_snapshot(self.args.input, self.args.output)
+
     def fetch_event_times(self):
-        with gzip.open(self.args.input) as f:
-            events = [json.loads(line) for line in f]
-            block_numbers = set(event["blockNumber"] for event in events)
-        web3 = Web3(HTTPProvider(os.environ["ETH_RPC_URL"]))
-        block_timestamps = {}
-        for number in tqdm(block_numbers):
-            block_timestamps[number] = web3.eth.getBlock(number)["timestamp"]
+        block_numbers = {event["blockNumber"] for event in iter_events(self.args.input)}
+        block_timestamps = resolve_block_timestamps(
+            os.environ["ETH_RPC_URL"],
+            block_numbers,
+            anchors_count=self.args.anchors,
+            concurrency=self.args.concurrency,
+            rate_limit=self.args.rate_limit,
+        )
         with open(self.args.output, "w") as f:
             json.dump(block_timestamps, f)
+        report_response_cache()
 
     @property
     def parser(self):
@@ -215,6 +695,9 @@ class RootCommand(Command):
     def misc(self):
         return MiscCommand(self.args)
 
+    def pipeline(self):
+        return PipelineCommand(self.args)
+
     def run(self):
         if not self.args.command:
             parser.error("no command given")
@@ -224,8 +707,10 @@ class RootCommand(Command):
 
 def main():
     args = parser.parse_args()
-    root_command = RootCommand(args)
-    root_command.run()
+    command = " ".join(filter(None, [args.command, getattr(args, "subcommand", None)]))
+    with profiling.profile_command(args, command):
+        root_command = RootCommand(args)
+        root_command.run()
 
 
 if __name__ == "__main__":
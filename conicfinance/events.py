@@ -0,0 +1,22 @@
+"""Streaming reader for gzipped JSON lines event logs
+
+Events are decoded one line at a time straight from the gzip stream, so
+consumers folding them hold a constant amount of memory whatever the length
+of the log. Lines are parsed with `json` rather than a faster parser such as
+orjson, which silently converts integers wider than 64 bits, as token amounts
+usually are, to floats.
+"""
+
+import json
+from typing import Iterator, Optional
+
+from conicfinance import profiling
+
+
+def iter_events(path: str, event_name: Optional[str] = None) -> Iterator[dict]:
+    """Yield the events stored in `path`, only those named `event_name` if set"""
+    with profiling.open_gzip(path) as f:
+        for line in f:
+            event = json.loads(line)
+            if event_name is None or event["event"] == event_name:
+                yield event
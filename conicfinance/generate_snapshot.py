@@ -1,14 +1,24 @@
 import argparse
+import asyncio
 import gzip
 import json
 import os
 from decimal import Decimal
-from os import path
-from typing import Optional
 
-from tqdm import tqdm
-from web3 import HTTPProvider, Web3
-from web3.contract import Contract
+from web3 import Web3
+
+from conicfinance import balances as balances_engine
+from conicfinance import profiling
+from conicfinance.checkpoint import CheckpointStore, add_checkpoint_argument
+from conicfinance.log_scanner import (
+    add_scan_arguments,
+    get_event_abi,
+    scan_event_values,
+)
+from conicfinance.rpc import BatchRPCClient, add_rpc_arguments
+from conicfinance.rpc_cache import report_response_cache
+from conicfinance.snapshot_file import load_snapshot, write_snapshot
+from conicfinance.snapshot_reader import SnapshotContract, load_abi
 
 # snapshot at the time of our announcement Tweet
 SNAPSHOT_BLOCK = 14_494_800
@@ -30,6 +40,7 @@ TOKENS_TO_DISTRIBUTE = TOTAL_SUPPLY // 10  # 10% to vlCVX holders
 
 
 parser = argparse.ArgumentParser(prog="generate-snapshot")
+profiling.add_profile_arguments(parser)
 
 subparsers = parser.add_subparsers(dest="command")
 
@@ -37,6 +48,9 @@ fetch_addresses_parser = subparsers.add_parser(
     "fetch-addresses", help="Fetch all vlCVX holders ever"
 )
 fetch_addresses_parser.add_argument("-o", "--output", help="Output file", required=True)
+add_rpc_arguments(fetch_addresses_parser)
+add_scan_arguments(fetch_addresses_parser)
+add_checkpoint_argument(fetch_addresses_parser)
 
 fetch_balances_parser = subparsers.add_parser(
     "fetch-balances", help="Fetch balances of vlCVX holders at snapshot block"
@@ -44,7 +58,14 @@ fetch_balances_parser = subparsers.add_parser(
 fetch_balances_parser.add_argument(
     "input", help="Input file generated by fetch-addresses"
 )
-fetch_balances_parser.add_argument("-o", "--output", help="Output file", required=True)
+fetch_balances_parser.add_argument(
+    "-o",
+    "--output",
+    help="Output file, in the columnar format if it ends with .snap",
+    required=True,
+)
+balances_engine.add_fetch_arguments(fetch_balances_parser)
+add_checkpoint_argument(fetch_balances_parser)
 
 generate_snapshot_parser = subparsers.add_parser(
     "generate-snapshot", help="Generate the airdrop snapshot"
@@ -57,40 +78,49 @@ generate_snapshot_parser.add_argument(
 )
 
 
-def get_w3():
-    return Web3(HTTPProvider(os.environ["ETH_RPC_URL"]))
-
-
-def get_cvx_locker(w3: Optional[Web3] = None, old: bool = False) -> Contract:
-    if w3 is None:
-        w3 = get_w3()
-    if old:
-        file_name, address = "old-cvx-locker.abi.json", OLD_CVX_LOCKER_ADDRESS
-    else:
-        file_name, address = "cvx-locker.abi.json", CVX_LOCKER_ADDRESS
-
-    with open(path.join(path.dirname(__file__), "abis", file_name)) as f:
-        abi = json.load(f)
-    return w3.eth.contract(address=address, abi=abi)
+async def _fetch_addresses(client, address, abi_file_name, start_block, args):
+    event_abi = get_event_abi(load_abi(abi_file_name), "Staked")
+    with CheckpointStore(args.checkpoint, f"addresses:{address}:Staked") as checkpoint:
+        return await scan_event_values(
+            client,
+            address,
+            event_abi,
+            "_user",
+            start_block,
+            SNAPSHOT_BLOCK,
+            checkpoint,
+            window=args.window,
+            concurrency=args.concurrency,
+        )
 
 
-def _fetch_addresses(locker, start_block, chunk_size=10_000):
-    unique_accounts = set()
-    for block in tqdm(range(start_block, SNAPSHOT_BLOCK, chunk_size)):
-        end_block = min(block + chunk_size, SNAPSHOT_BLOCK)
-        entries = locker.events.Staked.getLogs(fromBlock=block, toBlock=end_block)
-        unique_accounts.update(e["args"]["_user"] for e in entries)
-    return unique_accounts
+async def _fetch_all_addresses(args):
+    async with BatchRPCClient(
+        os.environ["ETH_RPC_URL"],
+        concurrency=args.concurrency,
+        rate_limit=args.rate_limit,
+    ) as client:
+        unique_addresses = await _fetch_addresses(
+            client,
+            CVX_LOCKER_ADDRESS,
+            "cvx-locker.abi.json",
+            CVX_LOCKER_DEPLOYED_BLOCK,
+            args,
+        )
+        unique_addresses |= await _fetch_addresses(
+            client,
+            OLD_CVX_LOCKER_ADDRESS,
+            "old-cvx-locker.abi.json",
+            OLD_CVX_LOCKER_DEPLOYED_BLOCK,
+            args,
+        )
+    return unique_addresses
 
 
 def fetch_addresses(args):
-    locker = get_cvx_locker()
-    old_locker = get_cvx_locker(old=True)
+    unique_addresses = asyncio.run(_fetch_all_addresses(args))
 
-    unique_addresses = _fetch_addresses(locker, CVX_LOCKER_DEPLOYED_BLOCK)
-    unique_addresses.update(_fetch_addresses(old_locker, OLD_CVX_LOCKER_DEPLOYED_BLOCK))
-
-    with gzip.open(args.output, "wt") as f:
+    with profiling.stage("write"), gzip.open(args.output, "wt") as f:
         for account in unique_addresses:
             print(account, file=f)
 
@@ -98,63 +128,62 @@ def fetch_addresses(args):
 
 
 def fetch_balances(args):
-    w3 = get_w3()
-    locker = get_cvx_locker(w3)
-    old_locker = get_cvx_locker(w3, old=True)
-
-    with gzip.open(args.input, "rt") as f:
-        addresses = [line.strip() for line in f]
-
-    balances = []
-    eoa_count = 0
-    for address in tqdm(addresses):
-        balance = locker.functions.balanceOf(address).call(
-            block_identifier=SNAPSHOT_BLOCK
-        )
-        old_balance = old_locker.functions.balanceOf(address).call(
-            block_identifier=SNAPSHOT_BLOCK
-        )
-        total_balance = balance + old_balance
-        is_eoa = len(w3.eth.get_code(address)) == 0
-        eoa_count += is_eoa
-        balances.append(
-            {"address": address, "balance": str(total_balance), "is_eoa": is_eoa}
+    with profiling.stage("read-addresses"):
+        with profiling.open_gzip(args.input, "rt") as f:
+            addresses = [line.strip() for line in f]
+
+    namespace = f"balances:{SNAPSHOT_BLOCK}"
+    with CheckpointStore(args.checkpoint, namespace) as checkpoint:
+        balances = balances_engine.fetch_balances(
+            os.environ["ETH_RPC_URL"],
+            [
+                SnapshotContract(CVX_LOCKER_ADDRESS, "cvx-locker.abi.json"),
+                SnapshotContract(OLD_CVX_LOCKER_ADDRESS, "old-cvx-locker.abi.json"),
+            ],
+            addresses,
+            SNAPSHOT_BLOCK,
+            checkpoint=checkpoint,
+            concurrency=args.concurrency,
+            batch_size=args.batch_size,
+            rate_limit=args.rate_limit,
+            calls_per_aggregate=args.calls_per_multicall,
         )
+    eoa_count = sum(balance["is_eoa"] for balance in balances)
 
-    with gzip.open(args.output, "wt") as f:
-        json.dump(balances, f)
+    with profiling.stage("write"):
+        write_snapshot(balances, args.output)
 
     print(f"found {eoa_count} EOAs")
 
 
 def generate_snapshot(args):
-    with gzip.open(args.input) as f:
-        accounts = json.load(f)
-
-    for account in accounts:
-        account["balance"] = Decimal(account["balance"]) / 10**18
-
-    eligible_accounts = [
-        account for account in accounts if account["balance"] >= CVX_CUTOFF
-    ]
-
-    log_balances = [account["balance"].ln() for account in eligible_accounts]
-    total_log_cvx = sum(log_balances)
-
-    airdrop = []
-    total_value = 0
-    for i, account in enumerate(eligible_accounts):
-        value = log_balances[i] * TOKENS_TO_DISTRIBUTE / total_log_cvx
-        scaled_value = int(value * 10**18)
-        total_value += scaled_value
-        airdrop.append(
-            {
-                "address": account["address"],
-                "value": str(scaled_value),
-            }
-        )
-
-    with open(args.output, "w") as f:
+    accounts = load_snapshot(args.input)
+
+    with profiling.stage("compute"):
+        for account in accounts:
+            account["balance"] = Decimal(account["balance"]) / 10**18
+
+        eligible_accounts = [
+            account for account in accounts if account["balance"] >= CVX_CUTOFF
+        ]
+
+        log_balances = [account["balance"].ln() for account in eligible_accounts]
+        total_log_cvx = sum(log_balances)
+
+        airdrop = []
+        total_value = 0
+        for i, account in enumerate(eligible_accounts):
+            value = log_balances[i] * TOKENS_TO_DISTRIBUTE / total_log_cvx
+            scaled_value = int(value * 10**18)
+            total_value += scaled_value
+            airdrop.append(
+                {
+                    "address": account["address"],
+                    "value": str(scaled_value),
+                }
+            )
+
+    with profiling.stage("write"), open(args.output, "w") as f:
         json.dump(airdrop, f, indent=2)
 
     print(f"total value: {total_value / 1e18}")
@@ -162,14 +191,16 @@ def generate_snapshot(args):
 
 def main():
     args = parser.parse_args()
-    if args.command == "fetch-addresses":
-        fetch_addresses(args)
-    elif args.command == "fetch-balances":
-        fetch_balances(args)
-    elif args.command == "generate-snapshot":
-        generate_snapshot(args)
-    else:
-        parser.error("no command given")
+    with profiling.profile_command(args, f"generate-snapshot {args.command}"):
+        if args.command == "fetch-addresses":
+            fetch_addresses(args)
+        elif args.command == "fetch-balances":
+            fetch_balances(args)
+        elif args.command == "generate-snapshot":
+            generate_snapshot(args)
+        else:
+            parser.error("no command given")
+        report_response_cache()
 
 
 if __name__ == "__main__":
@@ -1,7 +1,10 @@
 from decimal import Decimal
-import gzip
 import json
 from os import path
+from typing import Iterable, Iterator, List, NamedTuple, Optional
+
+from conicfinance import profiling
+from conicfinance.snapshot_file import get_addresses_with_balance
 
 DATA_PATH = path.join(path.dirname(__file__), "../../data")
 
@@ -14,18 +17,55 @@ VLCVX_HOLDERS = path.join(DATA_PATH, "vlcvx-snapshot-balances.json.gz")
 OG_WHITELIST = path.join(DATA_PATH, "og_whitelist.txt")
 
 
-def generate(output_file: str):
-    users = set()
-    for cutoff, filename in zip(
-        [CUT_OFF_CRV, CUT_OFF_CVX], [VECRV_HOLDERS, VLCVX_HOLDERS]
-    ):
-        with gzip.open(filename) as f:
-            holders = json.load(f)
-        for holder in holders:
-            if Decimal(holder["balance"]) >= cutoff:
-                users.add(holder["address"])
-    with open(OG_WHITELIST) as f:
+class WhitelistSource(NamedTuple):
+    """Snapshot whose accounts holding at least `cutoff` are whitelisted, or
+    list of addresses, one per line, whitelisted as is if `cutoff` is None
+    """
+
+    path: str
+    cutoff: Optional[int] = None
+
+
+DEFAULT_SOURCES = [
+    WhitelistSource(VECRV_HOLDERS, int(CUT_OFF_CRV)),
+    WhitelistSource(VLCVX_HOLDERS, int(CUT_OFF_CVX)),
+    WhitelistSource(OG_WHITELIST),
+]
+
+
+def parse_source(value: str) -> WhitelistSource:
+    """Parse `path` or `path:cutoff`, with a cutoff in tokens"""
+    file_path, _, cutoff = value.partition(":")
+    if not cutoff:
+        return WhitelistSource(file_path)
+    return WhitelistSource(file_path, int(Decimal(cutoff) * 10**18))
+
+
+def iter_source_addresses(source: WhitelistSource) -> Iterator[str]:
+    if source.cutoff is not None:
+        yield from get_addresses_with_balance(source.path, source.cutoff)
+        return
+    open_file = profiling.open_gzip if source.path.endswith(".gz") else open
+    with open_file(source.path, "rt") as f:
         for line in f:
-            users.add(line.strip())
+            if line.strip():
+                yield line.strip()
+
+
+def build_whitelist(sources: Iterable[WhitelistSource]) -> List[str]:
+    """Addresses of all `sources`, without duplicates and sorted
+    Addresses are compared case-insensitively and sorted by their bytes, so
+    the output does not depend on the order or the casing of the inputs
+    """
+    users = {}
+    for source in sources:
+        for address in iter_source_addresses(source):
+            users.setdefault(address.lower(), address)
+    return [users[key] for key in sorted(users)]
+
+
+def generate(output_file: str, sources: Iterable[WhitelistSource] = DEFAULT_SOURCES):
+    users = build_whitelist(sources)
     with open(output_file, "w") as f:
-        json.dump(list(users), f)
+        json.dump(users, f)
+    return users
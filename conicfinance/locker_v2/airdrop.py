@@ -1,12 +1,17 @@
 import datetime as dt
-import gzip
 import json
+import os
 from collections import defaultdict
 from decimal import Decimal
 from os import path
-from typing import Dict
+from typing import Dict, Iterable, List
 import math
 
+from conicfinance import profiling
+from conicfinance.block_times import resolve_block_timestamps
+from conicfinance.events import iter_events
+from conicfinance.snapshot_file import load_snapshot
+
 
 DATA_PATH = path.join(path.dirname(__file__), "../../data")
 
@@ -39,33 +44,55 @@ EXCLUDED_ADDRESSES = {
 }
 
 
-def get_total_cnc_locked_per_user():
-    with gzip.open(CNC_LOCK_EVENTS) as f:
-        events = [json.loads(line) for line in f]
-    with open(CNC_LOCK_EVENT_TIMES) as f:
-        times = json.load(f)
-
-    total_locked_per_user = {}
-    for event in events:
-        if event["event"] != "Locked":
-            continue
+def get_event_times(block_numbers: Iterable[int]) -> Dict[int, int]:
+    """Timestamps of the given blocks, read from `CNC_LOCK_EVENT_TIMES` when
+    available and resolved through `ETH_RPC_URL` otherwise
+    """
+    times = {}
+    with profiling.stage("event-times"):
+        if path.exists(CNC_LOCK_EVENT_TIMES):
+            with open(CNC_LOCK_EVENT_TIMES) as f:
+                times = {int(k): v for k, v in json.load(f).items()}
+        missing_blocks = set(block_numbers) - times.keys()
+        if missing_blocks:
+            times.update(
+                resolve_block_timestamps(os.environ["ETH_RPC_URL"], missing_blocks)
+            )
+    return times
+
+
+def get_cnc_locked_per_user_by_period() -> Dict[str, List[int]]:
+    """Amount times lock duration of each user, split between the locks made
+    before and after `LATE_BOOST_TIME`
+    The events are streamed twice, to resolve the block times and then to
+    fold the locks, instead of being kept in memory
+    """
+    times = get_event_times(
+        event["blockNumber"] for event in iter_events(CNC_LOCK_EVENTS, "Locked")
+    )
 
-        event_time = times[str(event["blockNumber"])]
+    locked_per_user = {}
+    for event in iter_events(CNC_LOCK_EVENTS, "Locked"):
+        event_time = times[event["blockNumber"]]
         account, amount, unlockTime = event["args"]["account"], event["args"]["amount"], event["args"]["unlockTime"]
 
         amountTime = amount * (unlockTime - event_time)
 
-        total_locked_per_user.setdefault(account, 0)
-        if event_time >= LATE_BOOST_TIME:
-            amountTime *= LATE_BOOST_MULTIPLIER
-        total_locked_per_user[account] += amountTime
+        locked = locked_per_user.setdefault(account, [0, 0])
+        locked[event_time >= LATE_BOOST_TIME] += amountTime
 
-    return total_locked_per_user
+    return locked_per_user
 
 
-def get_total_crv_locked_per_user():
-    with gzip.open(LOCKED_CRV) as f:
-        return json.load(f)
+def get_total_cnc_locked_per_user(late_boost_multiplier: int = LATE_BOOST_MULTIPLIER):
+    return {
+        account: early + late * late_boost_multiplier
+        for account, (early, late) in get_cnc_locked_per_user_by_period().items()
+    }
+
+
+def get_total_crv_locked_per_user(locked_crv_file: str = LOCKED_CRV):
+    return load_snapshot(locked_crv_file)
 
 
 def flatten(value: Decimal) -> Decimal:
@@ -134,22 +161,28 @@ def compute_CNC_airdrop_boost(
 
 
 def compute_vlcnc_airdrop_boost():
-    balances = get_total_cnc_locked_per_user()
-    return compute_CNC_airdrop_boost(balances, CNC_CUTOFF)
+    with profiling.stage("vlcnc-boost"):
+        balances = get_total_cnc_locked_per_user()
+        return compute_CNC_airdrop_boost(balances, CNC_CUTOFF)
 
 
-def compute_vecrv_airdrop():
-    balances = {
+def get_vecrv_balances(locked_crv_file: str = LOCKED_CRV) -> Dict[str, int]:
+    return {
         account: int(item["balance"])
-        for item in get_total_crv_locked_per_user()
+        for item in get_total_crv_locked_per_user(locked_crv_file)
         if (account := item["address"]) not in EXCLUDED_ADDRESSES
     }
-    return compute_CRV_airdrop_boost(balances, MIN_VCERV_BOOST, MAX_VECRV_BOOST, CRV_CUTOFF)
 
 
-def compute_airdrop():
+def compute_vecrv_airdrop(locked_crv_file: str = LOCKED_CRV):
+    with profiling.stage("vecrv-boost"):
+        balances = get_vecrv_balances(locked_crv_file)
+        return compute_CRV_airdrop_boost(balances, MIN_VCERV_BOOST, MAX_VECRV_BOOST, CRV_CUTOFF)
+
+
+def compute_airdrop(locked_crv_file: str = LOCKED_CRV):
     vlcnc_boost = compute_vlcnc_airdrop_boost()
-    vecrv_boost = compute_vecrv_airdrop()
+    vecrv_boost = compute_vecrv_airdrop(locked_crv_file)
 
     return [
         {
@@ -0,0 +1,111 @@
+"""Reconstruction of the CNC locker balances from its event log
+
+The locker keeps a list of vote locks, (amount, unlock time), per account and
+only changes it through two events:
+
+* `Locked`: a new lock is appended, and when `relocked` is set the unlock
+  time of all the existing locks of the account is moved to the new one
+* `UnlockExecuted`: the locks whose unlock time has passed are removed, for
+  a total of `amount`
+
+Every lock has the same fixed duration, so the unlock times of the locks of
+an account only grow: they are ordered by unlock time and the unlocked ones
+are always the first ones. `LockerState` checks this assumption and raises
+if a lock ends before the previous one. Replaying the events in order
+therefore gives the locks of every account at any block, and balances at
+many blocks can be computed from a single pass over the log.
+Shutting down the locker does not emit an event and is not replayed.
+
+The bundled event log has no `UnlockExecuted` events, so expired locks are
+never removed and `locked_balance` overstates balances after expiry. The
+`balance` field, computed from the unlock times, is the one to use.
+"""
+
+from typing import Dict, Iterable, List
+
+from conicfinance.events import iter_events
+from conicfinance.locker_v2.airdrop import CNC_LOCK_EVENTS, get_event_times
+
+
+class LockerState:
+    """Vote locks of every account, updated one event at a time"""
+
+    def __init__(self):
+        self.locks: Dict[str, List[List[int]]] = {}
+
+    def apply(self, event: dict):
+        args = event["args"]
+        if event["event"] == "Locked":
+            locks = self.locks.setdefault(args["account"], [])
+            if args["relocked"]:
+                for lock in locks:
+                    lock[1] = args["unlockTime"]
+            if locks and args["unlockTime"] < locks[-1][1]:
+                raise ValueError(
+                    f"lock of {args['account']} at block {event['blockNumber']} "
+                    "ends before the previous one, lock durations are not fixed"
+                )
+            locks.append([args["amount"], args["unlockTime"]])
+        elif event["event"] == "UnlockExecuted":
+            self._remove_unlocked(event, args["account"], args["amount"])
+
+    def _remove_unlocked(self, event: dict, account: str, amount: int):
+        locks = self.locks.get(account, [])
+        unlocked_amount = 0
+        unlocked_count = 0
+        while unlocked_amount < amount and unlocked_count < len(locks):
+            unlocked_amount += locks[unlocked_count][0]
+            unlocked_count += 1
+        if unlocked_amount != amount:
+            raise ValueError(
+                f"UnlockExecuted of {amount} for {account} at block "
+                f"{event['blockNumber']} does not match its locks"
+            )
+        del locks[:unlocked_count]
+
+    def get_balances(self, timestamp: int) -> List[dict]:
+        """Balances of the accounts with locks at `timestamp`
+        `locked_balance` includes the locks that could be unlocked but have not
+        been yet, or whose `UnlockExecuted` event is missing from the log,
+        while `balance` only counts the ones still running
+        """
+        balances = []
+        for account, locks in self.locks.items():
+            if not locks:
+                continue
+            balance = sum(amount for amount, end in locks if end > timestamp)
+            balances.append(
+                {
+                    "address": account,
+                    "balance": str(balance),
+                    "locked_balance": str(sum(amount for amount, _ in locks)),
+                }
+            )
+        return balances
+
+
+def replay_balances(
+    events: Iterable[dict], blocks: Iterable[int], timestamps: Dict[int, int]
+) -> Dict[int, List[dict]]:
+    """Balances at each of `blocks`, after all the events of the block
+    `events` must be in chain order and `timestamps` map blocks to their time
+    """
+    blocks = sorted(set(blocks))
+    state = LockerState()
+    balances = {}
+    i = 0
+    for event in events:
+        while i < len(blocks) and blocks[i] < event["blockNumber"]:
+            balances[blocks[i]] = state.get_balances(timestamps[blocks[i]])
+            i += 1
+        state.apply(event)
+    for block in blocks[i:]:
+        balances[block] = state.get_balances(timestamps[block])
+    return balances
+
+
+def get_locker_balances(blocks: Iterable[int]) -> Dict[int, List[dict]]:
+    """Balances of the CNC locker at `blocks`, replayed from `CNC_LOCK_EVENTS`"""
+    blocks = list(blocks)
+    timestamps = get_event_times(blocks)
+    return replay_balances(iter_events(CNC_LOCK_EVENTS), blocks, timestamps)
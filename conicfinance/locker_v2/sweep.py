@@ -0,0 +1,187 @@
+"""Evaluation of the boost computation over a grid of parameters
+
+Events and balances are loaded once and reduced to per-user arrays that are
+shared with the worker processes. Every worker evaluates parameter sets with
+the vectorized boost engine and keeps the log balances of each late boost
+multiplier it sees, so the grid is ordered to group parameter sets sharing
+the same multiplier.
+
+Cutoffs are compared with float64 balances, so a user within a rounding
+error of a cutoff may be classified differently than by `compute_airdrop`.
+"""
+
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from conicfinance.locker_v2.airdrop import (
+    MIN_VLCNC_BOOST,
+    MULTIPLIER,
+    get_cnc_locked_per_user_by_period,
+    get_vecrv_balances,
+)
+from conicfinance.locker_v2.vectorized import compute_CNC_boosts, compute_CRV_boosts
+
+PERCENTILES = (10, 50, 90, 99)
+
+
+class BoostParameters(NamedTuple):
+    min_vecrv_boost: float
+    max_vecrv_boost: float
+    # cutoffs are not scaled by `MULTIPLIER`
+    cnc_cutoff: float
+    crv_cutoff: float
+    late_boost_multiplier: float
+
+
+class SweepInputs(NamedTuple):
+    """Unscaled balances of all users, aligned on the same accounts"""
+
+    early_cnc: np.ndarray
+    late_cnc: np.ndarray
+    crv: np.ndarray
+
+
+def load_sweep_inputs() -> SweepInputs:
+    cnc_balances = get_cnc_locked_per_user_by_period()
+    crv_balances = get_vecrv_balances()
+    accounts = list(cnc_balances.keys() | crv_balances.keys())
+
+    def to_array(values: Iterable[int]) -> np.ndarray:
+        return np.fromiter(
+            (v / MULTIPLIER for v in values), dtype=np.float64, count=len(accounts)
+        )
+
+    return SweepInputs(
+        early_cnc=to_array(cnc_balances.get(k, (0, 0))[0] for k in accounts),
+        late_cnc=to_array(cnc_balances.get(k, (0, 0))[1] for k in accounts),
+        crv=to_array(crv_balances.get(k, 0) for k in accounts),
+    )
+
+
+def get_parameter_grid(
+    min_vecrv_boosts: List[float],
+    max_vecrv_boosts: List[float],
+    cnc_cutoffs: List[float],
+    crv_cutoffs: List[float],
+    late_boost_multipliers: List[float],
+) -> List[BoostParameters]:
+    combinations = itertools.product(
+        late_boost_multipliers,
+        cnc_cutoffs,
+        crv_cutoffs,
+        min_vecrv_boosts,
+        max_vecrv_boosts,
+    )
+    return [
+        BoostParameters(min_boost, max_boost, cnc_cutoff, crv_cutoff, multiplier)
+        for multiplier, cnc_cutoff, crv_cutoff, min_boost, max_boost in combinations
+    ]
+
+
+def gini(values: np.ndarray) -> float:
+    if len(values) == 0 or values.sum() == 0:
+        return 0.0
+    values = np.sort(values)
+    n = len(values)
+    weighted_sum = np.dot(np.arange(1, n + 1), values)
+    return float(2 * weighted_sum / (n * values.sum()) - (n + 1) / n)
+
+
+_inputs: Optional[SweepInputs] = None
+_crv_amounts: Optional[np.ndarray] = None
+_cnc_amounts: Dict[float, Tuple[np.ndarray, np.ndarray]] = {}
+
+
+def _init_worker(inputs: SweepInputs):
+    global _inputs, _crv_amounts
+    _inputs = inputs
+    _cnc_amounts.clear()
+    # users without balance are never above a cutoff, ignore their log
+    with np.errstate(divide="ignore"):
+        _crv_amounts = np.log(inputs.crv)
+
+
+def _get_cnc_amounts(late_boost_multiplier: float) -> Tuple[np.ndarray, np.ndarray]:
+    if late_boost_multiplier not in _cnc_amounts:
+        totals = _inputs.early_cnc + _inputs.late_cnc * late_boost_multiplier
+        with np.errstate(divide="ignore"):
+            _cnc_amounts[late_boost_multiplier] = (totals, np.log(totals))
+    return _cnc_amounts[late_boost_multiplier]
+
+
+def evaluate_parameters(parameters: BoostParameters) -> dict:
+    """Summary of the airdrop computed with `parameters`, in unscaled tokens"""
+    cnc_totals, cnc_amounts = _get_cnc_amounts(parameters.late_boost_multiplier)
+    cnc_eligible = cnc_totals >= parameters.cnc_cutoff
+    crv_eligible = _inputs.crv >= parameters.crv_cutoff
+
+    vlcnc_boosts = np.ones(len(cnc_totals))
+    vecrv_boosts = np.ones(len(cnc_totals))
+    if cnc_eligible.any():
+        vlcnc_boosts[cnc_eligible] = compute_CNC_boosts(
+            cnc_amounts[cnc_eligible], float(MIN_VLCNC_BOOST)
+        )
+    if crv_eligible.any():
+        vecrv_boosts[crv_eligible] = compute_CRV_boosts(
+            _crv_amounts[crv_eligible],
+            parameters.min_vecrv_boost,
+            parameters.max_vecrv_boost,
+        )
+    values = (vlcnc_boosts * vecrv_boosts)[cnc_eligible | crv_eligible]
+
+    percentiles = [0.0] * len(PERCENTILES)
+    if len(values):
+        percentiles = np.percentile(values, PERCENTILES)
+    return {
+        **parameters._asdict(),
+        "users": len(values),
+        "total_supply": float(values.sum()),
+        "gini": gini(values),
+        **{f"p{q}": float(v) for q, v in zip(PERCENTILES, percentiles)},
+    }
+
+
+def sweep_boost_parameters(
+    grid: List[BoostParameters], workers: Optional[int] = None
+) -> List[dict]:
+    """Evaluate every parameter set of `grid`, results are in the grid order"""
+    if workers is None:
+        workers = os.cpu_count() or 1
+    inputs = load_sweep_inputs()
+
+    if workers <= 1:
+        _init_worker(inputs)
+        return [evaluate_parameters(parameters) for parameters in grid]
+
+    # contiguous chunks keep the parameter sets sharing a multiplier together
+    chunksize = max(len(grid) // (workers * 4), 1)
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(inputs,)
+    ) as executor:
+        return list(executor.map(evaluate_parameters, grid, chunksize=chunksize))
+
+
+def format_sweep_table(results: List[dict]) -> str:
+    columns = [
+        ("min_vecrv_boost", "min veCRV", "{:.3f}"),
+        ("max_vecrv_boost", "max veCRV", "{:.3f}"),
+        ("cnc_cutoff", "CNC cutoff", "{:.4g}"),
+        ("crv_cutoff", "CRV cutoff", "{:.4g}"),
+        ("late_boost_multiplier", "late mult", "{:g}"),
+        ("users", "users", "{:d}"),
+        ("total_supply", "supply used", "{:.2f}"),
+        ("gini", "gini", "{:.4f}"),
+    ] + [(f"p{q}", f"p{q}", "{:.4f}") for q in PERCENTILES]
+
+    rows = [[title for _, title, _ in columns]]
+    for result in results:
+        rows.append([fmt.format(result[key]) for key, _, fmt in columns])
+    widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+    return "\n".join(
+        "  ".join(cell.rjust(width) for cell, width in zip(row, widths))
+        for row in rows
+    )
@@ -0,0 +1,136 @@
+"""NumPy implementation of the Locker V2 boost computation
+
+Boosts are computed in float64 over whole arrays at once. Only the final
+`value` of each user goes through `Decimal`, so that it is truncated to wei
+the same way as in `airdrop.compute_airdrop`. `verify_airdrop` compares the
+results with the ones of the `Decimal` implementation.
+"""
+
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from conicfinance import profiling
+from conicfinance.locker_v2.airdrop import (
+    CNC_CUTOFF,
+    CRV_CUTOFF,
+    MAX_VECRV_BOOST,
+    MIN_VCERV_BOOST,
+    MIN_VLCNC_BOOST,
+    MULTIPLIER,
+    get_total_cnc_locked_per_user,
+    get_vecrv_balances,
+)
+
+# relative difference allowed with the `Decimal` implementation
+DEFAULT_TOLERANCE = 1e-12
+
+BOOST_FIELDS = ("value", "vlcnc_boost", "vecrv_boost")
+
+
+def flatten_balances(
+    balances: Dict[str, int], cutoff: int
+) -> Tuple[List[str], np.ndarray]:
+    """Accounts with at least `cutoff` and the log of their unscaled balances"""
+    accounts = [k for k, v in balances.items() if v >= cutoff]
+    # int / int is correctly rounded, unlike converting the balances first
+    amounts = np.fromiter(
+        (balances[k] / MULTIPLIER for k in accounts),
+        dtype=np.float64,
+        count=len(accounts),
+    )
+    return accounts, np.log(amounts)
+
+
+def compute_CRV_boosts(
+    amounts: np.ndarray, min_boost: float, max_boost: float
+) -> np.ndarray:
+    min_amount, max_amount = amounts.min(), amounts.max()
+    standardized = np.sqrt(amounts - min_amount) / np.sqrt(max_amount - min_amount)
+    return min_boost + standardized * (max_boost - min_boost)
+
+
+def compute_CNC_boosts(amounts: np.ndarray, min_boost: float) -> np.ndarray:
+    subbed = amounts - amounts.min()
+    return np.sqrt(subbed) / np.sqrt(subbed.max()) + min_boost
+
+
+def compute_airdrop(
+    cnc_balances: Optional[Dict[str, int]] = None,
+    crv_balances: Optional[Dict[str, int]] = None,
+) -> List[dict]:
+    """Same output as `airdrop.compute_airdrop`, ordered by vlCNC accounts first
+    Balances are loaded from the data files when not given
+    """
+    with profiling.stage("load-balances"):
+        if cnc_balances is None:
+            cnc_balances = get_total_cnc_locked_per_user()
+        if crv_balances is None:
+            crv_balances = get_vecrv_balances()
+
+    with profiling.stage("compute-boosts"):
+        return _compute_airdrop(cnc_balances, crv_balances)
+
+
+def _compute_airdrop(
+    cnc_balances: Dict[str, int], crv_balances: Dict[str, int]
+) -> List[dict]:
+    cnc_accounts, cnc_amounts = flatten_balances(cnc_balances, CNC_CUTOFF)
+    crv_accounts, crv_amounts = flatten_balances(crv_balances, CRV_CUTOFF)
+
+    indices = {account: i for i, account in enumerate(cnc_accounts)}
+    for account in crv_accounts:
+        indices.setdefault(account, len(indices))
+    vlcnc_boosts = np.ones(len(indices))
+    vecrv_boosts = np.ones(len(indices))
+    vlcnc_boosts[: len(cnc_accounts)] = compute_CNC_boosts(
+        cnc_amounts, float(MIN_VLCNC_BOOST)
+    )
+    vecrv_boosts[[indices[k] for k in crv_accounts]] = compute_CRV_boosts(
+        crv_amounts, float(MIN_VCERV_BOOST), float(MAX_VECRV_BOOST)
+    )
+    boosts = vlcnc_boosts * vecrv_boosts
+
+    return [
+        {
+            "address": account,
+            "value": int(Decimal(boosts[i]) * MULTIPLIER),
+            "vlcnc_boost": float(vlcnc_boosts[i]),
+            "vecrv_boost": float(vecrv_boosts[i]),
+        }
+        for account, i in indices.items()
+    ]
+
+
+def verify_airdrop(
+    users: List[dict], reference: List[dict], tolerance: float = DEFAULT_TOLERANCE
+) -> dict:
+    """Compare `users` with `reference` and return a report of the differences
+    The report is `ok` if both have the same addresses and all fields agree
+    within a relative `tolerance`
+    """
+    by_address = {user["address"]: user for user in users}
+    reference_by_address = {user["address"]: user for user in reference}
+    common = sorted(by_address.keys() & reference_by_address.keys())
+
+    max_errors = {}
+    mismatches = set()
+    for field in BOOST_FIELDS:
+        actual = np.array([float(by_address[a][field]) for a in common])
+        expected = np.array([float(reference_by_address[a][field]) for a in common])
+        errors = np.abs(actual - expected) / np.abs(expected)
+        max_errors[field] = float(errors.max()) if len(errors) else 0.0
+        mismatches.update(common[i] for i in np.flatnonzero(errors > tolerance))
+
+    missing = reference_by_address.keys() - by_address.keys()
+    extra = by_address.keys() - reference_by_address.keys()
+    return {
+        "ok": not (missing or extra or mismatches),
+        "tolerance": tolerance,
+        "users": len(common),
+        "max_relative_errors": max_errors,
+        "mismatches": sorted(mismatches),
+        "missing": sorted(missing),
+        "extra": sorted(extra),
+    }
@@ -0,0 +1,218 @@
+"""Concurrent `eth_getLogs` scanning over adaptively sized block windows
+
+Windows are halved when the provider rejects a range as too large and
+doubled while ranges come back sparse. Several windows are fetched at once
+and the logs are returned in block order.
+"""
+
+import asyncio
+import collections
+from typing import Callable, List, Optional, Set, Tuple
+
+from eth_abi import decode_abi, decode_single
+from eth_utils import event_abi_to_log_topic
+from tqdm import tqdm
+from web3 import Web3
+
+from conicfinance import profiling
+from conicfinance.checkpoint import CheckpointStore
+from conicfinance.rpc import BatchRPCClient, RPCError
+from conicfinance.snapshot_reader import get_abi_type
+
+DEFAULT_WINDOW = 10_000
+DEFAULT_MAX_WINDOW = 500_000
+DEFAULT_SPARSE_THRESHOLD = 1_000
+DEFAULT_SCAN_CONCURRENCY = 4
+
+# fragments of the errors returned by common providers for oversized queries,
+# specific enough not to match other errors such as invalid block parameters.
+# Error codes are not used, Infura for instance also returns -32005 when rate
+# limiting, which `BatchRPCClient` retries
+RANGE_ERROR_MESSAGES = (
+    "block range too large",
+    "block range is too",
+    "max block range",
+    "maximum block range",
+    "range too large",
+    "returned more than",
+    "too many results",
+    "response size exceeded",
+    "query timeout",
+)
+
+
+def is_range_error(error: RPCError) -> bool:
+    message = error.message.lower()
+    return any(m in message for m in RANGE_ERROR_MESSAGES)
+
+
+def get_event_abi(abi: list, event_name: str) -> dict:
+    for item in abi:
+        if item.get("type") == "event" and item["name"] == event_name:
+            return item
+    raise ValueError(f"no event {event_name} in ABI")
+
+
+def get_event_topic(event_abi: dict) -> str:
+    return "0x" + event_abi_to_log_topic(event_abi).hex()
+
+
+def decode_log(event_abi: dict, log: dict) -> dict:
+    """Decode the arguments of a raw `eth_getLogs` entry"""
+    topics = log["topics"][1:]
+    indexed = [i for i in event_abi["inputs"] if i["indexed"]]
+    not_indexed = [i for i in event_abi["inputs"] if not i["indexed"]]
+
+    args = {}
+    for param, topic in zip(indexed, topics):
+        value = decode_single(get_abi_type(param), bytes.fromhex(topic[2:]))
+        args[param["name"]] = _format_value(param, value)
+    values = decode_abi(
+        [get_abi_type(p) for p in not_indexed], bytes.fromhex(log["data"][2:])
+    )
+    for param, value in zip(not_indexed, values):
+        args[param["name"]] = _format_value(param, value)
+    return args
+
+
+def _format_value(param: dict, value):
+    # checksum addresses as web3 does when decoding events
+    if param["type"] == "address":
+        return Web3.toChecksumAddress(value)
+    return value
+
+
+class LogScanner:
+    def __init__(
+        self,
+        client: BatchRPCClient,
+        address: str,
+        topics: list,
+        window: int = DEFAULT_WINDOW,
+        max_window: int = DEFAULT_MAX_WINDOW,
+        sparse_threshold: int = DEFAULT_SPARSE_THRESHOLD,
+        concurrency: int = DEFAULT_SCAN_CONCURRENCY,
+    ):
+        self.client = client
+        self.address = address
+        self.topics = topics
+        self.window = window
+        self.max_window = max_window
+        self.sparse_threshold = sparse_threshold
+        self.concurrency = concurrency
+
+    async def scan(
+        self,
+        from_block: int,
+        to_block: int,
+        on_range_done: Optional[Callable[[int, int, List[dict]], None]] = None,
+    ) -> List[dict]:
+        """Return all logs between `from_block` and `to_block` included, in order
+        `on_range_done` is called with every completed range and its logs
+        """
+        # ranges are completed in dispatch order so that the windows, and hence
+        # the requests, only depend on the responses and not on their timing
+        logs = []
+        cursor = from_block
+        pending = collections.deque()
+        try:
+            while cursor <= to_block or pending:
+                while cursor <= to_block and len(pending) < self.concurrency:
+                    end = min(cursor + self.window - 1, to_block)
+                    pending.append(
+                        asyncio.ensure_future(self._fetch_range(cursor, end))
+                    )
+                    cursor = end + 1
+
+                ranges, was_split = await pending.popleft()
+                for start, end, range_logs in ranges:
+                    logs.extend(range_logs)
+                    if on_range_done:
+                        on_range_done(start, end, range_logs)
+                self._adapt_window(ranges, was_split)
+        except BaseException:
+            # do not leave the other windows running once the scan failed
+            for future in pending:
+                future.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            raise
+
+        return logs
+
+    def _adapt_window(self, ranges: List[Tuple[int, int, List[dict]]], was_split: bool):
+        if was_split:
+            self.window = max(min(end - start + 1 for start, end, _ in ranges), 1)
+        elif all(len(logs) < self.sparse_threshold for _, _, logs in ranges):
+            self.window = min(self.window * 2, self.max_window)
+
+    async def _fetch_range(
+        self, start: int, end: int
+    ) -> Tuple[List[Tuple[int, int, List[dict]]], bool]:
+        params = {
+            "address": self.address,
+            "topics": self.topics,
+            "fromBlock": hex(start),
+            "toBlock": hex(end),
+        }
+        try:
+            logs = await self.client.request("eth_getLogs", [params])
+            return [(start, end, logs)], False
+        except RPCError as ex:
+            if start == end or not is_range_error(ex):
+                raise
+
+        middle = (start + end) // 2
+        left, _ = await self._fetch_range(start, middle)
+        right, _ = await self._fetch_range(middle + 1, end)
+        return left + right, True
+
+
+async def scan_event_values(
+    client: BatchRPCClient,
+    address: str,
+    event_abi: dict,
+    arg_name: str,
+    from_block: int,
+    to_block: int,
+    checkpoint: CheckpointStore,
+    window: int = DEFAULT_WINDOW,
+    concurrency: int = DEFAULT_SCAN_CONCURRENCY,
+) -> Set[str]:
+    """Return the distinct values of `arg_name` in the `event_abi` events
+    emitted by `address`. Ranges already recorded in `checkpoint` are skipped
+    and every completed range is recorded in it
+    """
+    scanner = LogScanner(
+        client,
+        address,
+        [get_event_topic(event_abi)],
+        window=window,
+        concurrency=concurrency,
+    )
+
+    def on_range_done(start, end, logs):
+        values = {
+            (str(decode_log(event_abi, log)[arg_name]), int(log["blockNumber"], 16))
+            for log in logs
+        }
+        checkpoint.add_range(start, end, values)
+        progress.update(end - start + 1)
+
+    missing_ranges = checkpoint.missing_ranges(from_block, to_block)
+    total_blocks = to_block - from_block + 1
+    missing_blocks = sum(end - start + 1 for start, end in missing_ranges)
+    with profiling.stage("scan-logs"), tqdm(
+        total=total_blocks, initial=total_blocks - missing_blocks, unit="block"
+    ) as progress:
+        for start, end in missing_ranges:
+            await scanner.scan(start, end, on_range_done=on_range_done)
+    return checkpoint.range_values(from_block, to_block)
+
+
+def add_scan_arguments(parser):
+    parser.add_argument(
+        "--window",
+        type=int,
+        default=DEFAULT_WINDOW,
+        help="Initial number of blocks per eth_getLogs call",
+    )
@@ -0,0 +1,62 @@
+"""Tightly packed keccak256 hashing for Merkle leaves and nodes
+
+Produces the same digests as `Web3.solidityKeccak` for the `address`,
+`address, uint256` and `bytes32, bytes32` encodings used by the tree, but
+packs the operands directly into reusable buffers instead of going through
+ABI type validation and hex conversions on every call.
+"""
+
+from typing import Union
+
+from eth_hash.auto import keccak
+
+ADDRESS_SIZE = 20
+WORD_SIZE = 32
+
+MAX_UINT256 = 2**256 - 1
+
+# solidityKeccak(["uint256"], [0]), used to pad odd levels
+ZERO_HASH = keccak(bytes(WORD_SIZE))
+
+
+def address_to_bytes(address: str) -> bytes:
+    hex_address = address[2:] if address[:2] in ("0x", "0X") else address
+    try:
+        raw_address = bytes.fromhex(hex_address)
+    except ValueError:
+        raise ValueError(f"invalid address: {address}") from None
+    if len(raw_address) != ADDRESS_SIZE:
+        raise ValueError(f"invalid address: {address}")
+    return raw_address
+
+
+class PackedHasher:
+    """Hashes packed operands using buffers allocated once per instance"""
+
+    def __init__(self):
+        self._address_value = bytearray(ADDRESS_SIZE + WORD_SIZE)
+        self._pair = bytearray(2 * WORD_SIZE)
+
+    def hash_address(self, address: bytes) -> bytes:
+        return keccak(address)
+
+    def hash_address_value(self, address: bytes, value: int) -> bytes:
+        if not 0 <= value <= MAX_UINT256:
+            raise ValueError(f"value out of uint256 range: {value}")
+        buffer = self._address_value
+        buffer[:ADDRESS_SIZE] = address
+        buffer[ADDRESS_SIZE:] = value.to_bytes(WORD_SIZE, "big")
+        return keccak(buffer)
+
+    def hash_pair(self, left: bytes, right: bytes) -> bytes:
+        buffer = self._pair
+        buffer[:WORD_SIZE] = left
+        buffer[WORD_SIZE:] = right
+        return keccak(buffer)
+
+    def hash_user(self, user: Union[dict, str]) -> bytes:
+        if isinstance(user, str):
+            return self.hash_address(address_to_bytes(user))
+        return self.hash_address_value(
+            address_to_bytes(user["address"]), int(user["value"])
+        )
@@ -0,0 +1,194 @@
+"""Incremental updates of a persisted Merkle tree
+
+Values of existing leaves are updated in place and new users are appended as
+new leaves, so the index of every existing leaf is kept. Only the ancestors
+of the changed leaves are rehashed, O(k log n) nodes for k changes, instead
+of the whole tree.
+
+A proof holds the sibling of every node on the path from its leaf to the
+root, and the path of any other leaf meets the path of a changed leaf at
+some level. Any change therefore also changes one node in the proof of every
+other leaf: the proofs to republish are, in the general case, all of them.
+`TreeUpdate` lists the changed nodes, which are enough to patch published
+proofs, and the ranges of leaves whose proofs changed.
+"""
+
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+
+from conicfinance.merkle.hashing import ZERO_HASH, PackedHasher, address_to_bytes
+from conicfinance.merkle.proof import get_value
+from conicfinance.merkle.tree import generate_merkle_levels
+from conicfinance.merkle.tree_file import MerkleTreeFile, write_tree_levels
+
+
+class TreeUpdate(NamedTuple):
+    old_root: bytes
+    root: bytes
+    # leaf indices of the updated and of the appended users
+    updated: List[int]
+    inserted: List[int]
+    # (level, index, new hash) of every changed node, leaves at level 0
+    changed_nodes: List[Tuple[int, int, bytes]]
+    # [start, end) ranges of the existing leaves whose proof changed
+    changed_proofs: List[Tuple[int, int]]
+
+
+class IncrementalMerkleTree:
+    """Merkle tree that can be updated without rebuilding it
+
+    Levels are kept without their `ZERO_HASH` padding, leaves first.
+    """
+
+    def __init__(
+        self,
+        levels: List[List[bytes]],
+        index: Dict[bytes, int],
+        values: Optional[List[int]],
+    ):
+        self.levels = levels
+        self.index = index
+        self.values = values
+        self.hasher = PackedHasher()
+
+    @classmethod
+    def from_users(cls, users: List[Union[dict, str]]) -> "IncrementalMerkleTree":
+        has_values = any(isinstance(user, dict) for user in users)
+        index = {}
+        for i, user in enumerate(users):
+            index.setdefault(_get_raw_address(user), i)
+        values = [get_value(user) for user in users] if has_values else None
+        levels = _strip_padding(generate_merkle_levels(users), len(users))
+        return cls(levels, index, values)
+
+    @classmethod
+    def from_tree_file(cls, path: str) -> "IncrementalMerkleTree":
+        with MerkleTreeFile(path) as tree:
+            levels = [
+                [tree.get_node(level, i) for i in range(length)]
+                for level, length in enumerate(tree.level_lengths)
+            ]
+            index = dict(tree.iter_index())
+            values = None
+            if tree.has_values:
+                values = [tree.get_value(i) for i in range(tree.leaves_count)]
+            return cls(_strip_padding(levels, tree.leaves_count), index, values)
+
+    @property
+    def leaves_count(self) -> int:
+        return len(self.levels[0])
+
+    @property
+    def root(self) -> bytes:
+        return self.levels[-1][0]
+
+    def hash_user(self, user: Union[dict, str]) -> bytes:
+        raw_address = _get_raw_address(user)
+        if self.values is None:
+            if not isinstance(user, str):
+                raise ValueError("the tree has no values, users must be addresses")
+            return self.hasher.hash_address(raw_address)
+        if isinstance(user, str):
+            raise ValueError("the tree has values, users must have a value")
+        return self.hasher.hash_address_value(raw_address, int(user["value"]))
+
+    def apply(self, users: List[Union[dict, str]]) -> TreeUpdate:
+        """Update the value of the `users` already in the tree and append the
+        others, then rehash the ancestors of the changed leaves
+        """
+        old_root = self.root
+        old_leaves_count = self.leaves_count
+        leaves = self.levels[0]
+        updated = []
+        inserted = []
+        dirty = set()
+        for user in users:
+            leaf = self.hash_user(user)
+            raw_address = _get_raw_address(user)
+            index = self.index.get(raw_address)
+            if index is None:
+                index = len(leaves)
+                self.index[raw_address] = index
+                leaves.append(leaf)
+                if self.values is not None:
+                    self.values.append(0)
+                inserted.append(index)
+            elif leaves[index] != leaf:
+                leaves[index] = leaf
+                updated.append(index)
+            else:
+                continue
+            if self.values is not None:
+                self.values[index] = int(user["value"])
+            dirty.add(index)
+
+        changed_nodes = [(0, i, leaves[i]) for i in sorted(dirty)]
+        changed_proofs = []
+        level = 0
+        while len(self.levels[level]) > 1:
+            nodes = self.levels[level]
+            if level + 1 == len(self.levels):
+                self.levels.append([])
+            parents = self.levels[level + 1]
+            parents.extend([None] * ((len(nodes) + 1) // 2 - len(parents)))
+
+            for i in dirty:
+                start, end = (i ^ 1) << level, ((i ^ 1) + 1) << level
+                if start < old_leaves_count:
+                    changed_proofs.append((start, min(end, old_leaves_count)))
+            dirty = {i // 2 for i in dirty}
+            for i in sorted(dirty):
+                right = nodes[2 * i + 1] if 2 * i + 1 < len(nodes) else ZERO_HASH
+                parents[i] = self.hasher.hash_pair(nodes[2 * i], right)
+                changed_nodes.append((level + 1, i, parents[i]))
+            level += 1
+
+        return TreeUpdate(
+            old_root,
+            self.root,
+            sorted(set(updated) - set(inserted)),
+            inserted,
+            changed_nodes,
+            _merge_ranges(changed_proofs),
+        )
+
+    def get_proof_at(self, index: int) -> List[bytes]:
+        proof = []
+        node_index = index
+        for nodes in self.levels[:-1]:
+            sibling = node_index ^ 1
+            proof.append(nodes[sibling] if sibling < len(nodes) else ZERO_HASH)
+            node_index //= 2
+        return proof
+
+    def write(self, output_file: str):
+        """Write the tree in the format of `write_tree_file`"""
+        levels = [
+            nodes + [ZERO_HASH] if len(nodes) % 2 == 1 else nodes
+            for nodes in self.levels[:-1]
+        ]
+        levels.append(self.levels[-1])
+        leaves_count = self.leaves_count
+        write_tree_levels(levels, leaves_count, self.index, self.values, output_file)
+
+
+def _get_raw_address(user: Union[dict, str]) -> bytes:
+    return address_to_bytes(user if isinstance(user, str) else user["address"])
+
+
+def _strip_padding(levels: List[List[bytes]], leaves_count: int) -> List[List[bytes]]:
+    stripped = []
+    length = leaves_count
+    for nodes in levels:
+        stripped.append(nodes[:length])
+        length = (length + 1) // 2
+    return stripped
+
+
+def _merge_ranges(ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
@@ -0,0 +1,61 @@
+"""Merkle tree construction sharded across processes
+
+Users are split in shards of 2**depth leaves, each shard is reduced to a
+single subtree root by a worker, and the subtree roots are folded into the
+final root in the parent process.
+
+Every shard but the last one is complete, so full shards contribute an even
+number of nodes to each of the lower levels and the parity of a level is
+decided by the last shard alone. Padding the last shard with `ZERO_HASH`
+whenever one of its levels is odd, until it is reduced to a single node,
+therefore gives the same root as `generate_merkle_tree`.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import List, Optional, Union
+
+from conicfinance.merkle.hashing import ZERO_HASH, PackedHasher
+from conicfinance.merkle.tree import compute_root, generate_merkle_tree
+
+MIN_SHARD_DEPTH = 10
+
+
+def compute_subtree_root(users: List[Union[dict, str]], depth: int) -> bytes:
+    hasher = PackedHasher()
+    nodes = [hasher.hash_user(user) for user in users]
+    for _ in range(depth):
+        if len(nodes) % 2 == 1:
+            nodes.append(ZERO_HASH)
+        hash_pair = hasher.hash_pair
+        nodes = [hash_pair(nodes[i], nodes[i + 1]) for i in range(0, len(nodes), 2)]
+    return nodes[0]
+
+
+def get_shard_depth(users_count: int, workers: int) -> int:
+    """Use a few shards per worker to even out the load"""
+    target_shard_size = max(users_count // (workers * 4), 1)
+    return max(target_shard_size.bit_length() - 1, MIN_SHARD_DEPTH)
+
+
+def generate_merkle_tree_parallel(
+    users: List[Union[dict, str]],
+    workers: Optional[int] = None,
+    shard_depth: Optional[int] = None,
+) -> bytes:
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if shard_depth is None:
+        shard_depth = get_shard_depth(len(users), workers)
+
+    shard_size = 2**shard_depth
+    if workers <= 1 or len(users) <= shard_size:
+        return generate_merkle_tree(users)
+
+    shards = [users[i : i + shard_size] for i in range(0, len(users), shard_size)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        subtree_roots = list(
+            executor.map(compute_subtree_root, shards, repeat(shard_depth))
+        )
+    return compute_root(subtree_roots)
@@ -1,20 +1,28 @@
-from typing import List, Tuple, Union
+from typing import Dict, List, Tuple, Union
 
-from conicfinance.merkle.tree import generate_merkle_tree
+from conicfinance.merkle.tree import generate_merkle_levels, generate_merkle_tree
 from web3 import Web3
 
 
+def get_address(user: Union[dict, str]) -> str:
+    if isinstance(user, str):
+        return Web3.toChecksumAddress(user)
+    return Web3.toChecksumAddress(user["address"])
+
+
+def get_value(user: Union[dict, str]) -> int:
+    if isinstance(user, dict):
+        return int(user["value"])
+    return 0
+
+
 class ProofGenerator:
     def __init__(self, target_address: str, users: List[Union[dict, str]]):
         self.users = users
         target = Web3.toChecksumAddress(target_address)
         self.target_index = [self._get_address(u) for u in users].index(target)
         self.node_index = self.target_index
-        target_user = users[self.target_index]
-        if isinstance(target_user, dict):
-            self.value = int(target_user["value"])
-        else:
-            self.value = 0
+        self.value = get_value(users[self.target_index])
         self.proof = []
 
     def process_leaves(self, leaves: List[bytes]):
@@ -25,9 +33,7 @@ class ProofGenerator:
         self.node_index //= 2
 
     def _get_address(self, user: Union[dict, str]):
-        if isinstance(user, str):
-            return Web3.toChecksumAddress(user)
-        return Web3.toChecksumAddress(user["address"])
+        return get_address(user)
 
 
 def generate_proof(
@@ -36,3 +42,26 @@ def generate_proof(
     proof_generator = ProofGenerator(user_address, users)
     generate_merkle_tree(users, proof_generator.process_leaves)
     return (proof_generator.proof, proof_generator.target_index), proof_generator.value
+
+
+def generate_all_proofs(
+    users: List[Union[dict, str]]
+) -> Dict[str, Tuple[int, List[bytes], int]]:
+    """Generate the proofs of every user from a single tree build.
+    Returns a mapping from checksummed address to (index, proof, value).
+    If an address appears more than once, its first entry is used,
+    as with `generate_proof`
+    """
+    levels = generate_merkle_levels(users)
+    proofs = {}
+    for index, user in enumerate(users):
+        address = get_address(user)
+        if address in proofs:
+            continue
+        proof = []
+        node_index = index
+        for level in levels[:-1]:
+            proof.append(level[node_index ^ 1])
+            node_index //= 2
+        proofs[address] = (index, proof, get_value(user))
+    return proofs
@@ -0,0 +1,170 @@
+"""HTTP service answering proof requests from a tree built once at startup
+
+`GET /proof/<address>` returns the `[index, proof]` JSON printed by
+`merkle generate-proof`, `GET /stats` the request counters, latency
+percentiles over the last requests and cache statistics.
+
+The tree is either built from a distribution and kept in memory, as one
+packed bytes array per level and a sorted array of addresses searched by
+bisection, or read from a tree file written by `merkle write-tree`.
+Encoded responses of hot addresses are kept in an LRU cache.
+"""
+
+import json
+import time
+from collections import Counter, deque
+from functools import lru_cache
+from typing import List, Tuple, Union
+
+import numpy as np
+from aiohttp import web
+from web3 import Web3
+
+from conicfinance.merkle.hashing import ADDRESS_SIZE, address_to_bytes
+from conicfinance.merkle.proof import get_value
+from conicfinance.merkle.tree import generate_merkle_levels
+
+NODE_SIZE = 32
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8080
+DEFAULT_CACHE_SIZE = 10_000
+DEFAULT_KEEPALIVE_TIMEOUT = 75.0
+LATENCY_WINDOW = 10_000
+LATENCY_PERCENTILES = [50, 90, 99]
+
+
+class InMemoryMerkleTree:
+    """Same interface as `MerkleTreeFile`, for a tree built from `users`"""
+
+    def __init__(self, users: List[Union[dict, str]]):
+        levels = generate_merkle_levels(users)
+        self.levels = [b"".join(level) for level in levels]
+        self.values = [get_value(user) for user in users]
+
+        raw_addresses = np.array(
+            [
+                address_to_bytes(user if isinstance(user, str) else user["address"])
+                for user in users
+            ],
+            dtype=f"S{ADDRESS_SIZE}",
+        )
+        # stable, so that the first of duplicate addresses is found first
+        self.leaf_indices = np.argsort(raw_addresses, kind="stable").astype(np.uint32)
+        self.sorted_addresses = raw_addresses[self.leaf_indices]
+
+    @property
+    def root(self) -> bytes:
+        return self.levels[-1]
+
+    def find_index(self, address: str) -> int:
+        target = np.array(address_to_bytes(address), dtype=f"S{ADDRESS_SIZE}")
+        position = int(np.searchsorted(self.sorted_addresses, target))
+        if (
+            position == len(self.sorted_addresses)
+            or self.sorted_addresses[position] != target
+        ):
+            raise ValueError(f"{address} is not in the tree")
+        return int(self.leaf_indices[position])
+
+    def get_proof_at(self, index: int) -> List[bytes]:
+        proof = []
+        node_index = index
+        for level in self.levels[:-1]:
+            offset = (node_index ^ 1) * NODE_SIZE
+            proof.append(level[offset : offset + NODE_SIZE])
+            node_index //= 2
+        return proof
+
+    def generate_proof(self, address: str) -> Tuple[Tuple[List[bytes], int], int]:
+        index = self.find_index(address)
+        return (self.get_proof_at(index), index), self.values[index]
+
+
+class ServerStats:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.statuses = Counter()
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def record(self, status: int, latency: float):
+        self.statuses[status] += 1
+        self.latencies.append(latency)
+
+    def as_dict(self) -> dict:
+        uptime = time.monotonic() - self.started
+        requests = sum(self.statuses.values())
+        latencies = np.array(self.latencies) * 1000
+        return {
+            "uptime": uptime,
+            "requests": requests,
+            "requests_per_second": requests / uptime,
+            "statuses": {str(k): v for k, v in sorted(self.statuses.items())},
+            "latency_ms": {
+                f"p{p}": float(np.percentile(latencies, p)) if len(latencies) else None
+                for p in LATENCY_PERCENTILES
+            },
+        }
+
+
+class ProofServer:
+    def __init__(self, tree, cache_size: int = DEFAULT_CACHE_SIZE):
+        self.tree = tree
+        self.stats = ServerStats()
+        self.get_response_body = lru_cache(maxsize=cache_size)(self._get_response_body)
+
+    def _get_response_body(self, address: str) -> bytes:
+        (proof, index), _ = self.tree.generate_proof(address)
+        return json.dumps([index, [Web3.toHex(node) for node in proof]]).encode()
+
+    async def handle_proof(self, request: web.Request) -> web.Response:
+        start = time.perf_counter()
+        response = self.get_proof_response(request.match_info["address"])
+        self.stats.record(response.status, time.perf_counter() - start)
+        return response
+
+    def get_proof_response(self, address: str) -> web.Response:
+        try:
+            address_to_bytes(address)
+        except ValueError:
+            return web.json_response({"error": "invalid address"}, status=400)
+        try:
+            body = self.get_response_body(address.lower())
+        except ValueError:
+            return web.json_response({"error": "address not found"}, status=404)
+        return web.Response(body=body, content_type="application/json")
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        cache_info = self.get_response_body.cache_info()
+        stats = self.stats.as_dict()
+        stats["root"] = Web3.toHex(self.tree.root)
+        stats["cache"] = {
+            "hits": cache_info.hits,
+            "misses": cache_info.misses,
+            "size": cache_info.currsize,
+            "max_size": cache_info.maxsize,
+        }
+        return web.json_response(stats)
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/proof/{address}", self.handle_proof)
+        app.router.add_get("/stats", self.handle_stats)
+        return app
+
+
+def serve(
+    tree,
+    host: str = DEFAULT_HOST,
+    port: int = DEFAULT_PORT,
+    cache_size: int = DEFAULT_CACHE_SIZE,
+    keepalive_timeout: float = DEFAULT_KEEPALIVE_TIMEOUT,
+):
+    server = ProofServer(tree, cache_size)
+    print(f"serving proofs for root {Web3.toHex(tree.root)}")
+    web.run_app(
+        server.create_app(),
+        host=host,
+        port=port,
+        keepalive_timeout=keepalive_timeout,
+    )
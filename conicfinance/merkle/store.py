@@ -0,0 +1,275 @@
+"""Many Merkle distributions stored side by side in one indexed file
+
+Layout (all integers little-endian unless stated otherwise):
+
+* header: magic, number of addresses, number of distributions, number of
+  memberships, flags
+* addresses: the 20-byte addresses of all the distributions, sorted, each
+  stored once
+* membership offsets: one uint32 per address, plus a final one, delimiting
+  the memberships of each address
+* memberships: (distribution, leaf index) uint32 pairs, grouped by address
+* distribution directory: name, number of leaves, number of levels, flags
+  and offset of the data of every distribution
+* distribution data: level lengths, the address of every leaf as an index in
+  the shared address table, one 32-byte big-endian value per leaf if the
+  distribution has values, and the nodes of every level above the leaves
+
+Leaves are not stored: the sibling leaf of a proof is rehashed from its
+address and value, so a leaf costs 4 bytes instead of 32. A single lookup in
+the address table gives every distribution an address is part of, with the
+leaf index its proof is read from. As with `generate_all_proofs`, only the
+first leaf of an address repeated in a distribution is indexed.
+"""
+
+import mmap
+import struct
+from typing import Dict, List, NamedTuple, Union
+
+import numpy as np
+
+from conicfinance.merkle.hashing import (
+    ADDRESS_SIZE,
+    ZERO_HASH,
+    PackedHasher,
+    address_to_bytes,
+)
+from conicfinance.merkle.proof import get_value
+from conicfinance.merkle.tree import generate_merkle_levels
+
+MAGIC = b"CNCMSTR\x01"
+HEADER = struct.Struct("<8sIIII")
+NAME_SIZE = 64
+DISTRIBUTION_ENTRY = struct.Struct(f"<{NAME_SIZE}sIIIQ")
+UINT32 = struct.Struct("<I")
+MEMBERSHIP = struct.Struct("<II")
+
+NODE_SIZE = 32
+VALUE_SIZE = 32
+
+FLAG_HAS_VALUES = 1
+
+
+class Claim(NamedTuple):
+    distribution: str
+    index: int
+    proof: List[bytes]
+    value: int
+
+
+def get_raw_address(user: Union[dict, str]) -> bytes:
+    return address_to_bytes(user if isinstance(user, str) else user["address"])
+
+
+def write_store(distributions: Dict[str, List[Union[dict, str]]], output_file: str):
+    """Write the `distributions`, mapping names to users, to `output_file`"""
+    for name in distributions:
+        if len(name.encode()) > NAME_SIZE:
+            raise ValueError(f"distribution name longer than {NAME_SIZE} bytes: {name}")
+    raw_addresses = {
+        name: [get_raw_address(user) for user in users]
+        for name, users in distributions.items()
+    }
+    addresses = sorted(
+        {address for addresses in raw_addresses.values() for address in addresses}
+    )
+    address_ids = {address: i for i, address in enumerate(addresses)}
+
+    memberships = [[] for _ in addresses]
+    for distribution_id, leaf_addresses in enumerate(raw_addresses.values()):
+        seen = set()
+        for leaf_index, address in enumerate(leaf_addresses):
+            if address not in seen:
+                seen.add(address)
+                memberships[address_ids[address]].append((distribution_id, leaf_index))
+    membership_offsets = np.cumsum([0] + [len(m) for m in memberships])
+    memberships_count = int(membership_offsets[-1])
+
+    sections = []
+    entries = []
+    offset = (
+        HEADER.size
+        + len(addresses) * ADDRESS_SIZE
+        + len(membership_offsets) * UINT32.size
+        + memberships_count * MEMBERSHIP.size
+        + len(distributions) * DISTRIBUTION_ENTRY.size
+    )
+    for name, users in distributions.items():
+        levels = generate_merkle_levels(users)
+        has_values = any(isinstance(user, dict) for user in users)
+        section = [b"".join(UINT32.pack(len(level)) for level in levels)]
+        leaf_address_ids = [address_ids[a] for a in raw_addresses[name]]
+        section.append(np.array(leaf_address_ids, dtype="<u4").tobytes())
+        if has_values:
+            section.append(
+                b"".join(get_value(user).to_bytes(VALUE_SIZE, "big") for user in users)
+            )
+        section.extend(b"".join(level) for level in levels[1:])
+        section = b"".join(section)
+
+        flags = FLAG_HAS_VALUES if has_values else 0
+        entry = (name.encode(), len(users), len(levels), flags, offset)
+        entries.append(DISTRIBUTION_ENTRY.pack(*entry))
+        sections.append(section)
+        offset += len(section)
+
+    with open(output_file, "wb") as f:
+        f.write(
+            HEADER.pack(MAGIC, len(addresses), len(distributions), memberships_count, 0)
+        )
+        f.write(b"".join(addresses))
+        f.write(membership_offsets.astype("<u4").tobytes())
+        for address_memberships in memberships:
+            for membership in address_memberships:
+                f.write(MEMBERSHIP.pack(*membership))
+        f.write(b"".join(entries))
+        for section in sections:
+            f.write(section)
+
+
+class StoredDistribution:
+    """Tree of one distribution of a `MerkleStore`"""
+
+    def __init__(self, store: "MerkleStore", entry_offset: int):
+        self._store = store
+        self._mmap = store._mmap
+        raw_name, self.leaves_count, levels_count, flags, offset = (
+            DISTRIBUTION_ENTRY.unpack_from(self._mmap, entry_offset)
+        )
+        self.name = raw_name.rstrip(b"\0").decode()
+        self.has_values = bool(flags & FLAG_HAS_VALUES)
+
+        self.level_lengths = [
+            UINT32.unpack_from(self._mmap, offset + i * UINT32.size)[0]
+            for i in range(levels_count)
+        ]
+        offset += levels_count * UINT32.size
+        self.address_ids_offset = offset
+        offset += self.leaves_count * UINT32.size
+        self.values_offset = offset
+        if self.has_values:
+            offset += self.leaves_count * VALUE_SIZE
+        # offsets of the levels above the leaves
+        self.level_offsets = [None]
+        for length in self.level_lengths[1:]:
+            self.level_offsets.append(offset)
+            offset += length * NODE_SIZE
+
+    @property
+    def root(self) -> bytes:
+        return self.get_node(len(self.level_lengths) - 1, 0)
+
+    def get_value(self, index: int) -> int:
+        if not self.has_values:
+            return 0
+        offset = self.values_offset + index * VALUE_SIZE
+        return int.from_bytes(self._mmap[offset : offset + VALUE_SIZE], "big")
+
+    def get_leaf(self, index: int) -> bytes:
+        if index == self.leaves_count:
+            return ZERO_HASH
+        (address_id,) = UINT32.unpack_from(
+            self._mmap, self.address_ids_offset + index * UINT32.size
+        )
+        address = self._store.get_raw_address(address_id)
+        hasher = self._store.hasher
+        if self.has_values:
+            return hasher.hash_address_value(address, self.get_value(index))
+        return hasher.hash_address(address)
+
+    def get_node(self, level: int, index: int) -> bytes:
+        if level == 0:
+            return self.get_leaf(index)
+        offset = self.level_offsets[level] + index * NODE_SIZE
+        return self._mmap[offset : offset + NODE_SIZE]
+
+    def get_proof_at(self, index: int) -> List[bytes]:
+        proof = []
+        node_index = index
+        for level in range(len(self.level_lengths) - 1):
+            proof.append(self.get_node(level, node_index ^ 1))
+            node_index //= 2
+        return proof
+
+
+class MerkleStore:
+    """Read-only view over a file written by `write_store`"""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.addresses_count, distributions_count, memberships_count, _ = (
+            HEADER.unpack_from(self._mmap, 0)
+        )
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a Merkle store file")
+        self.hasher = PackedHasher()
+
+        self.addresses_offset = HEADER.size
+        self.membership_offsets_offset = (
+            self.addresses_offset + self.addresses_count * ADDRESS_SIZE
+        )
+        self.memberships_offset = (
+            self.membership_offsets_offset + (self.addresses_count + 1) * UINT32.size
+        )
+        directory_offset = self.memberships_offset + memberships_count * MEMBERSHIP.size
+        self.distributions = [
+            StoredDistribution(self, directory_offset + i * DISTRIBUTION_ENTRY.size)
+            for i in range(distributions_count)
+        ]
+        self._addresses = np.frombuffer(
+            self._mmap,
+            dtype=f"S{ADDRESS_SIZE}",
+            count=self.addresses_count,
+            offset=self.addresses_offset,
+        )
+
+    def close(self):
+        del self._addresses
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get_distribution(self, name: str) -> StoredDistribution:
+        for distribution in self.distributions:
+            if distribution.name == name:
+                return distribution
+        raise ValueError(f"unknown distribution {name}")
+
+    def get_raw_address(self, address_id: int) -> bytes:
+        offset = self.addresses_offset + address_id * ADDRESS_SIZE
+        return self._mmap[offset : offset + ADDRESS_SIZE]
+
+    def find_address_id(self, address: str) -> int:
+        target = np.array(address_to_bytes(address), dtype=f"S{ADDRESS_SIZE}")
+        position = int(np.searchsorted(self._addresses, target))
+        if position == self.addresses_count or self._addresses[position] != target:
+            raise ValueError(f"{address} is not in the store")
+        return position
+
+    def get_claims(self, address: str) -> List[Claim]:
+        """Proofs and values of `address` in every distribution it is part of"""
+        address_id = self.find_address_id(address)
+        offset = self.membership_offsets_offset + address_id * UINT32.size
+        (start,) = UINT32.unpack_from(self._mmap, offset)
+        (end,) = UINT32.unpack_from(self._mmap, offset + UINT32.size)
+        claims = []
+        for i in range(start, end):
+            distribution_id, index = MEMBERSHIP.unpack_from(
+                self._mmap, self.memberships_offset + i * MEMBERSHIP.size
+            )
+            distribution = self.distributions[distribution_id]
+            claims.append(
+                Claim(
+                    distribution.name,
+                    index,
+                    distribution.get_proof_at(index),
+                    distribution.get_value(index),
+                )
+            )
+        return claims
@@ -1,11 +1,20 @@
 import json
 
+from web3 import Web3
+
+from conicfinance import profiling
+
+from .parallel import generate_merkle_tree_parallel
 from .tree import generate_merkle_tree
 
 
-def generate_merkle_root(input_file: str) -> str:
-    with open(input_file) as f:
+def generate_merkle_root(input_file: str, workers: int = 1) -> str:
+    with profiling.stage("load"), open(input_file) as f:
         users = json.load(f)
 
-    root = generate_merkle_tree(users)
-    return root.hex()
+    with profiling.stage("merkle-tree"):
+        if workers == 1:
+            root = generate_merkle_tree(users)
+        else:
+            root = generate_merkle_tree_parallel(users, workers)
+    return Web3.toHex(root)
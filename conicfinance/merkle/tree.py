@@ -1,33 +1,42 @@
 from typing import Callable, List, Optional, Union
 
-from web3 import Web3
+from conicfinance.merkle.hashing import ZERO_HASH, PackedHasher
 
 
-def compute_hash(user):
-    if isinstance(user, str):
-        address = Web3.toChecksumAddress(user)
-        return Web3.solidityKeccak(["address"], [address])
-    else:
-        address = Web3.toChecksumAddress(user["address"])
-        value = int(user["value"])
-        return Web3.solidityKeccak(["address", "uint256"], [address, value])
+def compute_hash(user: Union[dict, str]) -> bytes:
+    return PackedHasher().hash_user(user)
 
 
 def generate_merkle_tree(
     users: List[Union[dict, str]],
     process_leaves: Optional[Callable[[List[bytes]], None]] = None,
 ) -> bytes:
-    leaves = [compute_hash(user) for user in users]
+    hasher = PackedHasher()
+    leaves = [hasher.hash_user(user) for user in users]
+    return compute_root(leaves, process_leaves)
+
+
+def compute_root(
+    leaves: List[bytes],
+    process_leaves: Optional[Callable[[List[bytes]], None]] = None,
+) -> bytes:
+    hasher = PackedHasher()
     while len(leaves) > 1:
         if len(leaves) % 2 == 1:
-            leaves.append(Web3.solidityKeccak(["uint256"], [0]))
+            leaves.append(ZERO_HASH)
         if process_leaves:
             process_leaves(leaves)
 
-        new_leaves = []
-        for i in range(0, len(leaves), 2):
-            new_leaves.append(
-                Web3.solidityKeccak(["bytes32", "bytes32"], [leaves[i], leaves[i + 1]])
-            )
-        leaves = new_leaves
+        hash_pair = hasher.hash_pair
+        leaves = [hash_pair(leaves[i], leaves[i + 1]) for i in range(0, len(leaves), 2)]
     return leaves[0]
+
+
+def generate_merkle_levels(users: List[Union[dict, str]]) -> List[List[bytes]]:
+    """Build the tree once and keep every level, leaves first and root last.
+    All levels but the root are padded to an even length
+    """
+    levels = []
+    root = generate_merkle_tree(users, levels.append)
+    levels.append([root])
+    return levels
@@ -0,0 +1,162 @@
+"""Compact on-disk representation of a Merkle tree
+
+Layout (all integers little-endian unless stated otherwise):
+
+* header: magic, number of leaves, number of levels, number of indexed
+  addresses, flags
+* level lengths: one uint32 per level, leaves first and root last
+* nodes: every level as a packed array of 32-byte hashes
+* address index: (20-byte address, uint32 leaf index) entries sorted by address
+* values: one 32-byte big-endian value per leaf, if the tree has values
+
+Proofs are read straight from the memory-mapped file, touching only the
+log2(n) sibling nodes and the index entries visited by the binary search.
+"""
+
+import mmap
+import struct
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from conicfinance.merkle.hashing import address_to_bytes
+from conicfinance.merkle.proof import get_address, get_value
+from conicfinance.merkle.tree import generate_merkle_levels
+
+MAGIC = b"CNCMRKL\x01"
+HEADER = struct.Struct("<8sIIII")
+LEVEL_LENGTH = struct.Struct("<I")
+INDEX_ENTRY = struct.Struct("<20sI")
+
+NODE_SIZE = 32
+VALUE_SIZE = 32
+
+FLAG_HAS_VALUES = 1
+
+
+def write_tree_file(
+    users: List[Union[dict, str]],
+    output_file: str,
+    levels: Optional[List[List[bytes]]] = None,
+):
+    """Write the tree of `users`, from its `levels` if they were already built"""
+    if levels is None:
+        levels = generate_merkle_levels(users)
+    has_values = any(isinstance(user, dict) for user in users)
+
+    index = {}
+    for i, user in enumerate(users):
+        index.setdefault(address_to_bytes(get_address(user)), i)
+
+    values = [get_value(user) for user in users] if has_values else None
+    write_tree_levels(levels, len(users), index, values, output_file)
+
+
+def write_tree_levels(
+    levels: List[List[bytes]],
+    leaves_count: int,
+    index: Dict[bytes, int],
+    values: Optional[List[int]],
+    output_file: str,
+):
+    """Write a tree from its levels, as returned by `generate_merkle_levels`,
+    the leaf index of every raw address and the leaf values, if any
+    """
+    flags = FLAG_HAS_VALUES if values is not None else 0
+    with open(output_file, "wb") as f:
+        f.write(HEADER.pack(MAGIC, leaves_count, len(levels), len(index), flags))
+        for level in levels:
+            f.write(LEVEL_LENGTH.pack(len(level)))
+        for level in levels:
+            f.write(b"".join(level))
+        for address in sorted(index):
+            f.write(INDEX_ENTRY.pack(address, index[address]))
+        if values is not None:
+            for value in values:
+                f.write(value.to_bytes(VALUE_SIZE, "big"))
+
+
+class MerkleTreeFile:
+    """Read-only view over a file written by `write_tree_file`"""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.leaves_count, levels_count, self.addresses_count, flags = (
+            HEADER.unpack_from(self._mmap, 0)
+        )
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a Merkle tree file")
+        self.has_values = bool(flags & FLAG_HAS_VALUES)
+
+        offset = HEADER.size
+        self.level_lengths = []
+        for _ in range(levels_count):
+            self.level_lengths.append(LEVEL_LENGTH.unpack_from(self._mmap, offset)[0])
+            offset += LEVEL_LENGTH.size
+
+        self.level_offsets = []
+        for length in self.level_lengths:
+            self.level_offsets.append(offset)
+            offset += length * NODE_SIZE
+
+        self.index_offset = offset
+        self.values_offset = offset + self.addresses_count * INDEX_ENTRY.size
+
+    def close(self):
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def root(self) -> bytes:
+        return self.get_node(len(self.level_lengths) - 1, 0)
+
+    def get_node(self, level: int, index: int) -> bytes:
+        offset = self.level_offsets[level] + index * NODE_SIZE
+        return self._mmap[offset : offset + NODE_SIZE]
+
+    def get_value(self, index: int) -> int:
+        if not self.has_values:
+            return 0
+        offset = self.values_offset + index * VALUE_SIZE
+        return int.from_bytes(self._mmap[offset : offset + VALUE_SIZE], "big")
+
+    def find_index(self, address: str) -> int:
+        target = address_to_bytes(address)
+        low, high = 0, self.addresses_count
+        while low < high:
+            middle = (low + high) // 2
+            entry_address, index = INDEX_ENTRY.unpack_from(
+                self._mmap, self.index_offset + middle * INDEX_ENTRY.size
+            )
+            if entry_address == target:
+                return index
+            if entry_address < target:
+                low = middle + 1
+            else:
+                high = middle
+        raise ValueError(f"{address} is not in the tree")
+
+    def iter_index(self) -> Iterator[Tuple[bytes, int]]:
+        """(raw address, leaf index) entries, sorted by address"""
+        for i in range(self.addresses_count):
+            yield INDEX_ENTRY.unpack_from(
+                self._mmap, self.index_offset + i * INDEX_ENTRY.size
+            )
+
+    def get_proof_at(self, index: int) -> List[bytes]:
+        proof = []
+        node_index = index
+        for level in range(len(self.level_lengths) - 1):
+            proof.append(self.get_node(level, node_index ^ 1))
+            node_index //= 2
+        return proof
+
+    def generate_proof(self, address: str) -> Tuple[Tuple[List[bytes], int], int]:
+        """Same return value as `conicfinance.merkle.proof.generate_proof`"""
+        index = self.find_index(address)
+        return (self.get_proof_at(index), index), self.get_value(index)
@@ -0,0 +1,147 @@
+"""Bulk verification of published proofs against a Merkle root
+
+A proof `[index, siblings]` is folded the way `ProofGenerator` collects it:
+at each level, the node at an even index is the left operand and its
+sibling the right one, and the index is halved. The leaf is derived from the
+address and value of the proof with the encoding of `compute_hash`, so a
+proof only verifies for the exact claim it was generated for.
+
+Proofs are verified in chunks across processes. The distribution is checked
+in the same pass for duplicate addresses, addresses missing a proof, proofs
+of unknown addresses, values differing between the proofs and the
+distribution, and its total value.
+"""
+
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Dict, List, Optional, Tuple, Union
+
+from web3 import Web3
+
+from conicfinance.merkle.hashing import PackedHasher, address_to_bytes
+from conicfinance.merkle.proof import get_value
+
+# address, value or None for address-only leaves, index, proof
+Claim = Tuple[str, Optional[int], int, List[bytes]]
+
+CHUNKS_PER_WORKER = 4
+
+
+def fold_proof(
+    leaf: bytes, index: int, proof: List[bytes], hasher: PackedHasher
+) -> bytes:
+    node = leaf
+    for sibling in proof:
+        if index % 2 == 0:
+            node = hasher.hash_pair(node, sibling)
+        else:
+            node = hasher.hash_pair(sibling, node)
+        index //= 2
+    return node
+
+
+def find_invalid_claims(claims: List[Claim], root: bytes) -> List[str]:
+    """Addresses of the `claims` whose proof does not fold to `root`"""
+    hasher = PackedHasher()
+    invalid = []
+    for address, value, index, proof in claims:
+        try:
+            raw_address = address_to_bytes(address)
+            if value is None:
+                leaf = hasher.hash_address(raw_address)
+            else:
+                leaf = hasher.hash_address_value(raw_address, value)
+        except ValueError:
+            invalid.append(address)
+            continue
+        if fold_proof(leaf, index, proof, hasher) != root:
+            invalid.append(address)
+    return invalid
+
+
+def parse_proofs(formatted_proofs: Dict[str, list], with_values: bool) -> List[Claim]:
+    """Claims of the proofs written by `merkle generate-all-proofs`"""
+    return [
+        (
+            address,
+            int(value) if with_values else None,
+            index,
+            [Web3.toBytes(hexstr=node) for node in proof],
+        )
+        for address, (index, proof, value) in formatted_proofs.items()
+    ]
+
+
+def verify_claims(
+    claims: List[Claim], root: bytes, workers: Optional[int] = None
+) -> List[str]:
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1:
+        return find_invalid_claims(claims, root)
+
+    chunk_size = max(math.ceil(len(claims) / (workers * CHUNKS_PER_WORKER)), 1)
+    chunks = [claims[i : i + chunk_size] for i in range(0, len(claims), chunk_size)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(find_invalid_claims, chunks, repeat(root))
+        return [address for invalid in results for address in invalid]
+
+
+def verify_distribution(
+    users: List[Union[dict, str]],
+    claims: List[Claim],
+    root: bytes,
+    workers: Optional[int] = None,
+    expected_total: Optional[int] = None,
+) -> dict:
+    """Check `claims` against `root` and against the distribution `users`
+    Addresses are compared case-insensitively. The report is `ok` if every
+    user has exactly one entry and a valid proof for its value, and the total
+    value matches `expected_total` when given
+    """
+    addresses = [user if isinstance(user, str) else user["address"] for user in users]
+    values = {}
+    duplicates = set()
+    for address, user in zip(addresses, users):
+        key = address.lower()
+        if key in values:
+            duplicates.add(address)
+        else:
+            values[key] = get_value(user)
+
+    claimed = set()
+    value_mismatches = []
+    extra = []
+    for address, value, _, _ in claims:
+        key = address.lower()
+        claimed.add(key)
+        if key not in values:
+            extra.append(address)
+        elif value is not None and value != values[key]:
+            value_mismatches.append(address)
+    missing = [address for address in addresses if address.lower() not in claimed]
+
+    invalid = verify_claims(claims, root, workers)
+
+    total_value = sum(values.values())
+    claimed_value = sum(value or 0 for _, value, _, _ in claims)
+    total_ok = claimed_value == total_value and (
+        expected_total is None or total_value == expected_total
+    )
+    return {
+        "ok": not (invalid or value_mismatches or missing or extra or duplicates)
+        and total_ok,
+        "root": Web3.toHex(root),
+        "users": len(users),
+        "proofs": len(claims),
+        "total_value": str(total_value),
+        "claimed_value": str(claimed_value),
+        "expected_total": None if expected_total is None else str(expected_total),
+        "invalid": sorted(invalid),
+        "value_mismatches": sorted(value_mismatches),
+        "duplicates": sorted(duplicates),
+        "missing": sorted(missing),
+        "extra": sorted(extra),
+    }
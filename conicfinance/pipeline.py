@@ -0,0 +1,325 @@
+"""Runner for the chains of commands producing the distributions
+
+Every stage runs one of the command line tools in a subprocess, reading
+`inputs` and writing `outputs`. Stages depend on the stages producing their
+inputs and independent stages run concurrently.
+
+A stage is skipped when its key, a hash of its command and of the content of
+its inputs, and the hashes of its outputs match the ones recorded in the
+state file of the build directory after its last successful run.
+"""
+
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from conicfinance.initial_distribution import whitelist
+from conicfinance.locker_v2.airdrop import CNC_LOCK_EVENT_TIMES, CNC_LOCK_EVENTS
+
+STATE_FILE_NAME = "pipeline-state.json"
+DEFAULT_JOBS = 4
+
+
+class Stage(NamedTuple):
+    name: str
+    module: str
+    args: Tuple[str, ...]
+    inputs: Tuple[str, ...] = ()
+    outputs: Tuple[str, ...] = ()
+    # output file receiving the standard output of the command
+    stdout: Optional[str] = None
+
+    @property
+    def produced_files(self) -> Tuple[str, ...]:
+        return self.outputs + ((self.stdout,) if self.stdout else ())
+
+
+def get_stages(directory: str) -> List[Stage]:
+    def out(file_name):
+        return os.path.join(directory, file_name)
+
+    def checkpoint(stage_name):
+        return ("--checkpoint", out(f"{stage_name}.checkpoint"))
+
+    def cutoff(value):
+        return str(value / 10**18)
+
+    vlcvx_addresses = out("vlcvx-historical-holders.txt.gz")
+    vlcvx_balances = out("vlcvx-snapshot-balances.json.gz")
+    vecrv_addresses = out("vecrv-holders.txt.gz")
+    vecrv_balances = out("vecrv-holder-balances.json.gz")
+    vecrv_boost_addresses = out("vecrv-holders-after-initial-distribution.txt.gz")
+    vecrv_boost_balances = out("airdrop-boost-vecrv-balances.json.gz")
+    initial = ("-t", "initial-distribution")
+    boost = ("-t", "airdrop-boost")
+
+    return [
+        Stage(
+            "vlcvx-addresses",
+            "conicfinance.generate_snapshot",
+            ("fetch-addresses", "-o", vlcvx_addresses, *checkpoint("vlcvx-addresses")),
+            outputs=(vlcvx_addresses,),
+        ),
+        Stage(
+            "vlcvx-balances",
+            "conicfinance.generate_snapshot",
+            (
+                "fetch-balances",
+                vlcvx_addresses,
+                "-o",
+                vlcvx_balances,
+                *checkpoint("vlcvx-balances"),
+            ),
+            inputs=(vlcvx_addresses,),
+            outputs=(vlcvx_balances,),
+        ),
+        Stage(
+            "airdrop",
+            "conicfinance.generate_snapshot",
+            ("generate-snapshot", vlcvx_balances, "-o", out("airdrop.json")),
+            inputs=(vlcvx_balances,),
+            outputs=(out("airdrop.json"),),
+        ),
+        Stage(
+            "airdrop-root",
+            "conicfinance.cli",
+            ("merkle", "generate-root", out("airdrop.json")),
+            inputs=(out("airdrop.json"),),
+            stdout=out("airdrop-root.txt"),
+        ),
+        Stage(
+            "vecrv-addresses",
+            "conicfinance.vecrv",
+            (*initial, "fetch-addresses", "-o", vecrv_addresses)
+            + checkpoint("vecrv-addresses"),
+            outputs=(vecrv_addresses,),
+        ),
+        Stage(
+            "vecrv-balances",
+            "conicfinance.vecrv",
+            (*initial, "fetch-balances", vecrv_addresses, "-o", vecrv_balances)
+            + checkpoint("vecrv-balances"),
+            inputs=(vecrv_addresses,),
+            outputs=(vecrv_balances,),
+        ),
+        Stage(
+            "whitelist",
+            "conicfinance.cli",
+            (
+                "distribution",
+                "generate-whitelist",
+                "-o",
+                out("whitelist.json"),
+                "--tree-file",
+                out("whitelist.tree"),
+                "-s",
+                f"{vecrv_balances}:{cutoff(whitelist.CUT_OFF_CRV)}",
+                f"{vlcvx_balances}:{cutoff(whitelist.CUT_OFF_CVX)}",
+                whitelist.OG_WHITELIST,
+            ),
+            inputs=(vecrv_balances, vlcvx_balances, whitelist.OG_WHITELIST),
+            outputs=(out("whitelist.json"), out("whitelist.tree")),
+        ),
+        Stage(
+            "vecrv-boost-addresses",
+            "conicfinance.vecrv",
+            (*boost, "fetch-addresses", "-o", vecrv_boost_addresses)
+            + checkpoint("vecrv-boost-addresses"),
+            outputs=(vecrv_boost_addresses,),
+        ),
+        Stage(
+            "vecrv-boost-balances",
+            "conicfinance.vecrv",
+            (
+                *boost,
+                "fetch-balances",
+                vecrv_addresses,
+                vecrv_boost_addresses,
+                "-o",
+                vecrv_boost_balances,
+            )
+            + checkpoint("vecrv-boost-balances"),
+            inputs=(vecrv_addresses, vecrv_boost_addresses),
+            outputs=(vecrv_boost_balances,),
+        ),
+        Stage(
+            "boost-airdrop",
+            "conicfinance.cli",
+            (
+                "airdrop",
+                "generate-boost",
+                "-o",
+                out("boost-airdrop.json"),
+                "--vecrv-balances",
+                vecrv_boost_balances,
+            ),
+            inputs=(vecrv_boost_balances, CNC_LOCK_EVENTS, CNC_LOCK_EVENT_TIMES),
+            outputs=(out("boost-airdrop.json"),),
+        ),
+        Stage(
+            "boost-airdrop-root",
+            "conicfinance.cli",
+            ("merkle", "generate-root", out("boost-airdrop.json")),
+            inputs=(out("boost-airdrop.json"),),
+            stdout=out("boost-airdrop-root.txt"),
+        ),
+    ]
+
+
+PIPELINES = {
+    "initial-airdrop": ["airdrop-root"],
+    "initial-distribution": ["whitelist"],
+    "boost-airdrop": ["boost-airdrop-root"],
+    "all": ["airdrop-root", "whitelist", "boost-airdrop-root"],
+}
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_stage_key(stage: Stage) -> str:
+    data = {
+        "module": stage.module,
+        "args": stage.args,
+        "inputs": {path: hash_file(path) for path in stage.inputs},
+    }
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+
+def get_dependencies(stages: Iterable[Stage]) -> Dict[str, List[str]]:
+    producers = {path: stage.name for stage in stages for path in stage.produced_files}
+    return {
+        stage.name: sorted({producers[p] for p in stage.inputs if p in producers})
+        for stage in stages
+    }
+
+
+def select_stages(stages: List[Stage], targets: Iterable[str]) -> List[Stage]:
+    """`targets` and all the stages they depend on, in the order of `stages`"""
+    by_name = {stage.name: stage for stage in stages}
+    dependencies = get_dependencies(stages)
+    selected = set()
+    pending = list(targets)
+    while pending:
+        name = pending.pop()
+        if name not in by_name:
+            raise ValueError(f"unknown stage {name}")
+        if name not in selected:
+            selected.add(name)
+            pending.extend(dependencies[name])
+    return [stage for stage in stages if stage.name in selected]
+
+
+class PipelineRunner:
+    def __init__(
+        self,
+        stages: List[Stage],
+        directory: str,
+        jobs: int = DEFAULT_JOBS,
+        force: bool = False,
+        dry_run: bool = False,
+    ):
+        self.stages = stages
+        self.dependencies = get_dependencies(stages)
+        self.jobs = jobs
+        self.force = force
+        self.dry_run = dry_run
+        self.state_path = os.path.join(directory, STATE_FILE_NAME)
+        self.state = {}
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                self.state = json.load(f)
+        self._state_lock = threading.Lock()
+        self._output_lock = threading.Lock()
+
+    def log(self, stage: Stage, message: str):
+        with self._output_lock:
+            print(f"[{stage.name}] {message}", flush=True)
+
+    def is_current(self, stage: Stage, key: str) -> bool:
+        recorded = self.state.get(stage.name)
+        if self.force or recorded is None or recorded["key"] != key:
+            return False
+        return all(
+            os.path.exists(path) and hash_file(path) == recorded["outputs"].get(path)
+            for path in stage.produced_files
+        )
+
+    def run(self):
+        """Run all the stages that are not current, dependencies first"""
+        done = set()
+        pending = {stage.name: stage for stage in self.stages}
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            while pending or running:
+                for name, stage in list(pending.items()):
+                    if all(d in done for d in self.dependencies[name]):
+                        running[executor.submit(self.run_stage, stage)] = name
+                        del pending[name]
+                if not running:
+                    raise ValueError(f"unresolvable dependencies: {sorted(pending)}")
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        future.result()
+                    except Exception:
+                        pending.clear()
+                        wait(running)
+                        raise
+                    done.add(name)
+
+    def run_stage(self, stage: Stage):
+        if self.dry_run:
+            self.log(stage, " ".join(self.get_command(stage)))
+            return
+
+        key = get_stage_key(stage)
+        if self.is_current(stage, key):
+            self.log(stage, "up to date")
+            return
+
+        self.log(stage, "running")
+        start = time.perf_counter()
+        for path in stage.produced_files:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if stage.stdout:
+            with open(stage.stdout, "w") as f:
+                subprocess.run(self.get_command(stage), check=True, stdout=f)
+        else:
+            subprocess.run(self.get_command(stage), check=True)
+        self.log(stage, f"done in {time.perf_counter() - start:.1f}s")
+
+        outputs = {path: hash_file(path) for path in stage.produced_files}
+        with self._state_lock:
+            self.state[stage.name] = {"key": key, "outputs": outputs}
+            with open(self.state_path, "w") as f:
+                json.dump(self.state, f, indent=2)
+
+    @staticmethod
+    def get_command(stage: Stage) -> List[str]:
+        return [sys.executable, "-m", stage.module, *stage.args]
+
+
+def run_pipeline(
+    name: str,
+    directory: str,
+    jobs: int = DEFAULT_JOBS,
+    force: bool = False,
+    dry_run: bool = False,
+):
+    os.makedirs(directory, exist_ok=True)
+    stages = select_stages(get_stages(directory), PIPELINES[name])
+    PipelineRunner(stages, directory, jobs, force, dry_run).run()
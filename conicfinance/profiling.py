@@ -0,0 +1,302 @@
+"""Opt-in instrumentation of the command line tools
+
+With `--profile REPORT.json`, a command records its wall time, the JSON-RPC
+requests it sends through `BatchRPCClient` with their latencies per method,
+the bytes it reads and decompresses, its peak RSS and the number of keccak
+hashes it computes, in total and for each of the named stages it goes
+through, and writes them to a JSON report. With `--cprofile DIR`, cProfile
+statistics of the whole command, or of the stages named with
+`--cprofile-stage`, are dumped to `DIR/<stage>.prof`, to be read with
+`pstats` or `snakeviz`.
+
+Stages are nested with `stage(name)` blocks and identified by their path,
+`generate-snapshot fetch-balances/fetch-balances` for instance. They are
+tracked per context, so concurrent coroutines nest their stages correctly,
+but the counters of a stage also include the work done concurrently with it.
+The peak RSS of a stage is the high-water mark of the process when the stage
+ends. Keccak hashes computed in worker processes are not counted.
+
+Nothing is recorded unless a profiler is active, `stage` is then a no-op.
+"""
+
+import cProfile
+import gzip
+import io
+import json
+import os
+import re
+import resource
+import sys
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Iterable, List, Optional
+
+import numpy as np
+from eth_hash.auto import keccak
+
+LATENCY_PERCENTILES = [50, 90, 99]
+
+_profiler: Optional["Profiler"] = None
+_stage_path: ContextVar[str] = ContextVar("stage_path", default="")
+
+
+def get_io_read_bytes() -> Optional[int]:
+    """Bytes read by the process through system calls, including network
+    reads, or `None` if the platform does not report them
+    """
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key == "rchar":
+                    return int(value)
+    except OSError:
+        pass
+    return None
+
+
+def get_peak_rss(who: int = resource.RUSAGE_SELF) -> int:
+    """Peak resident set size in bytes"""
+    max_rss = resource.getrusage(who).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def summarize_latencies(latencies: List[float]) -> dict:
+    latencies_ms = np.array(latencies) * 1000
+    if not len(latencies_ms):
+        return {}
+    summary = {"mean": float(latencies_ms.mean())}
+    for p in LATENCY_PERCENTILES:
+        summary[f"p{p}"] = float(np.percentile(latencies_ms, p))
+    summary["max"] = float(latencies_ms.max())
+    return summary
+
+
+class Profiler:
+    def __init__(
+        self,
+        command: str,
+        cprofile_dir: Optional[str] = None,
+        cprofile_stages: Optional[Iterable[str]] = None,
+    ):
+        self.command = command
+        self.cprofile_dir = cprofile_dir
+        self.cprofile_stages = set(cprofile_stages or [])
+        self.started = time.perf_counter()
+        self.keccak_calls = 0
+        self.rpc_calls = Counter()
+        self.rpc_requests = Counter()
+        self.rpc_latencies = defaultdict(list)
+        self.rpc_response_bytes = 0
+        self.compressed_bytes = 0
+        self.decompressed_bytes = 0
+        self.stages = {}
+        self.cprofile_dumps = []
+        self._cprofile_active = False
+        self._keccak_hasher = None
+        self._initial_io_read_bytes = get_io_read_bytes()
+
+    def install(self):
+        """Count the keccak hashes computed through `eth_hash`, which web3,
+        eth_utils and `conicfinance.merkle.hashing` all go through
+        """
+        # resolves the backend, which replaces `hasher` on the first call
+        keccak(b"")
+        self._keccak_hasher = hasher = keccak.hasher
+
+        def counting_hasher(data):
+            self.keccak_calls += 1
+            return hasher(data)
+
+        keccak.hasher = counting_hasher
+
+    def uninstall(self):
+        if self._keccak_hasher is not None:
+            keccak.hasher = self._keccak_hasher
+            self._keccak_hasher = None
+
+    def record_rpc(self, methods: Iterable[str], latency: float, response_bytes: int):
+        """Record an HTTP request carrying calls to `methods`, its latency is
+        attributed to each of the methods it carries
+        """
+        methods = Counter(methods)
+        self.rpc_calls.update(methods)
+        self.rpc_latencies[None].append(latency)
+        for method in methods:
+            self.rpc_requests[method] += 1
+            self.rpc_latencies[method].append(latency)
+        self.rpc_response_bytes += response_bytes
+
+    def record_read(self, compressed_bytes: int, decompressed_bytes: int):
+        self.compressed_bytes += compressed_bytes
+        self.decompressed_bytes += decompressed_bytes
+
+    def get_counters(self) -> dict:
+        io_read_bytes = get_io_read_bytes()
+        if io_read_bytes is not None:
+            io_read_bytes -= self._initial_io_read_bytes
+        return {
+            "keccak_calls": self.keccak_calls,
+            "rpc_calls": sum(self.rpc_calls.values()),
+            "rpc_requests": len(self.rpc_latencies[None]),
+            "rpc_response_bytes": self.rpc_response_bytes,
+            "io_read_bytes": io_read_bytes,
+            "compressed_bytes": self.compressed_bytes,
+            "decompressed_bytes": self.decompressed_bytes,
+        }
+
+    def should_cprofile(self, path: str) -> bool:
+        if self.cprofile_dir is None or self._cprofile_active:
+            return False
+        if not self.cprofile_stages:
+            return "/" not in path
+        return path in self.cprofile_stages or path.split("/")[-1] in (
+            self.cprofile_stages
+        )
+
+    @contextmanager
+    def stage(self, name: str):
+        parent = _stage_path.get()
+        path = f"{parent}/{name}" if parent else name
+        token = _stage_path.set(path)
+        # registered on entry so that the report lists stages in start order
+        self.stages.setdefault(path, {"calls": 0, "wall_time": 0.0})
+        profile = None
+        if self.should_cprofile(path):
+            profile = cProfile.Profile()
+            self._cprofile_active = True
+            profile.enable()
+        initial_counters = self.get_counters()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            wall_time = time.perf_counter() - start
+            if profile is not None:
+                profile.disable()
+                self._cprofile_active = False
+                self.dump_cprofile(profile, path)
+            _stage_path.reset(token)
+            self.update_stage(path, wall_time, initial_counters)
+
+    def update_stage(self, path: str, wall_time: float, initial_counters: dict):
+        stage = self.stages[path]
+        stage["calls"] += 1
+        stage["wall_time"] += wall_time
+        for key, value in self.get_counters().items():
+            if value is not None:
+                value -= initial_counters[key]
+                stage[key] = stage.get(key, 0) + value
+        stage["peak_rss"] = get_peak_rss()
+
+    def dump_cprofile(self, profile: cProfile.Profile, path: str):
+        os.makedirs(self.cprofile_dir, exist_ok=True)
+        file_name = re.sub(r"[^\w.-]+", "_", path)
+        dump_file = os.path.join(self.cprofile_dir, f"{file_name}.prof")
+        profile.dump_stats(dump_file)
+        self.cprofile_dumps.append(dump_file)
+
+    def get_report(self) -> dict:
+        counters = self.get_counters()
+        return {
+            "command": self.command,
+            "argv": sys.argv,
+            "wall_time": time.perf_counter() - self.started,
+            "peak_rss": get_peak_rss(),
+            "peak_rss_children": get_peak_rss(resource.RUSAGE_CHILDREN),
+            "io_read_bytes": counters["io_read_bytes"],
+            "compressed_bytes": self.compressed_bytes,
+            "decompressed_bytes": self.decompressed_bytes,
+            "keccak_calls": self.keccak_calls,
+            "rpc": {
+                "calls": counters["rpc_calls"],
+                "requests": counters["rpc_requests"],
+                "response_bytes": self.rpc_response_bytes,
+                "latency_ms": summarize_latencies(self.rpc_latencies[None]),
+                "methods": {
+                    method: {
+                        "calls": calls,
+                        "requests": self.rpc_requests[method],
+                        "latency_ms": summarize_latencies(self.rpc_latencies[method]),
+                    }
+                    for method, calls in sorted(self.rpc_calls.items())
+                },
+            },
+            "stages": self.stages,
+            "cprofile_dumps": self.cprofile_dumps,
+        }
+
+
+def stage(name: str):
+    """Context manager recording a stage of the active profiler, if any"""
+    if _profiler is None:
+        return nullcontext()
+    return _profiler.stage(name)
+
+
+def record_rpc(methods: Iterable[str], latency: float, response_bytes: int = 0):
+    if _profiler is not None:
+        _profiler.record_rpc(methods, latency, response_bytes)
+
+
+@contextmanager
+def open_gzip(path: str, mode: str = "rb"):
+    """`gzip.open`, recording the bytes read from and decompressed out of
+    `path` when a profiler is active
+    """
+    with gzip.open(path, mode) as f:
+        try:
+            yield f
+        finally:
+            if _profiler is not None and "r" in mode:
+                gzip_file = f.buffer if isinstance(f, io.TextIOWrapper) else f
+                _profiler.record_read(gzip_file.fileobj.tell(), gzip_file.tell())
+
+
+def add_profile_arguments(parser):
+    parser.add_argument(
+        "--profile",
+        metavar="REPORT",
+        help="Write a JSON report of the stage timings, RPC requests, bytes "
+        "read, peak memory and keccak calls of the command",
+    )
+    parser.add_argument(
+        "--cprofile",
+        metavar="DIR",
+        help="Dump cProfile statistics of the command, or of the stages given "
+        "with --cprofile-stage, to DIR",
+    )
+    parser.add_argument(
+        "--cprofile-stage",
+        action="append",
+        metavar="STAGE",
+        help="Name or path of a stage to run under cProfile, can be repeated",
+    )
+
+
+@contextmanager
+def profile_command(args, command: str):
+    """Profile the body of the block as `command` if `--profile` or
+    `--cprofile` is given, the report is written even if the command fails
+    """
+    global _profiler
+    if not (args.profile or args.cprofile):
+        yield
+        return
+
+    _profiler = Profiler(command, args.cprofile, args.cprofile_stage)
+    _profiler.install()
+    try:
+        with _profiler.stage(command):
+            yield
+    finally:
+        _profiler.uninstall()
+        report = _profiler.get_report()
+        _profiler = None
+        if args.profile:
+            with open(args.profile, "w") as f:
+                json.dump(report, f, indent=2)
+            print(f"profile written to {args.profile}", file=sys.stderr)
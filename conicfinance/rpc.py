@@ -0,0 +1,263 @@
+"""Asynchronous JSON-RPC client sending batched requests over pooled connections"""
+
+import asyncio
+import itertools
+import json
+import time
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+import aiohttp
+
+from conicfinance import profiling
+from conicfinance.rpc_cache import (
+    ResponseCache,
+    get_fallback_finalized_block,
+    get_response_cache,
+    parse_finalized_block,
+)
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_TIMEOUT = 120
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+# fragments of the errors some providers return in a 200 response when rate
+# limiting, such as Infura's -32005 "project ID request rate exceeded"
+RATE_LIMIT_ERROR_MESSAGES = (
+    "rate exceeded",
+    "rate limit",
+    "too many requests",
+    "compute units per second",
+)
+
+RPCCall = Tuple[str, list]
+
+
+class RPCError(Exception):
+    def __init__(self, code: int, message: str, data: Any = None):
+        super().__init__(f"RPC error {code}: {message}")
+        self.code = code
+        self.message = message
+        self.data = data
+
+
+def is_rate_limited(response: Any) -> bool:
+    """Whether a JSON-RPC response, or any item of a batch, is a rate limit error"""
+    items = response if isinstance(response, list) else [response]
+    for item in items:
+        error = item.get("error") if isinstance(item, dict) else None
+        if isinstance(error, dict):
+            message = str(error.get("message", "")).lower()
+            if error.get("code") == 429 or any(
+                m in message for m in RATE_LIMIT_ERROR_MESSAGES
+            ):
+                return True
+    return False
+
+
+class RateLimiter:
+    """Spaces requests evenly to stay under `rate` requests per second"""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self._next_time = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next_time - now
+            self._next_time = max(now, self._next_time) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class BatchRPCClient:
+    """JSON-RPC client splitting calls in batches sent concurrently
+
+    Must be used as an async context manager so that the HTTP session is
+    opened and closed properly. Responses pinned to finalized blocks are
+    served from and stored in `cache`, which defaults to the cache configured
+    through `ETH_RPC_CACHE`
+    """
+
+    def __init__(
+        self,
+        url: str,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        rate_limit: Optional[float] = None,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        timeout: float = DEFAULT_TIMEOUT,
+        cache: Optional[ResponseCache] = None,
+    ):
+        self.url = url
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.cache = cache or get_response_cache()
+        self._rate_limiter = RateLimiter(rate_limit) if rate_limit else None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._ids = itertools.count()
+
+    async def __aenter__(self):
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.concurrency),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._session.close()
+
+    async def request(self, method: str, params: list) -> Any:
+        (result,) = await self.batch([(method, params)])
+        return result
+
+    async def batch(
+        self,
+        calls: Sequence[RPCCall],
+        return_exceptions: bool = False,
+        on_batch_done: Optional[Callable[[int], None]] = None,
+        batch_size: Optional[int] = None,
+    ) -> List[Any]:
+        """Execute all calls and return their results in order
+        If `return_exceptions` is set, failed calls return an `RPCError`
+        instead of raising it. `batch_size` overrides the client default
+        for calls with large payloads
+        """
+        if self.cache:
+            results = await self._batch_cached(calls, on_batch_done, batch_size)
+        else:
+            results = await self._batch(calls, on_batch_done, batch_size)
+
+        if not return_exceptions:
+            for result in results:
+                if isinstance(result, RPCError):
+                    raise result
+        return results
+
+    async def _batch_cached(self, calls, on_batch_done, batch_size) -> List[Any]:
+        await self._ensure_finalized_block()
+
+        results = [None] * len(calls)
+        missing_indices = []
+        for i, (method, params) in enumerate(calls):
+            if self.cache.is_cacheable(method, params):
+                hit, results[i] = self.cache.get(method, params)
+                if hit:
+                    continue
+            missing_indices.append(i)
+        if on_batch_done and len(missing_indices) < len(calls):
+            on_batch_done(len(calls) - len(missing_indices))
+
+        missing_calls = [calls[i] for i in missing_indices]
+        fetched = await self._batch(missing_calls, on_batch_done, batch_size)
+        for i, (method, params), result in zip(missing_indices, missing_calls, fetched):
+            results[i] = result
+            if not isinstance(result, RPCError) and self.cache.is_cacheable(
+                method, params
+            ):
+                self.cache.put(method, params, result)
+        self.cache.flush()
+        return results
+
+    async def _ensure_finalized_block(self):
+        if self.cache.finalized_block is not None:
+            return
+        (block,) = await self._send_batch([("eth_getBlockByNumber", ["finalized", False])])
+        self.cache.finalized_block = parse_finalized_block(block)
+        if self.cache.finalized_block is None:
+            (latest,) = await self._send_batch([("eth_blockNumber", [])])
+            self.cache.finalized_block = get_fallback_finalized_block(latest)
+
+    async def _batch(self, calls, on_batch_done, batch_size) -> List[Any]:
+        batch_size = batch_size or self.batch_size
+
+        async def run_chunk(chunk):
+            results = await self._send_batch(chunk)
+            if on_batch_done:
+                on_batch_done(len(chunk))
+            return results
+
+        chunks = [calls[i : i + batch_size] for i in range(0, len(calls), batch_size)]
+        chunk_results = await asyncio.gather(*(run_chunk(c) for c in chunks))
+        return [result for chunk in chunk_results for result in chunk]
+
+    async def _send_batch(self, calls: Sequence[RPCCall]) -> List[Any]:
+        ids = [next(self._ids) for _ in calls]
+        payload = [
+            {"jsonrpc": "2.0", "id": id_, "method": method, "params": params}
+            for id_, (method, params) in zip(ids, calls)
+        ]
+        response = await self._post(payload)
+        if isinstance(response, dict):
+            # some nodes answer a whole batch with a single error object
+            error = response.get("error", {})
+            raise RPCError(error.get("code", 0), error.get("message", str(response)))
+
+        responses = {item["id"]: item for item in response}
+        results = []
+        for id_ in ids:
+            item = responses.get(id_)
+            if item is None:
+                results.append(RPCError(0, f"missing response for request {id_}"))
+            elif "error" in item:
+                error = item["error"]
+                results.append(
+                    RPCError(error.get("code", 0), error["message"], error.get("data"))
+                )
+            else:
+                results.append(item["result"])
+        return results
+
+    async def _post(self, payload: list) -> Any:
+        for attempt in itertools.count():
+            if self._rate_limiter:
+                await self._rate_limiter.wait()
+            try:
+                async with self._semaphore:
+                    start = time.perf_counter()
+                    async with self._session.post(self.url, json=payload) as response:
+                        if response.status in RETRYABLE_STATUSES:
+                            raise aiohttp.ClientResponseError(
+                                response.request_info,
+                                response.history,
+                                status=response.status,
+                            )
+                        response.raise_for_status()
+                        body = await response.read()
+                    profiling.record_rpc(
+                        [call["method"] for call in payload],
+                        time.perf_counter() - start,
+                        len(body),
+                    )
+                    result = json.loads(body)
+                    # rate limit errors are retried like 429 responses
+                    if not is_rate_limited(result) or attempt >= self.max_retries:
+                        return result
+            except aiohttp.ClientResponseError as ex:
+                if ex.status not in RETRYABLE_STATUSES or attempt >= self.max_retries:
+                    raise
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt >= self.max_retries:
+                    raise
+            await asyncio.sleep(min(2**attempt, 30))
+
+
+def add_rpc_arguments(parser):
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help="Maximum number of concurrent HTTP requests",
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=float,
+        help="Maximum number of HTTP requests per second",
+    )
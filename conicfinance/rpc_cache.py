@@ -0,0 +1,211 @@
+"""Disk-backed cache of JSON-RPC responses for calls pinned to finalized blocks
+
+Only requests naming an explicit block number at or below the finalized
+block are cached, since their responses can never change: `eth_call`,
+`eth_getCode`, `eth_getBalance` and `eth_getStorageAt` at a block number,
+`eth_getBlockByNumber` and `eth_getLogs` with a numeric `toBlock`.
+
+The cache is enabled by pointing the `ETH_RPC_CACHE` environment variable to
+a SQLite file, and its size can be bounded with `ETH_RPC_CACHE_SIZE` in MB.
+Least recently used entries are evicted once the limit is reached.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+from collections import Counter
+from typing import Any, Optional, Tuple
+
+DEFAULT_MAX_SIZE_MB = 1024
+# depth used when the node does not support the `finalized` block tag
+FINALITY_DEPTH = 64
+# least recently used entries read at once when evicting
+EVICTION_CHUNK_SIZE = 1_000
+
+BLOCK_PARAM_METHODS = {"eth_call", "eth_getCode", "eth_getBalance", "eth_getStorageAt"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    method TEXT NOT NULL,
+    result TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_used INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used);
+CREATE TABLE IF NOT EXISTS stats (
+    method TEXT PRIMARY KEY,
+    hits INTEGER NOT NULL,
+    misses INTEGER NOT NULL
+);
+"""
+
+
+def _parse_block_number(block_identifier: Any) -> Optional[int]:
+    if isinstance(block_identifier, int):
+        return block_identifier
+    if isinstance(block_identifier, str) and block_identifier.startswith("0x"):
+        return int(block_identifier, 16)
+    return None
+
+
+def get_pinned_block(method: str, params: list) -> Optional[int]:
+    """Block number a request is pinned to, or `None` if its response may change"""
+    if not params:
+        return None
+    if method in BLOCK_PARAM_METHODS:
+        return _parse_block_number(params[-1])
+    if method == "eth_getBlockByNumber":
+        return _parse_block_number(params[0])
+    if method == "eth_getLogs" and isinstance(params[0], dict):
+        if "blockHash" in params[0]:
+            return None
+        return _parse_block_number(params[0].get("toBlock"))
+    return None
+
+
+def _json_default(value):
+    if isinstance(value, (bytes, bytearray)):
+        return "0x" + bytes(value).hex()
+    if isinstance(value, dict):
+        return dict(value)
+    raise TypeError(f"cannot serialize {type(value)}")
+
+
+def get_cache_key(method: str, params: list) -> str:
+    data = json.dumps([method, params], sort_keys=True, default=_json_default)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def parse_finalized_block(block: Any) -> Optional[int]:
+    """Number of the block returned for the `finalized` tag, if any"""
+    if isinstance(block, dict) and "number" in block:
+        return int(block["number"], 16)
+    return None
+
+
+def get_fallback_finalized_block(latest_block: str) -> int:
+    return int(latest_block, 16) - FINALITY_DEPTH
+
+
+class ResponseCache:
+    def __init__(self, path: str, max_size: int = DEFAULT_MAX_SIZE_MB * 2**20):
+        self.max_size = max_size
+        self.finalized_block: Optional[int] = None
+        self.hits: Counter = Counter()
+        self.misses: Counter = Counter()
+        self._flushed_hits: Counter = Counter()
+        self._flushed_misses: Counter = Counter()
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute("PRAGMA synchronous = NORMAL")
+        self._db.executescript(SCHEMA)
+        self._size, self._clock = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0), COALESCE(MAX(last_used), 0) FROM responses"
+        ).fetchone()
+
+    def close(self):
+        self.flush()
+        self._db.close()
+
+    def is_cacheable(self, method: str, params: list) -> bool:
+        block = get_pinned_block(method, params)
+        return (
+            block is not None
+            and self.finalized_block is not None
+            and block <= self.finalized_block
+        )
+
+    def get(self, method: str, params: list) -> Tuple[bool, Any]:
+        key = get_cache_key(method, params)
+        row = self._db.execute(
+            "SELECT result FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            self.misses[method] += 1
+            return False, None
+        self.hits[method] += 1
+        self._clock += 1
+        self._db.execute(
+            "UPDATE responses SET last_used = ? WHERE key = ?", (self._clock, key)
+        )
+        return True, json.loads(row[0])
+
+    def put(self, method: str, params: list, result: Any):
+        key = get_cache_key(method, params)
+        data = json.dumps(result, default=_json_default)
+        self._clock += 1
+        previous = self._db.execute(
+            "SELECT size FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if previous:
+            self._size -= previous[0]
+        self._db.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+            (key, method, data, len(data), self._clock),
+        )
+        self._size += len(data)
+        if self._size > self.max_size:
+            self._evict()
+
+    def flush(self):
+        """Commit pending writes and add this session's counts to the stored stats"""
+        hits = self.hits - self._flushed_hits
+        misses = self.misses - self._flushed_misses
+        with self._db:
+            for method in hits.keys() | misses.keys():
+                self._db.execute(
+                    "INSERT INTO stats VALUES (?, ?, ?) ON CONFLICT (method) DO UPDATE "
+                    "SET hits = hits + excluded.hits, misses = misses + excluded.misses",
+                    (method, hits[method], misses[method]),
+                )
+        self._flushed_hits = self.hits.copy()
+        self._flushed_misses = self.misses.copy()
+
+    def _evict(self):
+        """Drop least recently used entries until the cache is 10% under its limit"""
+        target = self.max_size * 9 // 10
+        while self._size > target:
+            rows = self._db.execute(
+                "SELECT key, size FROM responses ORDER BY last_used LIMIT ?",
+                (EVICTION_CHUNK_SIZE,),
+            ).fetchall()
+            if not rows:
+                break
+            evicted = []
+            for key, size in rows:
+                if self._size <= target:
+                    break
+                evicted.append((key,))
+                self._size -= size
+            self._db.executemany("DELETE FROM responses WHERE key = ?", evicted)
+        self._db.commit()
+
+    def format_stats(self) -> str:
+        lines = ["rpc cache (hits/misses):"]
+        for method in sorted(self.hits.keys() | self.misses.keys()):
+            lines.append(f"  {method}: {self.hits[method]}/{self.misses[method]}")
+        return "\n".join(lines)
+
+
+_response_cache: Optional[ResponseCache] = None
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """Cache configured through `ETH_RPC_CACHE`, shared by the whole process"""
+    global _response_cache
+    if _response_cache is None and os.environ.get("ETH_RPC_CACHE"):
+        max_size_mb = int(os.environ.get("ETH_RPC_CACHE_SIZE", DEFAULT_MAX_SIZE_MB))
+        _response_cache = ResponseCache(
+            os.environ["ETH_RPC_CACHE"], max_size=max_size_mb * 2**20
+        )
+    return _response_cache
+
+
+def report_response_cache():
+    """Persist and print the statistics of the configured cache, if any"""
+    cache = get_response_cache()
+    if cache is not None:
+        cache.flush()
+        print(cache.format_stats())
@@ -0,0 +1,266 @@
+"""Columnar binary representation of balance snapshots
+
+Layout (all integers little-endian unless stated otherwise):
+
+* header: magic, number of accounts, flags
+* addresses: one 20-byte address per account
+* balances: one 32-byte big-endian balance per account
+* is_eoa: bitmap with one bit per account, least significant bit first
+
+Columns are read straight from the memory-mapped file. Big-endian balances
+of the same width compare like the integers they encode, so accounts can be
+filtered by balance without decoding them. Checksumming addresses needs a
+keccak hash per address and is the dominant cost of loading a snapshot, so
+it is batched and only done for the selected accounts.
+
+Snapshots are also stored as gzipped JSON lists of
+`{"address", "balance", "is_eoa"}` objects with decimal string balances;
+`load_snapshot` and `write_snapshot` handle both formats.
+
+Datasets can carry a JSON sidecar file with metadata, such as the block they
+were computed at.
+"""
+
+import gzip
+import json
+import mmap
+import os
+import re
+import struct
+from typing import IO, Iterator, List, Optional, Sequence
+
+import numpy as np
+from eth_hash.auto import keccak
+
+from conicfinance import profiling
+from conicfinance.merkle.hashing import address_to_bytes
+
+MAGIC = b"CNCSNAP\x01"
+HEADER = struct.Struct("<8sII")
+
+ADDRESS_SIZE = 20
+BALANCE_SIZE = 32
+
+SNAPSHOT_FILE_EXTENSION = ".snap"
+METADATA_SUFFIX = ".meta.json"
+
+JSON_CHUNK_SIZE = 1 << 16
+JSON_SEPARATORS = re.compile(r"[\s,]*")
+
+
+def is_snapshot_file(path: str) -> bool:
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def to_checksum_addresses(raw_addresses: bytes) -> List[str]:
+    """EIP-55 checksums of packed 20-byte addresses"""
+    count = len(raw_addresses) // ADDRESS_SIZE
+    hex_addresses = raw_addresses.hex().encode()
+    width = ADDRESS_SIZE * 2
+    digests = b"".join(
+        [keccak(hex_addresses[i : i + width]) for i in range(0, count * width, width)]
+    )
+
+    # a letter is uppercased when the matching nibble of the hash is at least 8
+    digest_bytes = np.frombuffer(digests, dtype=np.uint8).reshape(count, 32)
+    nibbles = np.empty((count, width), dtype=np.uint8)
+    nibbles[:, 0::2] = digest_bytes[:, :ADDRESS_SIZE] >> 4
+    nibbles[:, 1::2] = digest_bytes[:, :ADDRESS_SIZE] & 0xF
+    chars = np.frombuffer(hex_addresses, dtype=np.uint8).reshape(count, width).copy()
+    chars[(nibbles >= 8) & (chars >= ord("a"))] -= ord("a") - ord("A")
+
+    checksummed = chars.tobytes().decode()
+    return ["0x" + checksummed[i : i + width] for i in range(0, count * width, width)]
+
+
+def write_snapshot_file(accounts: List[dict], output_file: str):
+    is_eoa_bitmap = bytearray((len(accounts) + 7) // 8)
+    for i, account in enumerate(accounts):
+        if account["is_eoa"]:
+            is_eoa_bitmap[i // 8] |= 1 << (i % 8)
+
+    with open(output_file, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(accounts), 0))
+        f.write(b"".join(address_to_bytes(a["address"]) for a in accounts))
+        f.write(
+            b"".join(int(a["balance"]).to_bytes(BALANCE_SIZE, "big") for a in accounts)
+        )
+        f.write(is_eoa_bitmap)
+
+
+class SnapshotFile:
+    """Read-only view over a file written by `write_snapshot_file`"""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.accounts_count, _ = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a snapshot file")
+        self.addresses_offset = HEADER.size
+        self.balances_offset = HEADER.size + self.accounts_count * ADDRESS_SIZE
+        self.is_eoa_offset = self.balances_offset + self.accounts_count * BALANCE_SIZE
+
+    def close(self):
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self) -> int:
+        return self.accounts_count
+
+    def get_raw_address(self, index: int) -> bytes:
+        offset = self.addresses_offset + index * ADDRESS_SIZE
+        return self._mmap[offset : offset + ADDRESS_SIZE]
+
+    def get_address(self, index: int) -> str:
+        (address,) = to_checksum_addresses(self.get_raw_address(index))
+        return address
+
+    def get_addresses(self, indices: Optional[Sequence[int]] = None) -> List[str]:
+        """Checksummed addresses of all accounts, or of the accounts at `indices`"""
+        if indices is None:
+            end = self.addresses_offset + self.accounts_count * ADDRESS_SIZE
+            return to_checksum_addresses(self._mmap[self.addresses_offset : end])
+        return to_checksum_addresses(b"".join(self.get_raw_address(i) for i in indices))
+
+    def get_raw_balance(self, index: int) -> bytes:
+        offset = self.balances_offset + index * BALANCE_SIZE
+        return self._mmap[offset : offset + BALANCE_SIZE]
+
+    def get_balance(self, index: int) -> int:
+        return int.from_bytes(self.get_raw_balance(index), "big")
+
+    def is_eoa(self, index: int) -> bool:
+        return bool(self._mmap[self.is_eoa_offset + index // 8] >> (index % 8) & 1)
+
+    def get_balances(self) -> List[int]:
+        end = self.balances_offset + self.accounts_count * BALANCE_SIZE
+        raw_balances = self._mmap[self.balances_offset : end]
+        return [
+            int.from_bytes(raw_balances[i : i + BALANCE_SIZE], "big")
+            for i in range(0, len(raw_balances), BALANCE_SIZE)
+        ]
+
+    def get_is_eoa(self) -> List[bool]:
+        end = self.is_eoa_offset + (self.accounts_count + 7) // 8
+        bitmap = np.frombuffer(self._mmap[self.is_eoa_offset : end], dtype=np.uint8)
+        bits = np.unpackbits(bitmap, count=self.accounts_count, bitorder="little")
+        return bits.astype(bool).tolist()
+
+    def find_indices(self, min_balance: int) -> List[int]:
+        """Indices of the accounts holding at least `min_balance`"""
+        end = self.balances_offset + self.accounts_count * BALANCE_SIZE
+        # every balance as four big-endian 64-bit words, compared word by word
+        # starting from the least significant one
+        words = np.frombuffer(
+            self._mmap[self.balances_offset : end], dtype=">u8"
+        ).reshape(self.accounts_count, BALANCE_SIZE // 8)
+        min_words = np.frombuffer(min_balance.to_bytes(BALANCE_SIZE, "big"), ">u8")
+        selected = words[:, -1] >= min_words[-1]
+        for i in range(words.shape[1] - 2, -1, -1):
+            selected = (words[:, i] > min_words[i]) | (
+                (words[:, i] == min_words[i]) & selected
+            )
+        return np.flatnonzero(selected).tolist()
+
+    def __iter__(self) -> Iterator[dict]:
+        """Accounts in the same form as in JSON snapshots"""
+        columns = zip(self.get_addresses(), self.get_balances(), self.get_is_eoa())
+        for address, balance, is_eoa in columns:
+            yield {"address": address, "balance": str(balance), "is_eoa": is_eoa}
+
+
+def load_snapshot(path: str) -> List[dict]:
+    """Accounts of a columnar or gzipped JSON snapshot"""
+    with profiling.stage("load-snapshot"):
+        if is_snapshot_file(path):
+            with SnapshotFile(path) as snapshot:
+                return list(snapshot)
+        with profiling.open_gzip(path) as f:
+            return json.load(f)
+
+
+def _iter_json_array(f: IO[str]) -> Iterator[dict]:
+    """Decode the objects of a JSON array one at a time, reading `f` by chunks"""
+    decoder = json.JSONDecoder()
+    buffer = f.read(JSON_CHUNK_SIZE).lstrip()
+    if not buffer.startswith("["):
+        raise ValueError("expected a JSON array")
+    position = 1
+    while True:
+        position = JSON_SEPARATORS.match(buffer, position).end()
+        if buffer.startswith("]", position):
+            return
+        try:
+            item, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            chunk = f.read(JSON_CHUNK_SIZE)
+            if not chunk:
+                raise
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        yield item
+
+
+def iter_snapshot(path: str) -> Iterator[dict]:
+    """Accounts of a columnar or gzipped JSON snapshot, decoded one at a time"""
+    if is_snapshot_file(path):
+        with SnapshotFile(path) as snapshot:
+            yield from snapshot
+    else:
+        with profiling.open_gzip(path, "rt") as f:
+            yield from _iter_json_array(f)
+
+
+def get_addresses_with_balance(path: str, min_balance: int) -> List[str]:
+    """Addresses of a columnar or gzipped JSON snapshot holding at least
+    `min_balance`, without decoding the other balances of columnar snapshots
+    """
+    if not is_snapshot_file(path):
+        accounts = iter_snapshot(path)
+        return [a["address"] for a in accounts if int(a["balance"]) >= min_balance]
+    with SnapshotFile(path) as snapshot:
+        return snapshot.get_addresses(snapshot.find_indices(min_balance))
+
+
+def write_snapshot(accounts: List[dict], output_file: str):
+    """Write a columnar snapshot if `output_file` ends with `.snap` and a
+    gzipped JSON one otherwise
+    """
+    if output_file.endswith(SNAPSHOT_FILE_EXTENSION):
+        write_snapshot_file(accounts, output_file)
+    else:
+        with gzip.open(output_file, "wt") as f:
+            json.dump(accounts, f)
+
+
+def convert_snapshot(input_file: str, output_file: str):
+    write_snapshot(load_snapshot(input_file), output_file)
+
+
+def get_metadata_path(path: str) -> str:
+    return path + METADATA_SUFFIX
+
+
+def write_snapshot_metadata(path: str, metadata: dict):
+    """Record `metadata`, such as the block a dataset was computed at, next
+    to the dataset stored in `path`
+    """
+    with open(get_metadata_path(path), "w") as f:
+        json.dump(metadata, f, indent=2)
+
+
+def read_snapshot_metadata(path: str) -> dict:
+    metadata_path = get_metadata_path(path)
+    if not os.path.exists(metadata_path):
+        raise ValueError(f"{path} has no metadata, expected in {metadata_path}")
+    with open(metadata_path) as f:
+        return json.load(f)
@@ -0,0 +1,190 @@
+"""Historical contract reads aggregated through Multicall3
+
+Calls are encoded from the ABIs in `abis/`, packed by hundreds into
+`aggregate3` calls executed at the snapshot block, and decoded back into
+Python values. When an aggregated call fails as a whole, for instance
+because it runs out of gas, its calls are sent one by one instead.
+"""
+
+import json
+from os import path
+from typing import Any, Callable, List, NamedTuple, Optional, Sequence
+
+from eth_abi import decode_abi, encode_abi
+from eth_abi.exceptions import DecodingError
+from eth_utils import function_abi_to_4byte_selector
+
+from conicfinance.rpc import BatchRPCClient, RPCError
+
+ABIS_PATH = path.join(path.dirname(path.dirname(__file__)), "abis")
+
+MULTICALL3_ADDRESS = "0xcA11bde05779BA9813f41Db3dC5CfEa5BFB1e8b4"
+MULTICALL3_DEPLOYED_BLOCK = 14_353_601
+# aggregate3((address,bool,bytes)[])
+AGGREGATE3_SELECTOR = bytes.fromhex("82ad56cb")
+
+DEFAULT_CALLS_PER_AGGREGATE = 500
+
+
+def load_abi(file_name: str) -> list:
+    with open(path.join(ABIS_PATH, file_name)) as f:
+        return json.load(f)
+
+
+def get_abi_type(param: dict) -> str:
+    abi_type = param["type"]
+    if not abi_type.startswith("tuple"):
+        return abi_type
+    components = ",".join(get_abi_type(c) for c in param["components"])
+    return f"({components}){abi_type[len('tuple'):]}"
+
+
+class ContractCall(NamedTuple):
+    address: str
+    function: dict
+    args: tuple
+
+    def encode(self) -> bytes:
+        input_types = [get_abi_type(p) for p in self.function["inputs"]]
+        return function_abi_to_4byte_selector(self.function) + encode_abi(
+            input_types, self.args
+        )
+
+    def decode(self, data: bytes) -> Any:
+        output_types = [get_abi_type(p) for p in self.function["outputs"]]
+        values = decode_abi(output_types, data)
+        return values[0] if len(values) == 1 else values
+
+
+class SnapshotContract:
+    def __init__(self, address: str, abi_file_name: str):
+        self.address = address
+        self.abi = load_abi(abi_file_name)
+
+    def call(self, function_name: str, *args) -> ContractCall:
+        for item in self.abi:
+            if (
+                item.get("type") == "function"
+                and item["name"] == function_name
+                and len(item["inputs"]) == len(args)
+            ):
+                return ContractCall(self.address, item, args)
+        raise ValueError(f"no function {function_name} with {len(args)} arguments")
+
+
+class SnapshotReader:
+    def __init__(
+        self,
+        client: BatchRPCClient,
+        block: int,
+        multicall_address: str = MULTICALL3_ADDRESS,
+        calls_per_aggregate: int = DEFAULT_CALLS_PER_AGGREGATE,
+    ):
+        self.client = client
+        self.block = block
+        self.multicall_address = multicall_address
+        self.calls_per_aggregate = calls_per_aggregate
+
+    @property
+    def use_multicall(self) -> bool:
+        """Calls are sent one by one if `calls_per_aggregate` is 0 or if
+        Multicall3 was not deployed yet at the snapshot block
+        """
+        if self.calls_per_aggregate <= 0:
+            return False
+        if self.multicall_address != MULTICALL3_ADDRESS:
+            return True
+        return self.block >= MULTICALL3_DEPLOYED_BLOCK
+
+    async def read(
+        self,
+        calls: Sequence[ContractCall],
+        return_exceptions: bool = False,
+        on_calls_done: Optional[Callable[[int], None]] = None,
+    ) -> List[Any]:
+        """Execute all calls at the snapshot block and return the decoded results
+        If `return_exceptions` is set, failed calls return an `RPCError`
+        instead of raising it
+        """
+        if self.use_multicall:
+            results = await self._read_aggregated(calls, on_calls_done)
+        else:
+            results = await self._read_single(calls, on_calls_done)
+
+        if not return_exceptions:
+            for result in results:
+                if isinstance(result, RPCError):
+                    raise result
+        return results
+
+    async def _read_aggregated(self, calls, on_calls_done) -> List[Any]:
+        chunks = [
+            calls[i : i + self.calls_per_aggregate]
+            for i in range(0, len(calls), self.calls_per_aggregate)
+        ]
+        aggregate_calls = [
+            self._eth_call(self.multicall_address, self._encode_aggregate(chunk))
+            for chunk in chunks
+        ]
+        # each aggregated call already carries hundreds of calls
+        responses = await self.client.batch(
+            aggregate_calls, return_exceptions=True, batch_size=1
+        )
+
+        results = []
+        failed_indices = []
+        for chunk, response in zip(chunks, responses):
+            if isinstance(response, RPCError):
+                failed_indices.extend(range(len(results), len(results) + len(chunk)))
+                results.extend([None] * len(chunk))
+                continue
+            (call_results,) = decode_abi(["(bool,bytes)[]"], _to_bytes(response))
+            for call, (success, data) in zip(chunk, call_results):
+                results.append(_decode(call, data) if success else _reverted(call))
+            if on_calls_done:
+                on_calls_done(len(chunk))
+
+        if failed_indices:
+            failed_calls = [calls[i] for i in failed_indices]
+            retried = await self._read_single(failed_calls, on_calls_done)
+            for i, result in zip(failed_indices, retried):
+                results[i] = result
+        return results
+
+    async def _read_single(self, calls, on_calls_done) -> List[Any]:
+        responses = await self.client.batch(
+            [self._eth_call(call.address, call.encode()) for call in calls],
+            return_exceptions=True,
+            on_batch_done=on_calls_done,
+        )
+        return [
+            response
+            if isinstance(response, RPCError)
+            else _decode(call, _to_bytes(response))
+            for call, response in zip(calls, responses)
+        ]
+
+    def _eth_call(self, address: str, data: bytes):
+        params = {"to": address, "data": "0x" + data.hex()}
+        return ("eth_call", [params, hex(self.block)])
+
+    def _encode_aggregate(self, calls: Sequence[ContractCall]) -> bytes:
+        encoded_calls = [(call.address, True, call.encode()) for call in calls]
+        return AGGREGATE3_SELECTOR + encode_abi(
+            ["(address,bool,bytes)[]"], [encoded_calls]
+        )
+
+
+def _decode(call: ContractCall, data: bytes) -> Any:
+    try:
+        return call.decode(data)
+    except DecodingError as ex:
+        return RPCError(0, f"could not decode {call.function['name']}: {ex}")
+
+
+def _reverted(call: ContractCall) -> RPCError:
+    return RPCError(0, f"call to {call.function['name']} on {call.address} reverted")
+
+
+def _to_bytes(data: str) -> bytes:
+    return bytes.fromhex(data[2:])
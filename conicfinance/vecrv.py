@@ -1,14 +1,29 @@
 import argparse
+import asyncio
 import gzip
-import json
 import os
 from decimal import Decimal
-from os import path
-from typing import Optional
+from typing import Iterable, List, Set, Tuple
 
-from tqdm import tqdm
-from web3 import HTTPProvider, Web3
-from web3.contract import Contract
+from web3 import Web3
+
+from conicfinance import balances as balances_engine
+from conicfinance import profiling
+from conicfinance.checkpoint import CheckpointStore, add_checkpoint_argument
+from conicfinance.log_scanner import (
+    add_scan_arguments,
+    get_event_abi,
+    scan_event_values,
+)
+from conicfinance.rpc import BatchRPCClient, add_rpc_arguments
+from conicfinance.rpc_cache import report_response_cache
+from conicfinance.snapshot_file import (
+    load_snapshot,
+    read_snapshot_metadata,
+    write_snapshot,
+    write_snapshot_metadata,
+)
+from conicfinance.snapshot_reader import SnapshotContract, load_abi
 
 
 INITIAL_DISTRIBUTION_SNAPSHOT_BLOCK = 14_528_680
@@ -27,35 +42,51 @@ parser.add_argument(
     help="Type of the current event",
     required=True,
 )
+profiling.add_profile_arguments(parser)
 
 subparsers = parser.add_subparsers(dest="command")
 
+
+def add_incremental_arguments(parser, dataset: str):
+    parser.add_argument(
+        "--since-previous",
+        help=f"Previous {dataset} file to update with the blocks after the one "
+        "it was computed at",
+    )
+    parser.add_argument(
+        "--block",
+        type=int,
+        help="Block to compute the dataset at (default: snapshot block of the event)",
+    )
+
+
 fetch_addresses_parser = subparsers.add_parser(
     "fetch-addresses", help="Fetch all veCRV holders ever"
 )
 fetch_addresses_parser.add_argument("-o", "--output", help="Output file", required=True)
+add_incremental_arguments(fetch_addresses_parser, "addresses")
+add_rpc_arguments(fetch_addresses_parser)
+add_scan_arguments(fetch_addresses_parser)
+add_checkpoint_argument(fetch_addresses_parser)
 
 fetch_balances_parser = subparsers.add_parser(
     "fetch-balances", help="Fetch balances of veCRV holders at snapshot block"
 )
 fetch_balances_parser.add_argument(
-    "inputs", nargs="+", help="Input file(s) generated by fetch-addresses"
+    "inputs",
+    nargs="*",
+    help="Input file(s) generated by fetch-addresses, optional with --since-previous",
 )
-fetch_balances_parser.add_argument("-o", "--output", help="Output file", required=True)
-
-
-def get_w3():
-    return Web3(HTTPProvider(os.environ["ETH_RPC_URL"]))
-
-
-def get_vecrv(w3: Optional[Web3] = None) -> Contract:
-    if w3 is None:
-        w3 = get_w3()
-    with open(
-        path.join(path.dirname(path.dirname(__file__)), "abis", "vecrv.abi.json")
-    ) as f:
-        abi = json.load(f)
-    return w3.eth.contract(address=VECRV_ADDRESS, abi=abi)
+fetch_balances_parser.add_argument(
+    "-o",
+    "--output",
+    help="Output file, in the columnar format if it ends with .snap",
+    required=True,
+)
+add_incremental_arguments(fetch_balances_parser, "balances")
+balances_engine.add_fetch_arguments(fetch_balances_parser)
+add_scan_arguments(fetch_balances_parser)
+add_checkpoint_argument(fetch_balances_parser)
 
 
 def get_start_block(event_type):
@@ -76,66 +107,149 @@ def get_snapshot_block(event_type):
         raise ValueError(f"Unknown event type: {event_type}")
 
 
-def _fetch_addresses(ve_crv, start_block, end_block, chunk_size=10_000):
-    unique_accounts = set()
-    for block in tqdm(range(start_block, end_block, chunk_size)):
-        to_block = min(block + chunk_size, end_block)
-        entries = ve_crv.events.Deposit.getLogs(fromBlock=block, toBlock=to_block)
-        unique_accounts.update(e["args"]["provider"] for e in entries)
-    return unique_accounts
-
+async def _fetch_addresses(start_block, end_block, args):
+    event_abi = get_event_abi(load_abi("vecrv.abi.json"), "Deposit")
+    async with BatchRPCClient(
+        os.environ["ETH_RPC_URL"],
+        concurrency=args.concurrency,
+        rate_limit=args.rate_limit,
+    ) as client:
+        namespace = f"addresses:Deposit:{start_block}"
+        with CheckpointStore(args.checkpoint, namespace) as checkpoint:
+            return await scan_event_values(
+                client,
+                VECRV_ADDRESS,
+                event_abi,
+                "provider",
+                start_block,
+                end_block,
+                checkpoint,
+                window=args.window,
+                concurrency=args.concurrency,
+            )
+
+
+def get_block_range(args) -> Tuple[int, int]:
+    """Blocks to scan, starting after the previous dataset if one is given"""
+    end_block = args.block or get_snapshot_block(args.type)
+    if args.since_previous:
+        start_block = read_snapshot_metadata(args.since_previous)["block"] + 1
+    else:
+        start_block = get_start_block(args.type)
+    if start_block > end_block:
+        parser.error(f"nothing to update, the dataset is already at block {end_block}")
+    return start_block, end_block
 
-def fetch_addresses(args):
-    ve_crv = get_vecrv()
 
-    start_block = get_start_block(args.type)
-    end_block = get_snapshot_block(args.type)
-    unique_addresses = _fetch_addresses(ve_crv, start_block, end_block)
+def read_addresses(input_files: Iterable[str]) -> Set[str]:
+    addresses = set()
+    for input_file in input_files:
+        with profiling.open_gzip(input_file, "rt") as f:
+            addresses |= {line.strip() for line in f}
+    return addresses
 
-    with gzip.open(args.output, "wt") as f:
-        for account in unique_addresses:
-            print(account, file=f)
 
-    print(f"found {len(unique_addresses)} unique addresses")
+def fetch_addresses(args):
+    start_block, end_block = get_block_range(args)
+    previous_addresses = set()
+    if args.since_previous:
+        previous_addresses = read_addresses([args.since_previous])
+    new_addresses = asyncio.run(_fetch_addresses(start_block, end_block, args))
+    unique_addresses = previous_addresses | new_addresses
+
+    with profiling.stage("write"):
+        with gzip.open(args.output, "wt") as f:
+            for account in unique_addresses:
+                print(account, file=f)
+        write_snapshot_metadata(args.output, {"block": end_block})
+
+    print(
+        f"found {len(unique_addresses)} unique addresses, "
+        f"{len(new_addresses - previous_addresses)} new"
+    )
+
+
+def get_addresses_to_refresh(
+    previous_balances: List[dict], changed_addresses: Set[str]
+) -> Set[str]:
+    """Addresses whose balance may differ from `previous_balances`
+    veCRV balances only increase through `Deposit` events and decay over time
+    otherwise, so only the addresses with new events and the ones with a
+    positive balance need to be queried again. Addresses absent from
+    `previous_balances` were under the cutoff and can only go above it
+    through a new event
+    """
+    positive_addresses = {
+        balance["address"]
+        for balance in previous_balances
+        if int(balance["balance"]) > 0
+    }
+    return changed_addresses | positive_addresses
+
+
+def merge_balances(
+    previous_balances: List[dict], refreshed_addresses: Set[str], balances: List[dict]
+) -> List[dict]:
+    merged = {
+        balance["address"]: balance
+        for balance in previous_balances
+        if balance["address"] not in refreshed_addresses
+    }
+    merged.update((balance["address"], balance) for balance in balances)
+    return list(merged.values())
 
 
 def fetch_balances(args):
-    w3 = get_w3()
-    locker = get_vecrv(w3)
-
-    addresses = set()
-    for input_file in args.inputs:
-        with gzip.open(input_file, "rt") as f:
-            addresses |= {line.strip() for line in f}
-
-    snapshot_block = get_snapshot_block(args.type)
-
-    balances = []
-    eoa_count = 0
-    for address in tqdm(addresses):
-        balance = locker.functions.balanceOf(address).call(
-            block_identifier=snapshot_block
+    if not args.inputs and not args.since_previous:
+        parser.error("fetch-balances needs input files or --since-previous")
+    with profiling.stage("read-addresses"):
+        addresses = read_addresses(args.inputs)
+
+    start_block, snapshot_block = get_block_range(args)
+    previous_balances = []
+    if args.since_previous:
+        previous_balances = load_snapshot(args.since_previous)
+        changed_addresses = asyncio.run(
+            _fetch_addresses(start_block, snapshot_block, args)
+        )
+        addresses |= get_addresses_to_refresh(previous_balances, changed_addresses)
+        print(f"{len(changed_addresses)} addresses with new events")
+
+    min_balance = int(CUT_OFF) if args.type == "initial-distribution" else None
+
+    namespace = f"balances:{snapshot_block}:{min_balance}"
+    with CheckpointStore(args.checkpoint, namespace) as checkpoint:
+        balances = balances_engine.fetch_balances(
+            os.environ["ETH_RPC_URL"],
+            [SnapshotContract(VECRV_ADDRESS, "vecrv.abi.json")],
+            list(addresses),
+            snapshot_block,
+            min_balance=min_balance,
+            checkpoint=checkpoint,
+            concurrency=args.concurrency,
+            batch_size=args.batch_size,
+            rate_limit=args.rate_limit,
+            calls_per_aggregate=args.calls_per_multicall,
         )
-        if args.type == "initial-distribution" and balance < CUT_OFF:
-            continue
-        is_eoa = len(w3.eth.get_code(address)) == 0
-        eoa_count += is_eoa
-        balances.append({"address": address, "balance": str(balance), "is_eoa": is_eoa})
+    balances = merge_balances(previous_balances, addresses, balances)
 
-    with gzip.open(args.output, "wt") as f:
-        json.dump(balances, f)
+    with profiling.stage("write"):
+        write_snapshot(balances, args.output)
+        write_snapshot_metadata(args.output, {"block": snapshot_block})
 
-    print(f"found {len(balances)} eligible accounts")
+    print(f"found {len(balances)} eligible accounts, {len(addresses)} queried")
 
 
 def main():
     args = parser.parse_args()
-    if args.command == "fetch-addresses":
-        fetch_addresses(args)
-    elif args.command == "fetch-balances":
-        fetch_balances(args)
-    else:
-        parser.error("no command given")
+    with profiling.profile_command(args, f"vecrv {args.command}"):
+        if args.command == "fetch-addresses":
+            fetch_addresses(args)
+        elif args.command == "fetch-balances":
+            fetch_balances(args)
+        else:
+            parser.error("no command given")
+        report_response_cache()
 
 
 if __name__ == "__main__":
@@ -7,8 +7,10 @@ setup(
     packages=find_packages(),
     install_requires=[
         "web3",
+        "aiohttp",
         "tqdm",
         "matplotlib",
+        "numpy",
     ],
     entry_points={
         "console_scripts": ["conicfinance=conicfinance.cli:main"],